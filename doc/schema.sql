@@ -35,6 +35,7 @@ CREATE TABLE jobstart (
 
 CREATE INDEX jobstart_jobid ON jobstart (jobid);
 CREATE INDEX jobstart_datetime ON jobstart (datetime);
+CREATE INDEX jobstart_jobid_datetime ON jobstart (jobid, datetime);
 
 CREATE TABLE jobfinish (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -42,6 +43,8 @@ CREATE TABLE jobfinish (
     command VARCHAR(255) NOT NULL,
     datetime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     status INTEGER NOT NULL,
+    startid INTEGER DEFAULT NULL,
+    duration INTEGER DEFAULT NULL,
 
     FOREIGN KEY (jobid) REFERENCES job(id)
         ON DELETE RESTRICT ON UPDATE RESTRICT
@@ -51,6 +54,7 @@ CREATE TABLE jobfinish (
 
 CREATE INDEX jobfinish_jobid ON jobfinish (jobid);
 CREATE INDEX jobfinish_datetime ON jobfinish (datetime);
+CREATE INDEX jobfinish_jobid_datetime ON jobfinish (jobid, datetime);
 
 CREATE TABLE jobalarm (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -134,3 +138,64 @@ CREATE TABLE rawcrontab (
 
 CREATE INDEX rawcrontab_host ON rawcrontab (host);
 CREATE INDEX rawcrontab_user ON rawcrontab (user);
+
+CREATE TABLE lease (
+    name VARCHAR(80) NOT NULL PRIMARY KEY,
+    holder VARCHAR(255) NOT NULL,
+    expires TIMESTAMP NOT NULL
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE TABLE joblive (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    stdout TEXT NOT NULL,
+    stderr TEXT NOT NULL,
+
+    FOREIGN KEY (jobid) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE INDEX joblive_jobid ON joblive (jobid);
+
+CREATE TABLE jobstats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    day DATE NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 0,
+    success INTEGER NOT NULL DEFAULT 0,
+    warning INTEGER NOT NULL DEFAULT 0,
+    fail INTEGER NOT NULL DEFAULT 0,
+    late INTEGER NOT NULL DEFAULT 0,
+    missed INTEGER NOT NULL DEFAULT 0,
+    timeout INTEGER NOT NULL DEFAULT 0,
+    duration_count INTEGER NOT NULL DEFAULT 0,
+    duration_total INTEGER NOT NULL DEFAULT 0,
+    duration_min INTEGER DEFAULT NULL,
+    duration_max INTEGER DEFAULT NULL,
+
+    UNIQUE (jobid, day),
+    FOREIGN KEY (jobid) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE INDEX jobstats_day ON jobstats (day);
+
+CREATE TABLE jobhistogram (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    day DATE NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+
+    UNIQUE (jobid, day, bucket),
+    FOREIGN KEY (jobid) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+)
+-- MySQL: ENGINE=InnoDB
+;
@@ -14,27 +14,28 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from codecs import latin_1_encode, latin_1_decode
-# ConfigParser renamed in Python 3
+# ConfigParser renamed in Python 3 (where SafeConfigParser is deprecated)
 try:
-    from configparser import SafeConfigParser
+    from configparser import ConfigParser
 except:
-    from ConfigParser import SafeConfigParser
+    from ConfigParser import SafeConfigParser as ConfigParser
 # Workaround lack of JSON in Python 2.4
 try:
     import json
 except ImportError:
     import simplejson as json
 import os
-import pwd
 import re
+import select
 import socket
 import sys
+from threading import Event, Lock, Thread
+import time
 # urllib.quote moved into urllib.parse.quote in Python 3
 try:
     from urllib.parse import quote as urlquote
 except:
     from urllib import quote as urlquote
-import urllib
 # httplib renamed in Python 3
 try:
     from http.client import HTTPConnection, HTTPException
@@ -42,6 +43,24 @@ except:
     from httplib import HTTPConnection, HTTPException
 
 from crab import CrabError, CrabStatus
+from crab.util.spool import CrabSpool
+from crab.util.cache import read_cache, write_cache
+from crab.util.compress import \
+    choose_encoding, compress, decompress, get_compressor, parse_encodings
+
+COMPRESS_MIN_SIZE = 1024
+IDENTITY_CACHE_TIME = 86400
+
+SPOOL_BATCH_EVENTS = 500
+SPOOL_BATCH_SIZE = 4 * 1024 * 1024
+
+
+class CrabNotSentError(CrabError):
+    """Error raised when a request could not be sent to the server.
+
+    The server can not have acted on such a request, so it is safe
+    to send it again later."""
+    pass
 
 
 class CrabClient:
@@ -62,13 +81,25 @@ class CrabClient:
         self.command = command
         self.crabid = crabid
 
-        self.config = SafeConfigParser()
+        # A single HTTP connection is kept open and reused for all of
+        # this client's requests.  The lock allows the client to be
+        # shared with a CrabLiveOutput thread.
+        self._conn = None
+        self._conn_lock = Lock()
+
+        # Encoding with which to compress request bodies: this is set
+        # when the server indicates which encodings it accepts.
+        self._encoding = None
+
+        self.config = ConfigParser()
         self.config.add_section('server')
         self.config.set('server', 'host', 'localhost')
         self.config.set('server', 'port', '8000')
         self.config.set('server', 'timeout', '30')
         self.config.add_section('client')
         self.config.set('client', 'use_fqdn', 'false')
+        self.config.set('client', 'spool_timeout', '5')
+        self.config.set('client', 'spool_max_age', '7')
 
         env = os.environ
 
@@ -76,9 +107,10 @@ class CrabClient:
         sysconfdir = env.get('CRABSYSCONFIG', '/etc/crab')
         userconfdir = env.get('CRABUSERCONFIG', os.path.expanduser('~/.crab'))
 
-        self.configfiles = self.config.read([
-            os.path.join(sysconfdir, 'crab.ini'),
-            os.path.join(userconfdir, 'crab.ini')])
+        configfiles = [os.path.join(sysconfdir, 'crab.ini'),
+                       os.path.join(userconfdir, 'crab.ini')]
+
+        self.configfiles = self.config.read(configfiles)
 
         # Override configuration as specified by environment variables.
         if 'CRABHOST' in env:
@@ -94,35 +126,283 @@ class CrabClient:
         # been determined.  This avoids the need to perform these operations
         # if the value is already known and would allow the way in which this
         # is done to be customized based on other values.
-        if not self.config.has_option('client', 'hostname'):
-            if self.config.getboolean('client', 'use_fqdn'):
-                self.config.set('client', 'hostname', socket.getfqdn())
-            else:
-                self.config.set('client', 'hostname',
-                                socket.gethostname().split('.', 1)[0])
+        if not (self.config.has_option('client', 'hostname') and
+                self.config.has_option('client', 'username')):
+            identity = self._get_identity(configfiles)
+
+            for option in ('hostname', 'username'):
+                if not self.config.has_option('client', option):
+                    self.config.set('client', option, identity[option])
+
+        self.timeout = int(self.config.get('server', 'timeout'))
 
-        if not self.config.has_option('client', 'username'):
-            self.config.set('client', 'username', pwd.getpwuid(os.getuid())[0])
+        # If a spool directory is configured, events which can not be sent
+        # to the server can be kept there to be sent later.
+        self.spool = None
+        if self.config.has_option('client', 'spool_dir'):
+            self.spool = CrabSpool(os.path.expanduser(
+                self.config.get('client', 'spool_dir')))
 
-    def start(self):
+    def start(self, timestamp=None):
         """Notify the server that the job is starting.
 
         Return the decoded server response, which may include
-        an inhibit dictionary item."""
+        an inhibit dictionary item.
+
+        If a timestamp (as returned by time.time) is given, it is sent
+        as the time at which the job started."""
 
         return self._write_json(self._get_url('start'),
-                                {'command': self.command},
+                                self._event_data(timestamp=timestamp),
                                 read=True)
 
     def finish(self, status=CrabStatus.UNKNOWN,
-               stdoutdata='', stderrdata=''):
+               stdoutdata='', stderrdata='', timestamp=None):
         """Notify the server that the job is finishing."""
 
         self._write_json(self._get_url('finish'),
+                         self._event_data(timestamp=timestamp,
+                                          status=status,
+                                          stdout=stdoutdata,
+                                          stderr=stderrdata))
+
+    def finish_stream(self, status=CrabStatus.UNKNOWN,
+                      stdoutchunks=(), stderrchunks=()):
+        """Notify the server that the job is finishing, sending the output
+        in a series of chunks.
+
+        The output is given as iterables of byte strings, such as
+        CrabOutputCapture objects, so that it need not all be held in
+        memory at once.  They may be iterated over a second time:
+        if the server does not support this action, the output is
+        combined and sent using the regular finish action."""
+
+        url = self._get_url('finish_stream')
+        encoding = self._encoding
+
+        def send_request(conn):
+            conn.putrequest('PUT', url, skip_accept_encoding=True)
+            conn.putheader('Accept-Encoding', 'gzip')
+            conn.putheader('Content-Type', 'application/x-ndjson')
+            conn.putheader('Transfer-Encoding', 'chunked')
+
+            compressor = None
+            if encoding is not None:
+                conn.putheader('Content-Encoding', encoding)
+                compressor = get_compressor(encoding)
+
+            conn.endheaders()
+
+            self._send_json_chunk(conn, {'command': self.command,
+                                         'status': status}, compressor)
+
+            for (key, chunks) in (('stdout', stdoutchunks),
+                                  ('stderr', stderrchunks)):
+                for chunk in chunks:
+                    self._send_json_chunk(
+                        conn, {key: latin_1_decode(chunk, 'replace')[0]},
+                        compressor)
+
+            if compressor is not None:
+                self._send_chunk(conn, compressor.flush())
+
+            conn.send(b'0\r\n\r\n')
+
+        (status_code, reason, body) = self._request(send_request)
+
+        if status_code == 415 and encoding is not None:
+            # The server no longer accepts this encoding: send the
+            # output again without compression.
+            self._encoding = None
+            return self.finish_stream(status, stdoutchunks, stderrchunks)
+
+        if status_code == 404:
+            return self.finish(
+                status,
+                latin_1_decode(b''.join(stdoutchunks), 'replace')[0],
+                latin_1_decode(b''.join(stderrchunks), 'replace')[0])
+
+        if status_code != 200:
+            raise CrabError('server error: ' + self._read_error(reason, body))
+
+    def output(self, stdoutdata='', stderrdata=''):
+        """Send output from the job while it is still running.
+
+        The server appends this to the live output of the job, which
+        is shown on the job's page until the job finishes."""
+
+        self._write_json(self._get_url('output'),
                          {'command': self.command,
-                          'status':   status,
-                          'stdout':   stdoutdata,
-                          'stderr':   stderrdata})
+                          'stdout':  stdoutdata,
+                          'stderr':  stderrdata})
+
+    def spool_event(self, action, status=None,
+                    stdoutdata='', stderrdata='', timestamp=None):
+        """Adds a start or finish event to the spool, to be sent to the
+        server later by flush_spool.
+
+        The event records the time at which it occurred (the current time
+        unless a timestamp is given) so that the server can log it
+        correctly when it is eventually sent."""
+
+        if self.spool is None:
+            raise CrabError('no spool directory configured')
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        record = {'action': action,
+                  'host': self.config.get('client', 'hostname'),
+                  'user': self.config.get('client', 'username'),
+                  'crabid': self.crabid,
+                  'command': self.command,
+                  'datetime': self._format_timestamp(timestamp)}
+
+        if action == 'finish':
+            record.update(status=status, stdout=stdoutdata, stderr=stderrdata)
+
+        self.spool.add(record)
+
+    def spool_pending(self):
+        """Determines whether there are events waiting in the spool."""
+
+        return self.spool is not None and bool(self.spool.entries())
+
+    def flush_spool(self, callback=None):
+        """Sends the spooled events to the server, in the order in
+        which they occurred.
+
+        The events are sent in batches using send_events.  Events older
+        than the client's spool_max_age (in days) are discarded, as are
+        events which the server rejects as invalid.  If a batch can not
+        be sent, it and the remaining events are left in the spool and
+        the error is raised as a CrabError.  If only part of a batch is
+        sent (see send_events), the events which were sent are removed
+        and the rest are left in the spool.
+
+        Only one process sends the events at a time: if another process
+        is already doing so, this method returns without sending any.
+
+        If a callback function is given, it is called with each event
+        which has been sent and the server's result.
+
+        Returns the number of events sent."""
+
+        if self.spool is None:
+            return 0
+
+        lock = self.spool.lock()
+        if lock is None:
+            # Another process is already sending the events.
+            return 0
+
+        max_age = 86400 * float(self.config.get('client', 'spool_max_age'))
+        sent = 0
+
+        try:
+            names = []
+            events = []
+            size = 0
+
+            for name in self.spool.entries() + [None]:
+                if name is not None:
+                    if self.spool.age(name) > max_age:
+                        self.spool.remove(name)
+                        continue
+
+                    names.append(name)
+                    events.append(self.spool.read(name))
+                    size += self.spool.size(name)
+
+                    if (len(events) < SPOOL_BATCH_EVENTS and
+                            size < SPOOL_BATCH_SIZE):
+                        continue
+
+                if not events:
+                    break
+
+                results = self.send_events(events)
+
+                for (name, event, result) in zip(names, events, results):
+                    self.spool.remove(name)
+                    if 'error' not in result:
+                        sent += 1
+                    if callback is not None:
+                        callback(event, result)
+
+                if len(results) < len(events):
+                    # Not all of the batch was sent: leave the remaining
+                    # events to be retried later.
+                    break
+
+                names = []
+                events = []
+                size = 0
+
+        finally:
+            lock.close()
+
+        return sent
+
+    def send_events(self, events):
+        """Sends a batch of job start and finish events to the server.
+
+        Each event is a dictionary, in the form in which events are
+        spooled, including the "action" and the "host", "user" and "crabid"
+        of the job.  Returns a list of the server's results for each event,
+        which include an "error" message for events which it rejected.
+
+        If the server does not support batches of events, they are sent
+        individually instead.  In this case sending stops at the first
+        event which can not be sent, and only the results for the events
+        sent before it are returned.  (The error is raised if there
+        are none.)"""
+
+        (status, reason, body) = self._put(
+            '/api/0/events', json.dumps(events), 'application/json')
+
+        if status == 404:
+            results = []
+
+            for event in events:
+                try:
+                    results.append(self._send_event(event))
+                except CrabError:
+                    if not results:
+                        raise
+                    break
+
+            return results
+
+        if status != 200:
+            raise CrabError('server error: ' + self._read_error(reason, body))
+
+        try:
+            results = json.loads(latin_1_decode(body, 'replace')[0])['results']
+
+        # except (ValueError, KeyError, TypeError) as err:
+        except (ValueError, KeyError, TypeError):
+            err = sys.exc_info()[1]
+            raise CrabError('did not understand response: ' + str(err))
+
+        if len(results) != len(events):
+            raise CrabError('did not receive a result for each event')
+
+        return results
+
+    def _send_event(self, event):
+        """Sends a single event, as given to send_events, using the
+        corresponding start or finish action."""
+
+        data = dict((key, event[key]) for key in (
+            'command', 'datetime', 'status', 'stdout', 'stderr')
+            if key in event)
+
+        return self._write_json(self._make_url(event['action'],
+                                               event['host'],
+                                               event['user'],
+                                               event['crabid']),
+                                data, read=True) or {}
 
     def send_crontab(self, crontab, timezone=None):
         """Takes the crontab as a string, breaks it into lines,
@@ -160,18 +440,79 @@ class CrabClient:
         info.append('Files: ' + ', '.join(self.configfiles))
         return '\n'.join(info)
 
+    def _get_identity(self, configfiles):
+        """Determines the default hostname and username for the client.
+
+        Since finding the fully-qualified domain name may require a DNS
+        lookup, and finding the username may involve a directory service,
+        the results are cached in a file.  This is used for up to a day,
+        provided that the configuration files have not been modified."""
+
+        key = [os.getuid(), socket.gethostname()]
+        for configfile in configfiles:
+            try:
+                key.append(os.path.getmtime(configfile))
+            except OSError:
+                key.append(None)
+
+        identity = read_cache('identity.json', key)
+
+        if (identity is not None and
+                time.time() - identity.get('time', 0) < IDENTITY_CACHE_TIME):
+            return identity
+
+        import pwd
+
+        if self.config.getboolean('client', 'use_fqdn'):
+            hostname = socket.getfqdn()
+        else:
+            hostname = key[1].split('.', 1)[0]
+
+        identity = {'time': time.time(),
+                    'hostname': hostname,
+                    'username': pwd.getpwuid(key[0])[0]}
+
+        write_cache('identity.json', key, identity)
+
+        return identity
+
     def _get_url(self, action):
         """Creates the URL to be used to perform the given server action."""
 
+        return self._make_url(action,
+                              self.config.get('client', 'hostname'),
+                              self.config.get('client', 'username'),
+                              self.crabid)
+
+    def _make_url(self, action, hostname, username, crabid=None):
+        """Creates the URL for a server action for the given job."""
+
         url = ('/api/0/' + action +
-               '/' + urlquote(self.config.get('client', 'hostname'), '') +
-               '/' + urlquote(self.config.get('client', 'username'), ''))
+               '/' + urlquote(hostname, '') +
+               '/' + urlquote(username, ''))
 
-        if self.crabid is not None:
-            url = url + '/' + urlquote(self.crabid, '')
+        if crabid is not None:
+            url = url + '/' + urlquote(crabid, '')
 
         return url
 
+    def _event_data(self, timestamp=None, **kwargs):
+        """Prepares the data to send for a job event."""
+
+        data = {'command': self.command}
+        data.update(kwargs)
+
+        if timestamp is not None:
+            data['datetime'] = self._format_timestamp(timestamp)
+
+        return data
+
+    def _format_timestamp(self, timestamp):
+        """Formats a timestamp (as returned by time.time) in UTC
+        in the format expected by the server."""
+
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+
     def _get_conn(self):
         """Opens an HTTP connection to the configured server."""
 
@@ -182,102 +523,233 @@ class CrabClient:
         try:
             return HTTPConnection(self.config.get('server', 'host'),
                                   self.config.get('server', 'port'),
-                                  timeout=int(self.config.get(
-                                                  'server', 'timeout')))
+                                  timeout=self.timeout)
         except TypeError:
             return HTTPConnection(self.config.get('server', 'host'),
                                   self.config.get('server', 'port'))
 
+    def _request(self, send_request):
+        """Performs an HTTP request using the client's persistent
+        connection.
+
+        The given function is called with the connection, and should send
+        the request.  The response is then read in full, so that the
+        connection can be used again, and returned as a tuple of
+        status code, reason phrase and body.
+
+        The connection is opened if necessary.  A connection which the
+        server has closed while idle is discarded before use.  If sending
+        the request on a connection which has been used before fails,
+        the request is retried once with a new connection.  (The
+        send_request function may therefore be called twice.)  Requests
+        are not retried once sent, since the server may have acted on them.
+        Errors are raised as CrabError exceptions, or CrabNotSentError
+        if the request was not completely sent."""
+
+        with self._conn_lock:
+            while True:
+                if self._conn is not None and self._conn_dropped():
+                    self._close_conn()
+
+                reused = self._conn is not None
+                if not reused:
+                    self._conn = self._get_conn()
+
+                sent = False
+
+                try:
+                    try:
+                        send_request(self._conn)
+                        sent = True
+                        res = self._conn.getresponse()
+                        body = res.read()
+
+                        if res.will_close:
+                            self._close_conn()
+
+                        accepted = res.getheader('Accept-Encoding')
+                        if accepted is not None:
+                            self._encoding = choose_encoding(
+                                parse_encodings(accepted))
+
+                        content_encoding = res.getheader('Content-Encoding')
+                        if content_encoding:
+                            body = decompress(body, content_encoding.lower())
+
+                        return (res.status, res.reason, body)
+
+                    except:
+                        self._close_conn()
+                        raise
+
+                # except HTTPException as err:
+                except HTTPException:
+                    err = sys.exc_info()[1]
+                    if not sent:
+                        if reused:
+                            continue
+                        raise CrabNotSentError('HTTP error: ' + str(err))
+                    raise CrabError('HTTP error: ' + str(err))
+
+                # except socket.error as err:
+                except socket.error:
+                    err = sys.exc_info()[1]
+                    # Do not retry after a timeout, as the server may
+                    # still be processing the request.
+                    if not sent:
+                        if reused and not isinstance(err, socket.timeout):
+                            continue
+                        raise CrabNotSentError('socket error: ' + str(err))
+                    raise CrabError('socket error: ' + str(err))
+
+    def _conn_dropped(self):
+        """Determines whether the persistent connection appears to
+        have been closed by the server.
+
+        The connection is idle, so if its socket is readable, the server
+        must have closed it (or sent something unexpected)."""
+
+        sock = self._conn.sock
+        if sock is None:
+            return False
+
+        try:
+            (readable, writable, errored) = select.select([sock], [], [], 0)
+        except (select.error, ValueError):
+            return True
+
+        return bool(readable)
+
+    def _close_conn(self):
+        """Closes the persistent connection, if open."""
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def close(self):
+        """Closes the client's connection to the server.
+
+        This is not required, but releases the connection sooner than
+        waiting for it to be closed when the client is discarded.  A new
+        connection will be opened if the client is used again."""
+
+        with self._conn_lock:
+            self._close_conn()
+
     def _read_json(self, url):
         """Performs an HTTP GET on the given URL and interprets the
         response as JSON."""
 
+        (status, reason, body) = self._request(
+            lambda conn: conn.request('GET', url,
+                                      headers={'Accept-Encoding': 'gzip'}))
+
+        if status != 200:
+            raise CrabError('server error: ' + self._read_error(reason, body))
+
         try:
-            try:
-                conn = self._get_conn()
-                conn.request('GET', url)
+            return json.loads(latin_1_decode(body, 'replace')[0])
 
-                res = conn.getresponse()
+        # except ValueError as err:
+        except ValueError:
+            err = sys.exc_info()[1]
+            raise CrabError('did not understand response: ' + str(err))
+
+    def _write_json(self, url, obj, read=False):
+        """Converts the given object to JSON and sends it with an
+        HTTP PUT to the given URL.
 
-                if res.status != 200:
-                    raise CrabError('server error: ' + self._read_error(res))
+        Optionally attempts to read JSON from the response."""
 
-                return json.loads(latin_1_decode(res.read(), 'replace')[0])
+        (status, reason, body) = self._put(url, json.dumps(obj))
 
-            # except HTTPException as err:
-            except HTTPException:
-                err = sys.exc_info()[1]
-                raise CrabError('HTTP error: ' + str(err))
+        if status != 200:
+            raise CrabError('server error: ' + self._read_error(reason, body))
 
-            # except socket.error as err:
-            except socket.error:
-                err = sys.exc_info()[1]
-                raise CrabError('socket error: ' + str(err))
+        if read:
+            response = latin_1_decode(body, 'replace')[0]
+
+            # Check we got a response before attempting to decode
+            # it as JSON.  (Some messages did not have responses
+            # for previous server versions.)
+            if not response:
+                return {}
+
+            try:
+                return json.loads(response)
 
             # except ValueError as err:
             except ValueError:
                 err = sys.exc_info()[1]
                 raise CrabError('did not understand response: ' + str(err))
 
-        finally:
-            conn.close()
+    def _put(self, url, message, content_type=None):
+        """Sends the given message (a string) with an HTTP PUT to the
+        given URL, returning the status code, reason phrase and body
+        of the response.
 
-    def _write_json(self, url, obj, read=False):
-        """Converts the given object to JSON and sends it with an
-        HTTP PUT to the given URL.
+        The message is compressed if it is not small and the server has
+        indicated that it accepts a suitable encoding."""
 
-        Optionally attempts to read JSON from the response."""
+        data = latin_1_encode(message)[0]
+        headers = {'Accept-Encoding': 'gzip'}
+        if content_type is not None:
+            headers['Content-Type'] = content_type
 
-        try:
-            try:
-                conn = self._get_conn()
-                conn.request('PUT', url, json.dumps(obj))
+        encoding = self._encoding
+        if encoding is not None and len(data) >= COMPRESS_MIN_SIZE:
+            headers['Content-Encoding'] = encoding
+            compressed = compress(data, encoding)
+        else:
+            encoding = None
+            compressed = data
 
-                res = conn.getresponse()
+        (status, reason, body) = self._request(
+            lambda conn: conn.request('PUT', url, compressed, headers))
 
-                if res.status != 200:
-                    raise CrabError('server error: ' + self._read_error(res))
+        if status == 415 and encoding is not None:
+            # The server no longer accepts this encoding: send the
+            # message again without compression.
+            self._encoding = None
+            del headers['Content-Encoding']
 
-                if read:
-                    response = latin_1_decode(res.read(), 'replace')[0]
+            (status, reason, body) = self._request(
+                lambda conn: conn.request('PUT', url, data, headers))
 
-                    # Check we got a response before attempting to decode
-                    # it as JSON.  (Some messages did not have responses
-                    # for previous server versions.)
-                    if response:
-                        return json.loads(response)
-                    else:
-                        return {}
+        return (status, reason, body)
 
-            # except HTTPException as err:
-            except HTTPException:
-                err = sys.exc_info()[1]
-                raise CrabError('HTTP error: ' + str(err))
+    def _send_json_chunk(self, conn, obj, compressor=None):
+        """Sends the given object as a line of JSON, using HTTP
+        chunked transfer encoding, optionally passing it through
+        a compressor."""
 
-            # except socket.error as err:
-            except socket.error:
-                err = sys.exc_info()[1]
-                raise CrabError('socket error: ' + str(err))
+        data = latin_1_encode(json.dumps(obj) + '\n')[0]
 
-            # except ValueError as err:
-            except ValueError:
-                err = sys.exc_info()[1]
-                raise CrabError('did not understand response: ' + str(err))
+        if compressor is not None:
+            data = compressor.compress(data)
 
-        finally:
-            conn.close()
+        self._send_chunk(conn, data)
+
+    def _send_chunk(self, conn, data):
+        """Sends data using HTTP chunked transfer encoding."""
 
-    def _read_error(self, res):
+        # An empty chunk would mark the end of the body.
+        if data:
+            conn.send(latin_1_encode('%x\r\n' % len(data))[0] +
+                      data + b'\r\n')
+
+    def _read_error(self, reason, body):
         """Determine the error message to show based on an
         unsuccessful HTTP response.
 
         Currently use the HTTP status phrase or the first
         paragraph of the body, if found with a regular expression."""
 
-        message = res.reason
+        message = reason
 
         try:
-            body = latin_1_decode(res.read(), 'replace')[0]
+            body = latin_1_decode(body, 'replace')[0]
             match = re.search('<p>([^<]*)', body)
             if match:
                 message = match.group(1)
@@ -285,3 +757,113 @@ class CrabClient:
             pass
 
         return message
+
+
+class CrabLiveOutput(Thread):
+    """Thread which periodically sends the output of a running job
+    to the server.
+
+    Output is added with the write method and accumulates in a buffer
+    for each stream, which is sent at most every "interval" seconds.
+    If the server can not be contacted, the interval is increased, and
+    if output accumulates faster than it can be sent, the oldest output
+    beyond "max_pending" bytes is discarded.  The job being run is
+    therefore never held up by the upload."""
+
+    def __init__(self, client, interval=60, max_pending=256 * 1024):
+        Thread.__init__(self)
+        self.daemon = True
+
+        self.client = client
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self.lock = Lock()
+        self.stopped = Event()
+        self.pending = {'stdout': bytearray(), 'stderr': bytearray()}
+        self.dropped = {'stdout': 0, 'stderr': 0}
+
+    def write(self, key, data):
+        """Adds output (a byte string) for the given stream,
+        "stdout" or "stderr"."""
+
+        with self.lock:
+            self._add_pending(key, data)
+
+    def run(self):
+        """Thread run function.
+
+        Sends the pending output at regular intervals until stopped."""
+
+        delay = self.interval
+
+        while True:
+            self.stopped.wait(delay)
+            if self.stopped.is_set():
+                break
+
+            if self.flush():
+                delay = self.interval
+            else:
+                delay = min(2 * delay, 16 * self.interval)
+
+    def flush(self):
+        """Sends any pending output to the server.
+
+        Returns False if this failed, in which case the output
+        is retained to be sent again."""
+
+        data = {}
+
+        with self.lock:
+            for (key, buffer_) in self.pending.items():
+                if self.dropped[key]:
+                    buffer_[0:0] = latin_1_encode(
+                        '[... {0} bytes of output not sent ...]\n'.format(
+                            self.dropped[key]))[0]
+                    self.dropped[key] = 0
+
+                data[key] = bytes(buffer_)
+                del buffer_[:]
+
+        if not (data['stdout'] or data['stderr']):
+            return True
+
+        try:
+            self.client.output(latin_1_decode(data['stdout'], 'replace')[0],
+                               latin_1_decode(data['stderr'], 'replace')[0])
+
+        except CrabError:
+            # Return the output to the buffers, ahead of anything
+            # written in the meantime.
+            with self.lock:
+                for (key, value) in data.items():
+                    newer = bytes(self.pending[key])
+                    del self.pending[key][:]
+                    self._add_pending(key, value)
+                    self._add_pending(key, newer)
+
+            return False
+
+        return True
+
+    def stop(self):
+        """Stops the thread, waiting for any upload in progress to
+        finish.  Any remaining output is not sent."""
+
+        self.stopped.set()
+
+        if self.is_alive():
+            self.join()
+
+    def _add_pending(self, key, data):
+        """Adds output to a buffer, discarding the oldest output if
+        the buffer is full.  The lock must already have been acquired."""
+
+        buffer_ = self.pending[key]
+        buffer_.extend(data)
+
+        excess = len(buffer_) - self.max_pending
+        if excess > 0:
+            del buffer_[:excess]
+            self.dropped[key] += excess
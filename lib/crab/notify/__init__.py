@@ -16,6 +16,16 @@
 from __future__ import print_function
 
 from collections import namedtuple
+from contextlib import contextmanager
+from threading import Lock
+import time
+
+# Parallel report generation requires the concurrent.futures module
+# (Python 3.2+).
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 from crab.report import CrabReportGenerator, CrabReportJob
 from crab.notify.email import CrabNotifyEmail
@@ -23,38 +33,137 @@ from crab.notify.email import CrabNotifyEmail
 CrabNotifyJob = namedtuple('CrabNotifyJob', ['n', 'start', 'end'])
 
 
+class CrabNotifyTiming:
+    """Accumulates the time spent in each stage of sending notifications.
+
+    As the stages for different reports may run in parallel, the times
+    are totals for all of the threads."""
+
+    stages = ('group', 'fetch', 'report', 'render', 'send')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.total = dict((stage, 0.0) for stage in self.stages)
+
+    @contextmanager
+    def __call__(self, stage):
+        """Context manager which adds the time spent within it
+        to the total for the given stage."""
+
+        start = time.time()
+
+        try:
+            yield
+
+        finally:
+            with self.lock:
+                self.total[stage] += time.time() - start
+
+    def __str__(self):
+        return ', '.join('{0} {1:.2f}s'.format(stage, self.total[stage])
+                         for stage in self.stages)
+
+
 class CrabNotify:
     """Class for sending notification messages."""
 
-    def __init__(self, config, store):
+    def __init__(self, config, store, smtp=None):
+        """Constructor method.
+
+        If an SMTP service is given, it is used to deliver
+        email messages.  The number of threads used to prepare reports
+        is given by the "threads" parameter in the "notify" section
+        of the configuration, and the directory in which to keep the
+        compiled report template by "template_cache"."""
+
         self.store = store
+        self.threads = int(config['notify'].get('threads', 4))
 
-        self.send_email = CrabNotifyEmail(config['crab']['home'],
-                                          config['crab']['base_url'],
-                                          config['email'])
+        self.send_email = CrabNotifyEmail(
+            config['crab']['home'], config['crab']['base_url'],
+            config['email'], smtp,
+            config['notify'].get('template_cache'))
 
     def __call__(self, notifications):
-        "Sends notification messages."""
+        """Sends notification messages.
+
+        The data for all of the reports is fetched together, and then
+        each distinct report is generated and sent, with up to
+        the configured number of reports being prepared in parallel
+        (if the concurrent.futures module is available).
+        The rendered sections for each job are shared between the reports
+        sent by this call."""
 
+        start = time.time()
+        timing = CrabNotifyTiming()
         report = CrabReportGenerator(self.store)
 
-        for (jobs, keys) in self._group_notifications(notifications):
-            output = report(jobs)
-            if output is not None:
-                email = []
+        # Rendered job sections, shared by the threads preparing reports.
+        # (The report functions add entries to it with setdefault.)
+        cache = {}
+
+        with timing('group'):
+            groups = list(self._group_notifications(notifications))
+
+        with timing('fetch'):
+            report.prefetch(job for (jobs, keys) in groups for job in jobs)
+
+        threads = min(self.threads, len(groups))
+
+        if threads > 1 and ThreadPoolExecutor is not None:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                futures = [executor.submit(self._send_report, report,
+                                           jobs, keys, timing, cache)
+                           for (jobs, keys) in groups]
+
+            sent = sum(future.result() for future in futures)
+
+        else:
+            sent = sum(self._send_report(report, jobs, keys, timing, cache)
+                       for (jobs, keys) in groups)
+
+        if sent:
+            print('Notification: sent {0} reports in {1:.2f}s ({2})'.format(
+                sent, time.time() - start, timing))
+
+    def _send_report(self, report, jobs, keys, timing, cache):
+        """Generates a report on the given jobs and sends it to the
+        given (method, address, ...) keys.
+
+        Returns True if a report was sent."""
+
+        try:
+            with timing('report'):
+                output = report(jobs)
+
+            if output is None:
+                return False
+
+            email = []
+
+            for key in keys:
+                (method, address) = key[0:2]
+
+                if method == 'email':
+                    # In the case of email, we can build a list of
+                    # addresses and CC a single message to all of them.
+                    email.append(address)
+                else:
+                    print('Unknown notification method: ', method)
+
+            if email:
+                with timing('render'):
+                    message = self.send_email.render(output, email, cache)
+
+                with timing('send'):
+                    self.send_email.send(message, email)
 
-                for key in keys:
-                    (method, address) = key[0:2]
+                return True
 
-                    if method == 'email':
-                        # In the case of email, we can build a list of
-                        # addresses and CC a single message to all of them.
-                        email.append(address)
-                    else:
-                        print('Unknown notification method: ', method)
+        except Exception as e:
+            print('Error: could not send notification:', str(e))
 
-                if email:
-                    self.send_email(output, email)
+        return False
 
     def _group_notifications(self, notifications):
         """Constructs a list of notifications to be sent.
@@ -29,10 +29,15 @@ from crab.report.summary import report_to_summary
 class CrabNotifyEmail:
     """Class to send notification messages by email."""
 
-    def __init__(self, crab_home, base_url, config_email):
+    def __init__(self, crab_home, base_url, config_email, smtp=None,
+                 template_cache=None):
         """Construct a nofication object.
 
-        Stores relevant configuration information in the object."""
+        Stores relevant configuration information in the object.
+        If an SMTP service (such as a CrabSMTPService) is given, messages
+        are passed to it to be delivered in the background.  Otherwise
+        each message is sent directly.  If a template cache directory
+        is given, the compiled report template is kept there."""
 
         self.home = crab_home
         self.base_url = base_url
@@ -42,10 +47,21 @@ class CrabNotifyEmail:
         self.subject_ok = config_email['subject_ok']
         self.subject_warning = config_email['subject_warning']
         self.subject_error = config_email['subject_error']
+        self.smtp = smtp
+        self.template_cache = template_cache
 
     def __call__(self, report, to):
         """Sends a report by email to the given addresses."""
 
+        self.send(self.render(report, to), to)
+
+    def render(self, report, to, cache=None):
+        """Prepares an email message (as a string) containing the
+        report in text and HTML form.
+
+        The cache dictionary, if given, is used to reuse the rendered
+        sections for each job between reports."""
+
         if report.error:
             subject = self.subject_error
         elif report.warning:
@@ -61,10 +77,21 @@ class CrabNotifyEmail:
         message['From'] = self.from_
         message['To'] = ', '.join(to)
 
-        message.attach(MIMEText(report_to_text(report), 'plain'))
-        message.attach(MIMEText(report_to_html(report,
-                                self.home, self.base_url), 'html'))
+        message.attach(MIMEText(report_to_text(report, cache=cache),
+                                'plain'))
+        message.attach(MIMEText(report_to_html(
+            report, self.home, self.base_url, cache=cache,
+            module_directory=self.template_cache), 'html'))
+
+        return message.as_string()
+
+    def send(self, message, to):
+        """Sends a message prepared by the render method."""
+
+        if self.smtp is not None:
+            self.smtp.send(self.from_, to, message)
+            return
 
         smtp = SMTP(self.server)
-        smtp.sendmail(self.from_, to, message.as_string())
+        smtp.sendmail(self.from_, to, message)
         smtp.quit()
@@ -0,0 +1,237 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import heapq
+from itertools import count
+import os
+try:
+    from queue import Empty, Queue
+except ImportError:
+    from Queue import Empty, Queue
+from smtplib import SMTP, SMTPException, SMTPRecipientsRefused, \
+    SMTPResponseException, SMTPServerDisconnected
+from threading import Event, Lock, Thread
+import time
+
+from crab import CrabError
+from crab.util.spool import CrabSpool
+
+
+class CrabSMTPService(Thread):
+    """Service which delivers email messages in the background.
+
+    Messages are passed to a pool of worker threads, each of which
+    keeps its connection to the SMTP server open between messages,
+    closing it after a period without messages.  If a message can
+    not be delivered, it is retried after a delay which doubles
+    with each attempt.
+
+    If an "outbox" directory is configured, each message is kept there
+    until it has been delivered (or abandoned), so that messages which
+    have not been sent when the server is stopped are sent after it
+    is restarted."""
+
+    def __init__(self, config):
+        """Constructor method.
+
+        Takes the "email" section of the server configuration.
+        Any messages left in the outbox are queued for delivery."""
+
+        Thread.__init__(self)
+
+        self.server = config['server']
+        self.num_workers = int(config.get('workers', 2))
+        self.retries = int(config.get('retries', 5))
+        self.retry_delay = float(config.get('retry_delay', 60))
+        self.idle_timeout = float(config.get('idle_timeout', 60))
+        self.timeout = float(config.get('timeout', 60))
+
+        self.queue = Queue()
+        self.retry = []
+        self.sequence = count()
+        self.lock = Lock()
+        self.stopped = Event()
+        self.workers = []
+
+        self.outbox = None
+        outbox = config.get('outbox')
+
+        if outbox is not None:
+            self.outbox = CrabSpool(os.path.expanduser(outbox))
+
+            for name in self.outbox.entries():
+                try:
+                    self.queue.put((name, self.outbox.read(name), 0))
+                except CrabError as err:
+                    print('Error: could not read email from outbox:',
+                          str(err))
+
+    def send(self, from_, to, message):
+        """Queues a message (given as a string) for delivery to the
+        given list of addresses."""
+
+        record = {'from': from_, 'to': list(to), 'message': message}
+        name = None
+
+        if self.outbox is not None:
+            try:
+                name = self.outbox.add(record)
+            except CrabError as err:
+                print('Error: could not write email to outbox:', str(err))
+
+        self.queue.put((name, record, 0))
+
+    def run(self):
+        """Thread run function.
+
+        Starts the worker threads, and then passes messages which are
+        due to be retried back to them."""
+
+        for i in range(self.num_workers):
+            worker = CrabSMTPWorker(self)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        while not self.stopped.wait(1):
+            now = time.time()
+
+            with self.lock:
+                while self.retry and self.retry[0][0] <= now:
+                    (_, _, name, record, attempts) = heapq.heappop(
+                        self.retry)
+                    self.queue.put((name, record, attempts))
+
+    def stop(self):
+        """Stops the service and its worker threads, once they have
+        delivered the messages already in the queue."""
+
+        self.stopped.set()
+
+        for worker in self.workers:
+            self.queue.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        if self.is_alive():
+            self.join()
+
+    def delivered(self, name):
+        """Removes a message which has been delivered, or abandoned,
+        from the outbox."""
+
+        if name is not None and self.outbox is not None:
+            try:
+                self.outbox.remove(name)
+            except CrabError as err:
+                print('Error: could not remove email from outbox:', str(err))
+
+    def failed(self, name, record, attempts, err):
+        """Schedules a message which could not be delivered to be
+        retried, unless the error was permanent or it has already
+        been retried the configured number of times."""
+
+        if is_permanent_error(err) or attempts > self.retries:
+            print('Error: could not send email to',
+                  ', '.join(record['to']) + ':', str(err))
+            self.delivered(name)
+            return
+
+        delay = self.retry_delay * 2 ** (attempts - 1)
+
+        with self.lock:
+            heapq.heappush(self.retry, (time.time() + delay,
+                                        next(self.sequence),
+                                        name, record, attempts))
+
+
+class CrabSMTPWorker(Thread):
+    """Worker thread which delivers messages from the queue of
+    a CrabSMTPService."""
+
+    def __init__(self, service):
+        Thread.__init__(self)
+
+        self.service = service
+        self.smtp = None
+
+    def run(self):
+        """Thread run function."""
+
+        while True:
+            try:
+                item = self.service.queue.get(
+                    timeout=self.service.idle_timeout)
+            except Empty:
+                self._close()
+                continue
+
+            if item is None:
+                self._close()
+                break
+
+            (name, record, attempts) = item
+
+            try:
+                self._send(record)
+
+            except (SMTPException, IOError, OSError) as err:
+                self._close()
+                self.service.failed(name, record, attempts + 1, err)
+
+            else:
+                self.service.delivered(name)
+
+    def _send(self, record):
+        """Sends a message, using the open connection if there is one.
+
+        If the server has closed the connection, a new connection
+        is opened and the message is sent again."""
+
+        if self.smtp is not None:
+            try:
+                self.smtp.sendmail(record['from'], record['to'],
+                                   record['message'])
+                return
+
+            except SMTPServerDisconnected:
+                self.smtp = None
+
+        self.smtp = SMTP(self.service.server, timeout=self.service.timeout)
+        self.smtp.sendmail(record['from'], record['to'], record['message'])
+
+    def _close(self):
+        """Closes the connection to the SMTP server, if open."""
+
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (SMTPException, IOError, OSError):
+                pass
+
+            self.smtp = None
+
+
+def is_permanent_error(err):
+    """Determines whether an SMTP error indicates that a message
+    will never be accepted, so that it should not be retried."""
+
+    if isinstance(err, SMTPRecipientsRefused):
+        return all(code >= 500 for (code, _) in err.recipients.values())
+
+    return isinstance(err, SMTPResponseException) and err.smtp_code >= 500
@@ -28,13 +28,35 @@ CrabReport = namedtuple(
     ['num', 'error', 'warning', 'ok', 'info', 'events', 'stdout', 'stderr'])
 
 
+def report_fragment_key(report, id_):
+    """Determines a key identifying the content of the section of
+    a report for the given job.
+
+    This depends on the events included for the job, whether their
+    output is included, and whether the report includes output for
+    any job (which affects the layout).  It can be used to cache
+    rendered sections, which can then be reused for reports including
+    the same events."""
+
+    return (id_, bool(report.stdout), tuple(
+        (event['type'], event['eventid'], event['datetime'],
+         event['eventid'] in report.stdout)
+        for event in report.events[id_]))
+
+
 class CrabReportGenerator:
     """Class for generating reports on the operation of cron jobs.
 
     This class maintains a cache of job information and events
     to allow it to handle multiple report requests in an efficient
     manner.  This depends on a single configuration, so methods
-    for adjusting the filtering are not provided."""
+    for adjusting the filtering are not provided.
+
+    The information, events and output for the jobs are fetched
+    in bulk by the prefetch method, which can be given the jobs for
+    a number of reports before they are generated.  Reports on jobs
+    which have been prefetched only read the cache, so they can then be
+    generated in parallel."""
 
     def __init__(self, store, **kwargs):
         """Constructor for report object."""
@@ -69,49 +91,27 @@ class CrabReportGenerator:
         report_stdout = {}
         report_stderr = {}
 
+        self.prefetch(jobs)
+
         for job in jobs:
             if job in checked:
                 continue
             else:
                 checked.add(job)
 
-            (id_, start, end, skip_ok, skip_warning, skip_error,
-                include_output) = job
-
-            if id_ in self.cache_info:
-                info = self.cache_info[id_]
-            else:
-                info = self.store.get_job_info(id_)
-                if info is None:
-                    continue
-
-                if info['crabid'] is None:
-                    info['title'] = info['command']
-                else:
-                    info['title'] = info['crabid']
-
-                self.cache_info[id_] = info
+            id_ = job.id_
+            info = self.cache_info.get(id_)
+            if info is None:
+                continue
 
-            if job in self.cache_event:
-                events = self.cache_event[job]
-                num_errors = self.cache_error[job]
-                num_warnings = self.cache_warning[job]
-            else:
-                self.filter.set_timezone(info['timezone'])
-                events = self.cache_event[job] = self.filter(
-                             self.store.get_job_events(id_, limit=None,
-                                                       start=start, end=end),
-                             skip_ok=skip_ok, skip_warning=skip_warning,
-                             skip_error=skip_error, skip_start=True)
-                num_errors = self.cache_error[job] = self.filter.errors
-                num_warnings = self.cache_warning[job] = self.filter.warnings
+            events = self.cache_event[job]
 
             if events:
                 num += 1
 
-                if num_errors:
+                if self.cache_error[job]:
                     error.add(id_)
-                elif num_warnings:
+                elif self.cache_warning[job]:
                     warning.add(id_)
                 else:
                     ok.add(id_)
@@ -119,24 +119,14 @@ class CrabReportGenerator:
                 report_info[id_] = info
                 report_events[id_] = events
 
-                if include_output:
+                if job.include_output:
                     for event in events:
                         if event['type'] == CrabEvent.FINISH:
                             finishid = event['eventid']
-                            if finishid in self.cache_stdout:
-                                report_stdout[finishid] = \
-                                    self.cache_stdout[finishid]
-                                report_stderr[finishid] = \
-                                    self.cache_stderr[finishid]
-                            else:
-                                (stdout, stderr) = self.store.get_job_output(
-                                         finishid, info['host'], info['user'],
-                                         id_, info['crabid'])
-
-                                report_stdout[finishid] = \
-                                    self.cache_stdout[finishid] = stdout
-                                report_stderr[finishid] = \
-                                    self.cache_stderr[finishid] = stderr
+                            report_stdout[finishid] = \
+                                self.cache_stdout[finishid]
+                            report_stderr[finishid] = \
+                                self.cache_stderr[finishid]
 
         if num:
             return CrabReport(num, error, warning, ok,
@@ -144,3 +134,72 @@ class CrabReportGenerator:
                               report_stdout, report_stderr)
         else:
             return None
+
+    def prefetch(self, jobs):
+        """Fetches the information, events and (where required) output
+        for the given jobs, if not already cached.
+
+        Rather than querying the store for each job, the information for
+        all of the jobs is fetched together, as are the events of all of
+        the jobs sharing a time range, and the output of all of the
+        finishes to be included."""
+
+        jobs = [job for job in set(jobs) if job not in self.cache_event]
+
+        if not jobs:
+            return
+
+        ids = set(job.id_ for job in jobs).difference(self.cache_info)
+
+        if ids:
+            found = self.store.get_jobs_info(ids)
+
+            for id_ in ids:
+                # Record jobs which were not found as None so that
+                # they are not looked up again.
+                info = self.cache_info[id_] = found.get(id_)
+
+                if info is None:
+                    pass
+                elif info['crabid'] is None:
+                    info['title'] = info['command']
+                else:
+                    info['title'] = info['crabid']
+
+        windows = {}
+
+        for job in jobs:
+            if self.cache_info[job.id_] is not None:
+                windows.setdefault((job.start, job.end), []).append(job)
+
+        output = {}
+
+        for ((start, end), window_jobs) in windows.items():
+            events = self.store.get_jobs_events(
+                set(job.id_ for job in window_jobs), start, end)
+
+            for job in window_jobs:
+                info = self.cache_info[job.id_]
+
+                self.filter.set_timezone(info['timezone'])
+                job_events = self.cache_event[job] = self.filter(
+                    events.get(job.id_, []),
+                    skip_ok=job.skip_ok, skip_warning=job.skip_warning,
+                    skip_error=job.skip_error, skip_start=True)
+                self.cache_error[job] = self.filter.errors
+                self.cache_warning[job] = self.filter.warnings
+
+                if job.include_output:
+                    for event in job_events:
+                        if event['type'] == CrabEvent.FINISH:
+                            finishid = event['eventid']
+                            if finishid not in self.cache_stdout:
+                                output[finishid] = (
+                                    finishid, info['host'], info['user'],
+                                    job.id_, info['crabid'])
+
+        if output:
+            for (finishid, (stdout, stderr)) in self.store.get_job_outputs(
+                    output.values()).items():
+                self.cache_stdout[finishid] = stdout
+                self.cache_stderr[finishid] = stderr
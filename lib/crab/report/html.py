@@ -13,9 +13,61 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from mako.template import Template
+from threading import Lock
 
+from mako.lookup import TemplateLookup
 
-def report_to_html(report, home, base_url):
-    template = Template(filename=home + '/templ/report/basic.html')
-    return template.render(report=report, base_url=base_url)
+from crab.report import report_fragment_key
+
+_lookup = {}
+_lookup_lock = Lock()
+
+
+def get_report_template(home, module_directory=None):
+    """Fetches the report template.
+
+    Template lookups are kept for each home directory, so that the
+    template is only compiled once.  If a module directory is given,
+    the compiled template is also kept there, so that it need not be
+    compiled again when the server is restarted."""
+
+    key = (home, module_directory)
+
+    with _lookup_lock:
+        lookup = _lookup.get(key)
+
+        if lookup is None:
+            lookup = _lookup[key] = TemplateLookup(
+                directories=[home + '/templ'],
+                module_directory=module_directory)
+
+    return lookup.get_template('report/basic.html')
+
+
+def report_to_html(report, home, base_url, cache=None, module_directory=None):
+    """Renders a report as HTML.
+
+    If a cache dictionary is given, the rendered event listing for each
+    job is stored in it, and reused for other reports (for example
+    for other recipients) containing the same events.  The cache may be
+    shared by several threads: entries are added with setdefault so that
+    all of the threads use the same copy of each fragment."""
+
+    template = get_report_template(home, module_directory)
+    job_events = template.get_def('job_events')
+
+    def render_job(id_):
+        if cache is None:
+            return job_events.render(id_, report=report, base_url=base_url)
+
+        key = ('html', base_url, report_fragment_key(report, id_))
+        html = cache.get(key)
+
+        if html is None:
+            html = cache.setdefault(key, job_events.render(
+                id_, report=report, base_url=base_url))
+
+        return html
+
+    return template.render(report=report, base_url=base_url,
+                           render_job=render_job)
@@ -14,9 +14,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from crab import CrabEvent, CrabStatus
+from crab.report import report_fragment_key
 
 
-def report_to_text(report, event_list=True):
+def report_to_text(report, event_list=True, cache=None):
+    """Renders a report as plain text.
+
+    If a cache dictionary is given, the event listing for each job
+    is stored in it, and reused for other reports containing the
+    same events.  As for report_to_html, the cache may be shared
+    by several threads."""
+
     lines = []
     sections = ['error', 'warning', 'ok']
     titles = ['Jobs with Errors', 'Jobs with Warnings', 'Successful Jobs']
@@ -37,28 +45,47 @@ def report_to_text(report, event_list=True):
         lines.append('')
 
         for id_ in set.union(report.error, report.warning, report.ok):
-            subhead = _summary_line(report, id_)
-            lines.append(subhead)
-            lines.append('-' * len(subhead))
-            lines.append('')
+            if cache is None:
+                lines.extend(_job_lines(report, id_))
 
-            for e in report.events[id_]:
-                lines.append('    ' + _event_line(e))
+            else:
+                key = ('text', report_fragment_key(report, id_))
+                job_lines = cache.get(key)
 
-                if e['type'] == CrabEvent.FINISH:
-                    finishid = e['eventid']
-                    if finishid in report.stdout and report.stdout[finishid]:
-                        lines.extend(_output_lines(8, 'Std. Out.',
-                                                   report.stdout[finishid]))
-                    if finishid in report.stderr and report.stderr[finishid]:
-                        lines.extend(_output_lines(8, 'Std. Error',
-                                                   report.stderr[finishid]))
+                if job_lines is None:
+                    job_lines = cache.setdefault(
+                        key, _job_lines(report, id_))
 
-            lines.append('')
+                lines.extend(job_lines)
 
     return "\n".join(lines)
 
 
+def _job_lines(report, id_):
+    lines = []
+
+    subhead = _summary_line(report, id_)
+    lines.append(subhead)
+    lines.append('-' * len(subhead))
+    lines.append('')
+
+    for e in report.events[id_]:
+        lines.append('    ' + _event_line(e))
+
+        if e['type'] == CrabEvent.FINISH:
+            finishid = e['eventid']
+            if finishid in report.stdout and report.stdout[finishid]:
+                lines.extend(_output_lines(8, 'Std. Out.',
+                                           report.stdout[finishid]))
+            if finishid in report.stderr and report.stderr[finishid]:
+                lines.extend(_output_lines(8, 'Std. Error',
+                                           report.stderr[finishid]))
+
+    lines.append('')
+
+    return lines
+
+
 def _summary_line(report, id_):
     info = report.info[id_]
     return '{0:10} {1:10} {2}'.format(info['host'], info['user'],
@@ -21,17 +21,35 @@ import cherrypy
 from cherrypy import HTTPError
 
 from crab import CrabError, CrabStatus
+from crab.util.compress import ENCODINGS, CrabDecompressReader
+from crab.util.datetime import parse_datetime
+
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
 
 
 class CrabServer:
-    """Crab server class, used for interaction with the client."""
+    """Crab server class, used for interaction with the client.
+
+    Request bodies may be compressed with any of the encodings listed
+    in the Accept-Encoding header of the server's responses, and
+    responses are compressed with gzip if the client accepts it."""
 
-    def __init__(self, store):
+    _cp_config = {
+        'tools.gzip.on': True,
+        'tools.response_headers.on': True,
+        'tools.response_headers.headers': [
+            ('Accept-Encoding', ', '.join(ENCODINGS))],
+    }
+
+    def __init__(self, store, max_request_size=MAX_REQUEST_SIZE):
         """Constructor for CrabServer.
 
-        Saves a reference to the given storage backend."""
+        Saves a reference to the given storage backend.  The size
+        to which compressed request bodies may expand is limited
+        to max_request_size bytes."""
 
         self.store = store
+        self.max_request_size = max_request_size
 
     @cherrypy.expose
     def crontab(self, host, user, raw=False):
@@ -80,7 +98,8 @@ class CrabServer:
             if command is None:
                 raise CrabError('cron command not specified')
 
-            data = self.store.log_start(host, user, crabid, command)
+            data = self.store.log_start(host, user, crabid, command,
+                                        self._read_datetime(data))
 
             return json.dumps({'inhibit': data['inhibit']})
 
@@ -88,28 +107,222 @@ class CrabServer:
             cherrypy.log.error('CrabError: log error: ' + str(err))
             raise HTTPError(message='log error: ' + str(err))
 
+    @cherrypy.expose
+    def inhibited(self):
+        """CherryPy handler listing the jobs which are inhibited.
+
+        This allows a relay to determine whether a job is inhibited
+        without waiting for its start event to be forwarded."""
+
+        try:
+            return json.dumps({'inhibited': self.store.get_inhibited_jobs()})
+
+        except CrabError as err:
+            cherrypy.log.error('CrabError: read error: ' + str(err))
+            raise HTTPError(message='read error: ' + str(err))
+
     @cherrypy.expose
     def finish(self, host, user, crabid=None):
         """CherryPy handler allowing clients to report jobs finishing."""
 
         try:
             data = self._read_json()
-            command = data.get('command')
-            status = data.get('status')
 
-            if command is None or status is None:
-                raise CrabError('insufficient information to log finish')
+            self._log_finish(host, user, crabid, data,
+                             data.get('stdout'), data.get('stderr'))
+
+        except CrabError as err:
+            cherrypy.log.error('CrabError: log error: ' + str(err))
+            raise HTTPError(message='log error: ' + str(err))
+
+    @cherrypy.expose
+    def finish_stream(self, host, user, crabid=None):
+        """CherryPy handler allowing clients to report jobs finishing,
+        sending the output in a series of chunks.
+
+        The body of the request should consist of JSON objects, one per
+        line.  The first gives the command and status, as for the finish
+        action, and each subsequent object contains a chunk of
+        "stdout" and/or "stderr".  This allows the client to send
+        the output of a job without constructing a single message
+        containing all of it, possibly using chunked transfer encoding."""
+
+        try:
+            data = self._read_json_line()
+
+            if data is None:
+                raise CrabError('no finish information received')
+
+            stdout = []
+            stderr = []
+
+            while True:
+                chunk = self._read_json_line()
+
+                if chunk is None:
+                    break
+
+                if 'stdout' in chunk:
+                    stdout.append(chunk['stdout'])
+
+                if 'stderr' in chunk:
+                    stderr.append(chunk['stderr'])
 
-            if status not in CrabStatus.VALUES:
-                raise CrabError('invalid finish status')
+            self._log_finish(host, user, crabid, data,
+                             ''.join(stdout), ''.join(stderr))
 
-            self.store.log_finish(host, user, crabid, command, status,
+        except CrabError as err:
+            cherrypy.log.error('CrabError: log error: ' + str(err))
+            raise HTTPError(message='log error: ' + str(err))
+
+    @cherrypy.expose
+    def output(self, host, user, crabid=None):
+        """CherryPy handler allowing clients to send output from jobs
+        which are still running."""
+
+        try:
+            data = self._read_json()
+            command = data.get('command')
+
+            if command is None:
+                raise CrabError('cron command not specified')
+
+            self.store.log_output(host, user, crabid, command,
                                   data.get('stdout'), data.get('stderr'))
 
         except CrabError as err:
             cherrypy.log.error('CrabError: log error: ' + str(err))
             raise HTTPError(message='log error: ' + str(err))
 
+    @cherrypy.expose
+    def events(self):
+        """CherryPy handler allowing clients to report a batch of job
+        start and finish events.
+
+        The body of the request should be a JSON array of events, or
+        (with content type application/x-ndjson) one event per line.
+        Each event is an object giving the "action" ("start" or "finish"),
+        "host", "user", "crabid" and "command", and optionally the
+        "datetime" at which it occurred.  Finish events also include the
+        "status", "stdout" and "stderr".  The events are logged in a
+        single transaction.
+
+        The response contains a list of "results", one per event.
+        Events which were not valid were not logged, and their result
+        includes an "error" message.  The results for start events
+        indicate whether the job is inhibited."""
+
+        if cherrypy.request.method not in ('PUT', 'POST'):
+            raise HTTPError(405)
+
+        content_type = cherrypy.request.headers.get('Content-Type', '')
+
+        if content_type.startswith('application/x-ndjson'):
+            events = list(iter(self._read_json_line, None))
+        else:
+            events = self._read_json()
+            if not isinstance(events, list):
+                raise HTTPError(400, message='Expected a list of events')
+
+        results = [None] * len(events)
+        valid = []
+        positions = []
+
+        for (i, event) in enumerate(events):
+            try:
+                valid.append(self._read_event(event))
+                positions.append(i)
+
+            except CrabError as err:
+                results[i] = {'error': str(err)}
+
+        try:
+            for (i, result) in zip(positions, self.store.log_events(valid)):
+                results[i] = result
+
+        except CrabError as err:
+            cherrypy.log.error('CrabError: log error: ' + str(err))
+            raise HTTPError(message='log error: ' + str(err))
+
+        return json.dumps({'results': results})
+
+    def _read_event(self, data):
+        """Checks an event received as part of a batch and converts
+        it to the form expected by the store's log_events method."""
+
+        if not isinstance(data, dict):
+            raise CrabError('event is not an object')
+
+        action = data.get('action')
+        host = data.get('host')
+        user = data.get('user')
+
+        if action not in ('start', 'finish'):
+            raise CrabError('invalid action')
+
+        if host is None or user is None:
+            raise CrabError('host or user not specified')
+
+        event = {
+            'action': action,
+            'host': host,
+            'user': user,
+            'crabid': data.get('crabid'),
+            'datetime': self._read_datetime(data),
+        }
+
+        if action == 'start':
+            event['command'] = data.get('command')
+
+            if event['command'] is None:
+                raise CrabError('cron command not specified')
+
+        else:
+            (event['command'], event['status']) = self._read_finish(data)
+            event['stdout'] = data.get('stdout')
+            event['stderr'] = data.get('stderr')
+
+        return event
+
+    def _log_finish(self, host, user, crabid, data, stdout, stderr):
+        """Checks the finish information received from the client
+        and logs the finish in the storage backend."""
+
+        (command, status) = self._read_finish(data)
+
+        self.store.log_finish(host, user, crabid, command, status,
+                              stdout, stderr, self._read_datetime(data))
+
+    def _read_finish(self, data):
+        """Checks the finish information received from the client.
+
+        Returns the command and status."""
+
+        command = data.get('command')
+        status = data.get('status')
+
+        if command is None or status is None:
+            raise CrabError('insufficient information to log finish')
+
+        if status not in CrabStatus.VALUES:
+            raise CrabError('invalid finish status')
+
+        return (command, status)
+
+    def _read_datetime(self, data):
+        """Reads the optional datetime of an event, as sent by clients
+        reporting events which could not be sent at the time."""
+
+        datetime_ = data.get('datetime')
+
+        if datetime_ is None:
+            return None
+
+        try:
+            return parse_datetime(datetime_)
+        except (TypeError, ValueError):
+            raise CrabError('invalid datetime')
+
     def _read_json(self):
         """Attempts to interpret the HTTP PUT body as JSON and return
         the corresponding Python object.
@@ -119,10 +332,67 @@ class CrabServer:
         and the CherryPy handler needs to pass the response back with
         return."""
 
-        message = latin_1_decode(cherrypy.request.body.read(), 'replace')[0]
+        try:
+            body = self._request_body().read()
+        except CrabError as err:
+            raise HTTPError(400, message=str(err))
+
+        message = latin_1_decode(body, 'replace')[0]
 
         try:
             return json.loads(message)
         except ValueError:
             cherrypy.log.error('CrabError: Failed to read JSON: ' + message)
             raise HTTPError(400, message='Did not understand JSON')
+
+    def _read_json_line(self):
+        """Reads one line of the HTTP PUT body and interprets it as JSON.
+
+        Blank lines are skipped.  Returns None at the end of the body."""
+
+        body = self._request_body()
+
+        while True:
+            try:
+                line = body.readline()
+            except CrabError as err:
+                raise HTTPError(400, message=str(err))
+
+            if not line:
+                return None
+
+            message = latin_1_decode(line, 'replace')[0].strip()
+
+            if message:
+                break
+
+        try:
+            return json.loads(message)
+        except ValueError:
+            cherrypy.log.error('CrabError: Failed to read JSON: ' + message)
+            raise HTTPError(400, message='Did not understand JSON')
+
+    def _request_body(self):
+        """Returns a file-like object from which to read the HTTP request
+        body, decompressing it if a supported content encoding is given.
+
+        Raises an HTTP 415 error for unsupported encodings."""
+
+        request = cherrypy.request
+        body = getattr(request, 'crab_body', None)
+
+        if body is None:
+            encoding = request.headers.get(
+                'Content-Encoding', '').strip().lower()
+
+            if encoding in ('', 'identity'):
+                body = request.body
+            elif encoding in ENCODINGS or encoding == 'x-gzip':
+                body = CrabDecompressReader(
+                    request.body, encoding, self.max_request_size)
+            else:
+                raise HTTPError(415, message='Unsupported content encoding')
+
+            request.crab_body = body
+
+        return body
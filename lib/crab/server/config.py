@@ -32,7 +32,10 @@ def read_crabd_config():
 
     config = Config()
     config.update({'global': {'server.socket_port': 8000,
-                              'server.socket_host': '0.0.0.0'},
+                              'server.socket_host': '0.0.0.0',
+                              'server.socket_timeout': 10,
+                              'server.socket_queue_size': 64,
+                              'server.thread_pool': 20},
 
                    'crab': {'home': os.path.join(sys.prefix, 'share', 'crab'),
                             'base_url': None},
@@ -89,6 +92,38 @@ def read_crabd_config():
     return config
 
 
+def read_crabrelay_config():
+    """Determine Crab relay configuration.
+
+    This returns a CherryPy configuration dictionary, read from
+    crabrelay.ini files in the same directories as the server
+    configuration."""
+
+    config = Config()
+    config.update({'global': {'server.socket_port': 8000,
+                              'server.socket_host': '0.0.0.0',
+                              'server.socket_timeout': 10,
+                              'server.socket_queue_size': 64,
+                              'server.thread_pool': 20},
+
+                   'upstream': {'host': 'localhost',
+                                'port': 8000},
+
+                   'relay': {'spool_dir': '/var/lib/crab/relay'}})
+
+    env = os.environ
+    sysconfdir = env.get('CRABSYSCONFIG', '/etc/crab')
+    userconfdir = env.get('CRABUSERCONFIG', os.path.expanduser('~/.crab'))
+
+    for confdir in (sysconfdir, userconfdir):
+        try:
+            config.update(os.path.join(confdir, 'crabrelay.ini'))
+        except IOError:
+            pass
+
+    return config
+
+
 def construct_store(storeconfig, outputstore=None):
     """Constructs a storage backend from the given dictionary."""
 
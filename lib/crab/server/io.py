@@ -13,7 +13,31 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from __future__ import print_function
+
 import json
+import sys
+import time
+
+from crab import CrabError, CrabEvent
+from crab.util.datetime import format_datetime, parse_datetime
+
+# Version number written in the header of newline-delimited JSON exports.
+NDJSON_VERSION = 1
+
+# Number of jobs for which to fetch configuration, or events to fetch,
+# at once when exporting.
+EXPORT_BATCH = 250
+
+# Number of events to insert in each transaction when importing.
+IMPORT_BATCH = 500
+
+# Names of the types of event records in newline-delimited JSON files.
+EVENT_TYPES = {
+    'start': CrabEvent.START,
+    'alarm': CrabEvent.ALARM,
+    'finish': CrabEvent.FINISH,
+}
 
 JOB_FIELDS = [
     'host',
@@ -46,61 +70,228 @@ NOTIFICATION_FIELDS = [
 ]
 
 
-def import_config(store, file_):
-    """Read job and configuration information from a JSON file."""
+class CrabIOProgress:
+    """Counts the records processed by an import or export, and
+    reports the counts at intervals."""
+
+    def __init__(self, action, file_=sys.stderr, interval=5):
+        """Constructor for progress objects.
+
+        The action ("Imported" or "Exported") begins each report,
+        which is written to the given file at most once per interval
+        (in seconds)."""
+
+        self.action = action
+        self.file_ = file_
+        self.interval = interval
+        self.types = []
+        self.counts = {}
+        self.reported = time.time()
+
+    def add(self, type_, count=1):
+        """Adds to the count of records of the given type."""
+
+        if type_ not in self.counts:
+            self.types.append(type_)
+            self.counts[type_] = 0
+
+        self.counts[type_] += count
+
+        if time.time() > self.reported + self.interval:
+            self.report()
+
+    def report(self):
+        """Writes a report of the current counts."""
 
-    # Read JSON from the given file handle.
-    data = json.load(file_)
+        self.reported = time.time()
+
+        print(self.action, ', '.join(
+            '{0} {1}'.format(self.counts[type_], type_)
+            for type_ in self.types) or 'nothing',
+            file=self.file_)
+
+
+def import_config(store, file_, progress=None):
+    """Read job and configuration information from a file.
+
+    The file may either be in JSON format, as written by export_config,
+    or newline-delimited JSON, as written by export_ndjson.  This is
+    determined from the first line of the file.  The counts of records
+    imported are given to the progress object (a CrabIOProgress),
+    if specified."""
+
+    first = file_.readline()
+
+    try:
+        header = json.loads(first)
+    except ValueError:
+        header = None
+
+    if isinstance(header, dict) and header.get('type') == 'header':
+        if header.get('version') != NDJSON_VERSION:
+            raise CrabError('unsupported import version: ' +
+                            str(header.get('version')))
+
+        _import_ndjson(store, file_, progress)
+
+    else:
+        _import_json(store, json.loads(first + file_.read()), progress)
+
+    if progress is not None:
+        progress.report()
+
+
+def _import_json(store, data, progress):
+    """Imports job and configuration information from a dictionary,
+    as read from a file written by export_config."""
 
     # Ensure each job listed is present and update its configuration.
     for job in data['jobs']:
-        id_ = store.check_job(**job['info'])
-
-        configid = None
-        if job['config'] is not None:
-            configid = store.write_job_config(id_, **job['config'])
-
-        # If there were notifications, try to fetch the existing notifications
-        # so that those which match can be updated instead of being duplicated.
-        # If we don't already have a configuration, create a blank one for
-        # attaching notifications.
-        if job['notifications']:
-            # If we didn't set a config, check one didn't already exist.
-            if configid is None:
-                config = store.get_job_config(id_)
-                if config is not None:
-                    configid = config['configid']
-
-            # If we still don't have a configid (didn't set and didn't already
-            # exist) create one, otherwise fetch notifications.
-            existing_notify = {}
-            if configid is None:
-                configid = store.write_job_config(id_)
-            else:
-                for notification in store.get_job_notifications(configid):
-                    existing_notify[_notify_key(notification)] = \
-                        notification['notifyid']
-
-            for notification in job['notifications']:
-                notifyid = existing_notify.get(_notify_key(notification))
-                store.write_notification(notifyid=notifyid, configid=configid,
-                                         host=None, user=None, **notification)
+        _import_job(store, job)
+
+        if progress is not None:
+            progress.add('job')
 
     # Store any crontabs which were given.
     for crontab in data['crontabs']:
         store.write_raw_crontab(**crontab)
 
+        if progress is not None:
+            progress.add('crontab')
+
     # Get a list of existing "match" notifications, then store/update
     # those given.
+    existing_notify = _match_notifications(store)
+
+    for notification in data['notifications']:
+        _import_notification(store, notification, existing_notify)
+
+        if progress is not None:
+            progress.add('notification')
+
+
+def _import_ndjson(store, file_, progress):
+    """Imports records from a newline-delimited JSON file.
+
+    Each line is processed as it is read.  Event records apply to the
+    job record which precedes them, and are inserted in batches."""
+
+    id_ = None
+    events = []
+    existing_notify = None
+
+    def flush_events():
+        if events:
+            store.import_job_events(id_, events)
+
+            if progress is not None:
+                progress.add('event', len(events))
+
+            del events[:]
+
+    for line in file_:
+        if not line.strip():
+            continue
+
+        record = json.loads(line)
+        type_ = record.pop('type')
+
+        if type_ in EVENT_TYPES:
+            if id_ is None:
+                raise CrabError('event record found before job record')
+
+            record['type'] = EVENT_TYPES[type_]
+            record['datetime'] = parse_datetime(record['datetime'])
+            events.append(record)
+
+            if len(events) >= IMPORT_BATCH:
+                flush_events()
+
+            continue
+
+        flush_events()
+
+        if type_ == 'job':
+            id_ = _import_job(store, record)
+
+        elif type_ == 'crontab':
+            store.write_raw_crontab(**record)
+
+        elif type_ == 'notification':
+            if existing_notify is None:
+                existing_notify = _match_notifications(store)
+
+            _import_notification(store, record, existing_notify)
+
+        else:
+            raise CrabError('unknown import record type: ' + str(type_))
+
+        if progress is not None:
+            progress.add(type_)
+
+    flush_events()
+
+
+def _import_job(store, job):
+    """Ensures that a job is present and updates its configuration
+    and notifications.
+
+    Returns the job ID number."""
+
+    id_ = store.check_job(**job['info'])
+
+    configid = None
+    if job['config'] is not None:
+        configid = store.write_job_config(id_, **job['config'])
+
+    # If there were notifications, try to fetch the existing notifications
+    # so that those which match can be updated instead of being duplicated.
+    # If we don't already have a configuration, create a blank one for
+    # attaching notifications.
+    if job['notifications']:
+        # If we didn't set a config, check one didn't already exist.
+        if configid is None:
+            config = store.get_job_config(id_)
+            if config is not None:
+                configid = config['configid']
+
+        # If we still don't have a configid (didn't set and didn't already
+        # exist) create one, otherwise fetch notifications.
+        existing_notify = {}
+        if configid is None:
+            configid = store.write_job_config(id_)
+        else:
+            for notification in store.get_job_notifications(configid):
+                existing_notify[_notify_key(notification)] = \
+                    notification['notifyid']
+
+        for notification in job['notifications']:
+            notifyid = existing_notify.get(_notify_key(notification))
+            store.write_notification(notifyid=notifyid, configid=configid,
+                                     host=None, user=None, **notification)
+
+    return id_
+
+
+def _match_notifications(store):
+    """Fetches the existing "match" notifications, returning
+    a dictionary of notification IDs by key."""
+
     existing_notify = {}
+
     for notification in store.get_match_notifications():
         existing_notify[_notify_key(notification, match=True)] = \
             notification['notifyid']
 
-    for notification in data['notifications']:
-        notifyid = existing_notify.get(_notify_key(notification, match=True))
-        store.write_notification(notifyid=notifyid, configid=None,
-                                 **notification)
+    return existing_notify
+
+
+def _import_notification(store, notification, existing_notify):
+    """Stores or updates a "match" notification."""
+
+    notifyid = existing_notify.get(_notify_key(notification, match=True))
+    store.write_notification(notifyid=notifyid, configid=None,
+                             **notification)
 
 
 def export_config(store, file_):
@@ -154,6 +345,120 @@ def export_config(store, file_):
     }, file_, indent=4, separators=(',', ': '), sort_keys=True)
 
 
+def export_ndjson(store, file_, include_events=False, progress=None):
+    """Write job and configuration information to a newline-delimited
+    JSON file.
+
+    Each record is written as it is prepared, with the configuration
+    and notifications fetched for batches of jobs.  If "include_events"
+    is specified, each job's record is followed by its history of
+    events, including the output of each finish, which is read in pages.
+    The counts of records exported are given to the progress object
+    (a CrabIOProgress), if specified."""
+
+    def write(type_, record):
+        record['type'] = type_
+        file_.write(json.dumps(record, sort_keys=True))
+        file_.write('\n')
+
+        if progress is not None and type_ != 'header':
+            progress.add('event' if type_ in EVENT_TYPES else type_)
+
+    write('header', {'version': NDJSON_VERSION})
+
+    jobs = store.get_jobs()
+    hostuser = set()
+
+    for offset in range(0, len(jobs), EXPORT_BATCH):
+        batch = jobs[offset:offset + EXPORT_BATCH]
+        configs = store.get_jobs_configs([job['id'] for job in batch])
+        notifications = store.get_configs_notifications(
+            [config['configid'] for config in configs.values()])
+
+        for job in batch:
+            hostuser.add((job['host'], job['user']))
+            config = configs.get(job['id'])
+
+            write('job', {
+                'info': _filter_dict(job, JOB_FIELDS),
+                'config': _filter_dict(config, CONFIG_FIELDS),
+                'notifications': [
+                    _filter_dict(notification, NOTIFICATION_FIELDS)
+                    for notification in (
+                        () if config is None else
+                        notifications.get(config['configid'], ()))],
+            })
+
+            if include_events:
+                _export_events(store, job, write)
+
+    # Retrieve raw crontabs.
+    for (host, user) in sorted(hostuser):
+        crontab = store.get_raw_crontab(host, user)
+
+        if crontab is not None:
+            write('crontab', {
+                'host': host,
+                'user': user,
+                'crontab': crontab,
+            })
+
+    # Retrieve "match" notifications.
+    for notification in store.get_match_notifications():
+        write('notification', _filter_dict(
+            notification, ['host', 'user'] + NOTIFICATION_FIELDS))
+
+    if progress is not None:
+        progress.report()
+
+
+def _export_events(store, job, write):
+    """Writes the history of events of a job, reading it in pages.
+
+    All of the starts are written before the alarms and finishes
+    so that, when imported, the finishes can be paired with
+    their starts."""
+
+    id_ = job['id']
+
+    for (type_, name) in ((CrabEvent.START, 'start'),
+                          (CrabEvent.ALARM, 'alarm'),
+                          (CrabEvent.FINISH, 'finish')):
+        after = 0
+
+        while True:
+            events = store.get_job_event_page(id_, type_, after,
+                                              EXPORT_BATCH)
+            if not events:
+                break
+
+            after = events[-1]['eventid']
+
+            if type_ == CrabEvent.FINISH:
+                outputs = store.get_job_outputs(
+                    (event['eventid'], job['host'], job['user'], id_,
+                     job['crabid'])
+                    for event in events)
+
+            for event in events:
+                record = {'datetime': format_datetime(event['datetime'])}
+
+                if type_ != CrabEvent.ALARM:
+                    record['command'] = event['command']
+
+                if type_ != CrabEvent.START:
+                    record['status'] = event['status']
+
+                if type_ == CrabEvent.FINISH:
+                    (stdout, stderr) = outputs[event['eventid']]
+
+                    if stdout or stderr:
+                        record['stdout'] = stdout
+                        record['stderr'] = stderr
+
+                write(name, record)
+
+
 def _filter_dict(d, keys):
     """Filters a dictionary to contain only the given keys.
 
@@ -0,0 +1,298 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import os
+from threading import Event, Lock, Thread
+import time
+
+from crab import CrabError
+from crab.client import CrabClient
+from crab.util.spool import CrabSpool
+from crab.util.datetime import format_datetime
+
+
+class CrabRelayClient(CrabClient):
+    """Client used by a relay to contact the upstream Crab server.
+
+    Unlike the regular client, this acts on behalf of other hosts and
+    users, and is configured by the "upstream" and "relay" sections of
+    the relay configuration rather than by the client's crab.ini files."""
+
+    def __init__(self, config):
+        CrabClient.__init__(self)
+
+        upstream = config.get('upstream', {})
+        relay = config.get('relay', {})
+
+        self.config.set('server', 'host', upstream.get('host', 'localhost'))
+        self.config.set('server', 'port', str(upstream.get('port', 8000)))
+        self.config.set('client', 'spool_max_age',
+                        str(relay.get('max_age', 7)))
+        self.timeout = int(upstream.get('timeout', 30))
+
+        self.spool = CrabSpool(os.path.expanduser(
+            relay.get('spool_dir', '/var/lib/crab/relay')))
+
+    def send_output(self, host, user, crabid, command, stdout, stderr):
+        """Sends the live output of a job running on the given host."""
+
+        self._write_json(self._make_url('output', host, user, crabid),
+                         {'command': command,
+                          'stdout': stdout,
+                          'stderr': stderr})
+
+    def send_user_crontab(self, host, user, crontab, timezone=None):
+        """Sends a crontab (given as a list of lines) for the given
+        host and user.  Returns a list of warnings."""
+
+        data = self._write_json(self._make_url('crontab', host, user),
+                                {'crontab': crontab,
+                                 'timezone': timezone},
+                                read=True)
+
+        return data['warning']
+
+    def fetch_user_crontab(self, host, user, raw=False):
+        """Retrieves the crontab lines for the given host and user."""
+
+        url = self._make_url('crontab', host, user)
+        if raw:
+            url = url + '?raw=true'
+
+        return self._read_json(url)['crontab']
+
+    def fetch_inhibited(self):
+        """Retrieves the list of inhibited jobs, as dictionaries giving
+        the host, user, crabid and command of each job."""
+
+        return self._read_json('/api/0/inhibited')['inhibited']
+
+
+class CrabRelayStore:
+    """Storage backend for a relay, allowing it to be used with the
+    regular CrabServer.
+
+    Job start and finish events are added to the relay's spool, to be
+    forwarded to the upstream server in batches by CrabRelayService.
+    Whether a job is inhibited is answered from a cache of the set of
+    inhibited jobs, which is fetched from the upstream server periodically
+    and updated from the results received when forwarding start events.
+    Live output and crontabs are passed directly to the upstream server."""
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = Lock()
+        self.inhibit = set()
+
+    def log_start(self, host, user, crabid, command, datetime_=None):
+        """Spools a job start event.
+
+        Returns a dictionary indicating whether the job is inhibited,
+        according to the inhibit cache."""
+
+        self._spool_event({'action': 'start',
+                           'host': host,
+                           'user': user,
+                           'crabid': crabid,
+                           'command': command}, datetime_)
+
+        key = self._job_key(host, user, crabid, command)
+
+        with self.lock:
+            inhibit = key in self.inhibit
+
+        return {'inhibit': inhibit}
+
+    def log_finish(self, host, user, crabid, command, status,
+                   stdout=None, stderr=None, datetime_=None):
+        """Spools a job finish event."""
+
+        self._spool_event({'action': 'finish',
+                           'host': host,
+                           'user': user,
+                           'crabid': crabid,
+                           'command': command,
+                           'status': status,
+                           'stdout': stdout,
+                           'stderr': stderr}, datetime_)
+
+    def log_events(self, events):
+        """Spools a batch of events, as checked by the server's
+        events action."""
+
+        results = []
+
+        for event in events:
+            if event['action'] == 'start':
+                results.append(self.log_start(
+                    event['host'], event['user'], event['crabid'],
+                    event['command'], event['datetime']))
+
+            else:
+                self.log_finish(
+                    event['host'], event['user'], event['crabid'],
+                    event['command'], event['status'],
+                    event['stdout'], event['stderr'], event['datetime'])
+                results.append({})
+
+        return results
+
+    def log_output(self, host, user, crabid, command,
+                   stdout=None, stderr=None):
+        """Passes live output directly to the upstream server."""
+
+        self.client.send_output(host, user, crabid, command,
+                                stdout or '', stderr or '')
+
+    def save_crontab(self, host, user, crontab, timezone=None):
+        """Passes a crontab directly to the upstream server."""
+
+        return self.client.send_user_crontab(host, user, crontab, timezone)
+
+    def get_crontab(self, host, user):
+        """Fetches a crontab from the upstream server."""
+
+        return self.client.fetch_user_crontab(host, user)
+
+    def get_raw_crontab(self, host, user):
+        """Fetches a raw crontab from the upstream server."""
+
+        return self.client.fetch_user_crontab(host, user, raw=True)
+
+    def get_inhibited_jobs(self):
+        """Lists the jobs in the inhibit cache, so that a relay can
+        itself be used as the upstream server of another relay."""
+
+        with self.lock:
+            return [dict(zip(('host', 'user', 'crabid', 'command'), key))
+                    for key in self.inhibit]
+
+    def refresh_inhibit(self):
+        """Replaces the inhibit cache with the list of inhibited jobs
+        fetched from the upstream server."""
+
+        inhibit = set(
+            self._job_key(job['host'], job['user'], job['crabid'],
+                          job['command'])
+            for job in self.client.fetch_inhibited())
+
+        with self.lock:
+            self.inhibit = inhibit
+
+    def record_result(self, event, result):
+        """Records the upstream server's result for a forwarded event.
+
+        This is intended to be used as the flush_spool callback, and
+        updates the inhibit cache from the results of start events."""
+
+        if event['action'] == 'start' and 'inhibit' in result:
+            key = self._job_key(event['host'], event['user'],
+                                event['crabid'], event['command'])
+
+            with self.lock:
+                if result['inhibit']:
+                    self.inhibit.add(key)
+                else:
+                    self.inhibit.discard(key)
+
+    def _spool_event(self, event, datetime_):
+        """Adds an event to the spool, recording the time at which
+        it occurred."""
+
+        if datetime_ is None:
+            event['datetime'] = time.strftime('%Y-%m-%d %H:%M:%S',
+                                              time.gmtime())
+        else:
+            event['datetime'] = format_datetime(datetime_)
+
+        self.client.spool.add(event)
+
+    def _job_key(self, host, user, crabid, command):
+        """Determines the key by which a job is identified in the
+        inhibit cache."""
+
+        if crabid is not None:
+            return (host, user, crabid, None)
+
+        return (host, user, None, command)
+
+
+class CrabRelayService(Thread):
+    """Service which forwards the events spooled by a relay to the
+    upstream server.
+
+    The spool is flushed at regular intervals.  If the upstream server
+    can not be reached, the events are kept and sent later.  The store's
+    inhibit cache is also refreshed, less frequently."""
+
+    def __init__(self, config, store):
+        """Constructor method.
+
+        Takes the "relay" section of the relay configuration and
+        the CrabRelayStore."""
+
+        Thread.__init__(self)
+
+        self.store = store
+        self.interval = int(config.get('interval', 10))
+        self.inhibit_interval = int(config.get('inhibit_interval', 60))
+        self.inhibit_refreshed = None
+        self.stopped = Event()
+
+    def run(self):
+        """Thread run function."""
+
+        while not self.stopped.is_set():
+            if (self.inhibit_refreshed is None or time.time() >
+                    self.inhibit_refreshed + self.inhibit_interval):
+                self.refresh()
+
+            self.flush()
+            self.stopped.wait(self.interval)
+
+    def refresh(self):
+        """Refreshes the store's cache of inhibited jobs."""
+
+        self.inhibit_refreshed = time.time()
+
+        try:
+            self.store.refresh_inhibit()
+
+        except CrabError as err:
+            print('Error: could not fetch inhibited jobs:', str(err))
+
+    def flush(self):
+        """Sends the spooled events to the upstream server.
+
+        Returns the number of events sent."""
+
+        try:
+            return self.store.client.flush_spool(
+                callback=self.store.record_result)
+
+        except CrabError as err:
+            print('Error: could not forward events:', str(err))
+            return 0
+
+    def stop(self):
+        """Stops the service, waiting for it to finish any flush
+        in progress."""
+
+        self.stopped.set()
+
+        if self.is_alive():
+            self.join()
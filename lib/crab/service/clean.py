@@ -23,20 +23,26 @@ from crab.util.schedule import CrabSchedule
 class CrabCleanService(CrabMinutely):
     """Service to clean the store by removing old events."""
 
-    def __init__(self, config, store):
+    def __init__(self, config, store, lease=None):
         """Constructor method.
 
-        Stores the store object and a CrabSchedule object."""
+        Stores the store object and a CrabSchedule object.
+        If a lease is given, cleaning is only performed while it
+        is held."""
 
         CrabMinutely.__init__(self)
 
         self.store = store
+        self.lease = lease
         self.schedule = CrabSchedule(config['schedule'], config['timezone'])
         self.keep_days = config['keep_days']
 
     def run_minutely(self, datetime_):
         """Performs cleaning if scheduled for the given minute."""
 
+        if self.lease is not None and not self.lease.is_held():
+            return
+
         if self.schedule.match(datetime_):
             self.store.delete_old_events(
                 datetime_=(datetime_ - timedelta(days=self.keep_days)))
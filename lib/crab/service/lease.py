@@ -0,0 +1,104 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+from datetime import timedelta
+import os
+import socket
+from threading import Thread
+import time
+
+from crab import CrabError
+
+
+class CrabLeaseService(Thread):
+    """Service to hold a lease, stored in the database, which determines
+    which of a number of servers sharing the database is the leader.
+
+    The lease is renewed at regular intervals.  So that two servers
+    do not act as leader at the same time, this service considers the
+    lease to be held only until one renewal interval before it would
+    expire.  If it can not renew the lease (for example because the
+    database is unavailable) it will therefore stop acting as leader
+    before another server can take over."""
+
+    def __init__(self, config, store):
+        """Constructor method.
+
+        Takes the "cluster" section of the server configuration and
+        the storage backend."""
+
+        Thread.__init__(self)
+
+        self.store = store
+        self.name = config.get('lease_name', 'crabd')
+        self.node = config.get('node', None)
+        if self.node is None:
+            self.node = '{0}:{1}'.format(socket.getfqdn(), os.getpid())
+        self.lease_time = int(config.get('lease_time', 60))
+        self.renew_interval = int(config.get(
+            'renew_interval', self.lease_time // 3))
+
+        if not 0 < self.renew_interval < self.lease_time:
+            raise CrabError('lease renewal interval must be shorter '
+                            'than the lease time')
+
+        self.held_until = 0.0
+
+    def run(self):
+        """Thread run function.
+
+        Attempts to acquire or renew the lease at regular intervals."""
+
+        while True:
+            self.renew()
+            time.sleep(self.renew_interval)
+
+    def renew(self):
+        """Attempts to acquire or renew the lease.
+
+        Returns True if the lease is now held."""
+
+        attempted = time.time()
+        was_held = self.is_held()
+
+        try:
+            held = self.store.acquire_lease(
+                self.name, self.node, timedelta(seconds=self.lease_time))
+
+        except CrabError as err:
+            # Leave held_until unchanged, so that if we held the lease,
+            # we continue to act as leader until it would have expired.
+            print('Error: could not renew lease:', str(err))
+            return was_held
+
+        if held:
+            self.held_until = (attempted + self.lease_time -
+                               self.renew_interval)
+        else:
+            self.held_until = 0.0
+
+        if held and not was_held:
+            print('Lease', self.name, 'acquired by', self.node)
+        elif was_held and not held:
+            print('Lease', self.name, 'lost by', self.node)
+
+        return held
+
+    def is_held(self):
+        """Determines whether the lease is currently held."""
+
+        return time.time() < self.held_until
@@ -16,15 +16,21 @@
 
 from __future__ import print_function
 
+from array import array
+from collections import namedtuple
 from datetime import datetime, timedelta
+import gzip
+from json import JSONEncoder
 import pytz
 import time
 from random import Random
-from threading import Condition, Event, Thread
+from threading import Condition, Event, Lock, Thread
 
 from crab import CrabError, CrabEvent, CrabStatus
 from crab.service import CrabMinutely
+from crab.util.histogram import CrabHistogram
 from crab.util.schedule import CrabSchedule
+from crab.util.web import json_default
 
 HISTORY_COUNT = 10
 LATE_GRACE_PERIOD = timedelta(seconds=30)
@@ -35,10 +41,174 @@ class JobDeleted(Exception):
     pass
 
 
+class CrabJobStatus(namedtuple(
+        'CrabJobStatus',
+        ['status', 'running', 'reliability', 'scheduled', 'installed',
+         'history'])):
+    """Immutable record of the status of a single job."""
+
+    __slots__ = ()
+
+    @property
+    def severity(self):
+        """Classifies the status: 0 if OK, 1 for a warning or 2 for
+        an error."""
+
+        if self.status is None or CrabStatus.is_ok(self.status):
+            return 0
+        elif CrabStatus.is_warning(self.status):
+            return 1
+        else:
+            return 2
+
+
+class CrabJobState(object):
+    """Mutable state of a single job, as tracked by the monitor thread.
+
+    The status history is kept in a fixed-size ring buffer, with a count
+    of the successful entries maintained as statuses are added, so
+    that the reliability can be found without examining the history.
+
+    If adaptive timeouts are in use, a histogram of the job's
+    run durations is also kept."""
+
+    __slots__ = ('status', 'running', 'installed', 'scheduled', 'schedule',
+                 'graceperiod', 'timeout', 'fixed_timeout', 'last_start',
+                 'history', 'history_next', 'history_len', 'successes',
+                 'histogram')
+
+    def __init__(self, installed):
+        self.status = None
+        self.running = False
+        self.installed = installed
+        self.scheduled = False
+        self.schedule = None
+        self.graceperiod = None
+        self.timeout = None
+        self.fixed_timeout = False
+        self.last_start = None
+        self.history = array('h', [0] * HISTORY_COUNT)
+        self.history_next = 0
+        self.history_len = 0
+        self.successes = 0
+        self.histogram = None
+
+    def add_history(self, status):
+        """Adds a status to the history, replacing the oldest entry
+        if the history is full."""
+
+        if self.history_len == HISTORY_COUNT:
+            if self.history[self.history_next] == CrabStatus.SUCCESS:
+                self.successes -= 1
+        else:
+            self.history_len += 1
+
+        self.history[self.history_next] = status
+        self.history_next = (self.history_next + 1) % HISTORY_COUNT
+
+        if status == CrabStatus.SUCCESS:
+            self.successes += 1
+
+    def get_history(self):
+        """Returns the history as a tuple, oldest first."""
+
+        if self.history_len < HISTORY_COUNT:
+            return tuple(self.history[:self.history_len])
+
+        return tuple(self.history[self.history_next:] +
+                     self.history[:self.history_next])
+
+    @property
+    def reliability(self):
+        """Percentage of the statuses in the history which were
+        successful."""
+
+        if self.history_len == 0:
+            return 0
+
+        return int(100 * self.successes / self.history_len)
+
+
+UNKNOWN_JOB_STATUS = CrabJobStatus(
+    status=None, running=False, reliability=0, scheduled=False,
+    installed=None, history=())
+
+
+class CrabStatusSnapshot:
+    """Immutable record of the status of all jobs, as published by
+    the monitor after each batch of events.
+
+    The status attribute is a dictionary of CrabJobStatus records
+    by job ID number.  Records for jobs which have not changed are
+    shared with the previous snapshot.
+
+    The JSON encoding of the snapshot is prepared on demand and then
+    cached, so that any number of clients waiting for the same event
+    can share a single encoded (and optionally compressed) copy."""
+
+    json_encoder = JSONEncoder(default=json_default)
+
+    def __init__(self, startid, alarmid, finishid, status,
+                 numwarning, numerror):
+        """Constructor for status snapshot objects.
+
+        The status dictionary must not be modified after it has been
+        given to this constructor."""
+
+        self.startid = startid
+        self.alarmid = alarmid
+        self.finishid = finishid
+        self.status = status
+        self.numwarning = numwarning
+        self.numerror = numerror
+
+        self._encoded = {}
+        self._lock = Lock()
+
+    def as_dict(self):
+        """Returns the snapshot information as a dictionary, in the form
+        used for the web interface's jobstatus query."""
+
+        return {'startid': self.startid, 'alarmid': self.alarmid,
+                'finishid': self.finishid,
+                'status': dict((id_, job._asdict())
+                               for (id_, job) in self.status.items()),
+                'numwarning': self.numwarning, 'numerror': self.numerror}
+
+    def encode(self, service=(), compress=False):
+        """Returns the snapshot encoded as JSON (as bytes).
+
+        The "service" argument should be a tuple of (name, running) pairs
+        giving the state of the services, which is also included in
+        the output.  If "compress" is specified then the result is
+        gzip-compressed."""
+
+        key = (service, compress)
+
+        with self._lock:
+            encoded = self._encoded.get(key)
+
+            if encoded is None:
+                plain = self._encoded.get((service, False))
+
+                if plain is None:
+                    message = self.as_dict()
+                    message['service'] = dict(service)
+                    plain = self._encoded[(service, False)] = \
+                        self.json_encoder.encode(message).encode('utf-8')
+
+                if compress:
+                    encoded = self._encoded[key] = gzip.compress(plain)
+                else:
+                    encoded = plain
+
+        return encoded
+
+
 class CrabMonitor(CrabMinutely):
     """A class implementing the crab monitor thread."""
 
-    def __init__(self, store, passive=False):
+    def __init__(self, store, passive=False, lease=None, config=None):
         """Constructor.
 
         Saves the given storage backend and prepares the instance
@@ -48,17 +218,29 @@ class CrabMonitor(CrabMinutely):
         job status but will not write alarms into the store.  This could
         be used, for example, to implement a web interface (which requires
         a monitor) separately from the active monitor.
+
+        If a lease (such as a CrabLeaseService) is given, then the monitor
+        tracks the job status and timeouts as normal, but only writes
+        alarms while the lease is held.  This allows a standby server
+        to take over from the active monitor without delay.
+
+        The "monitor" section of the server configuration may be given.
+        If its "adaptive_timeout" parameter is set, jobs without
+        a configured timeout are given one based on their recent run
+        durations: the given percentile of the durations multiplied
+        by the given factor, within the given bounds (in minutes).
+        The default timeout is used until enough runs have been seen.
         """
 
         CrabMinutely.__init__(self)
 
         self.store = store
         self.passive = passive
-        self.sched = {}
-        self.status = {}
+        self.lease = lease
+        self.jobs = {}
         self.status_ready = Event()
-        self.config = {}
-        self.last_start = {}
+        self.status_dirty = set()
+        self.snapshot = CrabStatusSnapshot(0, 0, 0, {}, 0, 0)
         self.timeout = {}
         self.late_timeout = {}
         self.miss_timeout = {}
@@ -69,6 +251,20 @@ class CrabMonitor(CrabMinutely):
         self.num_warning = 0
         self.num_error = 0
         self.random = Random()
+        self.listeners = []
+
+        if config is None:
+            config = {}
+
+        self.adaptive_timeout = (config.get('adaptive_timeout', False) and
+                                 not passive)
+        self.timeout_percentile = float(config.get('timeout_percentile', 99))
+        self.timeout_factor = float(config.get('timeout_factor', 2.0))
+        self.timeout_min = timedelta(minutes=config.get('timeout_min', 5))
+        self.timeout_max = timedelta(minutes=config.get('timeout_max', 1440))
+        self.timeout_min_runs = int(config.get('timeout_min_runs', 5))
+        self.timeout_days = int(config.get('timeout_days', 30))
+        self.histogram_date = None
 
     def run(self):
         """Monitor thread main run function.
@@ -79,22 +275,33 @@ class CrabMonitor(CrabMinutely):
         is fired.
 
         It then goes into a loop, and every few seconds it checks
-        for new events, processing any which are found.  The new_event
-        Condition is fired if there were any new events.
+        for new events, processing any which are found.  If there were
+        any new events, a new status snapshot is published and
+        the new_event Condition is fired.
 
         We call _check_minute from CrabMinutely to check whether the
         minute has changed since the last time round the loop."""
 
         jobs = self.store.get_jobs()
 
+        # Fetch the run durations for all jobs together, rather than
+        # separately as each job is initialized.
+        histograms = self._load_histograms([job['id'] for job in jobs])
+        if histograms is None:
+            histograms = {}
+        else:
+            self.histogram_date = datetime.now(pytz.UTC).date()
+
         for job in jobs:
             id_ = job['id']
             try:
-                self._initialize_job(id_, load_events=True)
+                self._initialize_job(id_, load_events=True,
+                                     histograms=histograms)
 
             except JobDeleted:
                 print('Warning: job', id_, 'has vanished')
 
+        self._publish_status()
         self.status_ready.set()
 
         while True:
@@ -110,42 +317,11 @@ class CrabMonitor(CrabMinutely):
             except Exception as e:
                 print('Error: monitor exception getting events:', str(e))
 
-            for event in events:
-                id_ = event['jobid']
-                self._update_max_id_values(event)
-
-                try:
-                    if id_ not in self.status:
-                        self._initialize_job(id_)
-
-                    self._process_event(id_, event)
-                    self._compute_reliability(id_)
-
-                # If the monitor is loaded when a job has just been
-                # deleted, then it may have events more recent
-                # than those of the events that still exist.
-                except JobDeleted:
-                    pass
-
-                # Also trap other exceptions, in case a database disconnection
-                # causes a failure from _initialize_job.  Do this separately,
-                # inside the events loop so that we keep the max_id_values
-                # up to date with the other events.
-                except Exception as e:
-                    print('Error: monitor exception handling event:', str(e))
-
-            self.num_error = 0
-            self.num_warning = 0
-            for id_ in self.status:
-                jobstatus = self.status[id_]['status']
-                if (jobstatus is None or CrabStatus.is_ok(jobstatus)):
-                    pass
-                elif (CrabStatus.is_warning(jobstatus)):
-                    self.num_warning += 1
-                else:
-                    self.num_error += 1
+            self._handle_events(events)
 
             if events:
+                self._publish_status()
+
                 with self.new_event:
                     self.new_event.notify_all()
 
@@ -154,6 +330,11 @@ class CrabMonitor(CrabMinutely):
             # is protected by a try-except block in the superclass.
             self._check_minute()
 
+            # Publish changes to the job list which were not caused by
+            # events, e.g. jobs added or removed by run_minutely.
+            if self.status_dirty:
+                self._publish_status()
+
             # Check status of timeouts - need to get a list of keys
             # so that we can delete from the dict while iterating.
             # Note: _write_alarm uses a try-except block for CrabErrors.
@@ -172,17 +353,69 @@ class CrabMonitor(CrabMinutely):
                     self._write_alarm(id_, CrabStatus.TIMEOUT)
                     del self.timeout[id_]
 
+    def _handle_events(self, events):
+        """Processes a list of new events, as given by the store's
+        get_events_since method."""
+
+        # Jobs initialized while handling these events: their histograms
+        # already include the durations of all of the events.
+        new_jobs = set()
+
+        for event in events:
+            id_ = event['jobid']
+            self._update_max_id_values(event)
+
+            try:
+                if id_ not in self.jobs:
+                    self._initialize_job(id_)
+                    new_jobs.add(id_)
+
+                self._process_event(id_, event)
+
+                if (self.adaptive_timeout and
+                        event['type'] == CrabEvent.FINISH and
+                        event['duration'] is not None and
+                        id_ not in new_jobs):
+                    self.jobs[id_].histogram.add(event['duration'])
+
+                for listener in self.listeners:
+                    listener(id_, event)
+
+            # If the monitor is loaded when a job has just been
+            # deleted, then it may have events more recent
+            # than those of the events that still exist.
+            except JobDeleted:
+                pass
+
+            # Also trap other exceptions, in case a database disconnection
+            # causes a failure from _initialize_job.  Do this separately,
+            # inside the events loop so that we keep the max_id_values
+            # up to date with the other events.
+            except Exception as e:
+                print('Error: monitor exception handling event:', str(e))
+
+    def add_listener(self, listener):
+        """Adds a function to be called with the job ID and event
+        (as a dict) for each new event seen by the monitor.
+
+        The function is called from the monitor thread, so should
+        return quickly.  It is not called for the events read when
+        the monitor starts."""
+
+        self.listeners.append(listener)
+
     def run_minutely(self, datetime_):
         """Every minute the job scheduling is checked.
 
-        At this stage we also check for new / deleted / updated jobs."""
+        At this stage we also check for new / deleted / updated jobs.
+        If adaptive timeouts are in use, the histograms of run durations
+        are reloaded each day, so that old runs are discarded."""
 
         if not self.passive:
-            for id_ in self.sched:
-                if self.sched[id_].match(datetime_):
-                    if ((id_ not in self.last_start) or
-                            (self.last_start[id_] +
-                             self.config[id_]['graceperiod'] < datetime_)):
+            for (id_, job) in self.jobs.items():
+                if job.schedule is not None and job.schedule.match(datetime_):
+                    if ((job.last_start is None) or
+                            (job.last_start + job.graceperiod < datetime_)):
                         # No need to check if the late timeout is already
                         # running as the grace period is currently less
                         # than the minimum scheduling interval.
@@ -192,10 +425,10 @@ class CrabMonitor(CrabMinutely):
                         # "running".
                         if id_ not in self.miss_timeout:
                             self.miss_timeout[id_] = (
-                                datetime_ + self.config[id_]['graceperiod'])
+                                datetime_ + job.graceperiod)
 
         # Look for new or deleted jobs.
-        currentjobs = set(self.status.keys())
+        currentjobs = set(self.jobs.keys())
         jobs = self.store.get_jobs()
         for job in jobs:
             id_ = job['id']
@@ -204,9 +437,10 @@ class CrabMonitor(CrabMinutely):
 
                 # Compare installed timestamp is case we need to
                 # reload the schedule.
-                if job['installed'] > self.status[id_]['installed']:
+                if job['installed'] > self.jobs[id_].installed:
                     self._schedule_job(id_)
-                    self.status[id_]['installed'] = job['installed']
+                    self.jobs[id_].installed = job['installed']
+                    self.status_dirty.add(id_)
 
                 # TODO: is there a quick way to check whether we
                 # need to do this?
@@ -221,16 +455,37 @@ class CrabMonitor(CrabMinutely):
         for id_ in currentjobs:
             self._remove_job(id_)
 
-    def _initialize_job(self, id_, load_events=False):
+        date = datetime_.astimezone(pytz.UTC).date()
+
+        if self.adaptive_timeout and date != self.histogram_date:
+            histograms = self._load_histograms(list(self.jobs.keys()))
+
+            if histograms is not None:
+                self.histogram_date = date
+
+                for (id_, job) in self.jobs.items():
+                    job.histogram = histograms.get(id_, CrabHistogram())
+
+    def _initialize_job(self, id_, load_events=False, histograms=None):
         """Fetches information about the specified job and records it
-        in the instance data structures.  Includes a call to _schedule_job."""
+        in the instance data structures.  Includes a call to _schedule_job.
+
+        If adaptive timeouts are in use, the job's duration histogram
+        is taken from the given dictionary, or fetched if none
+        is given."""
 
         jobinfo = self.store.get_job_info(id_)
         if jobinfo is None or jobinfo['deleted'] is not None:
             raise JobDeleted
 
-        self.status[id_] = {'status': None, 'running': False, 'history': [],
-                            'installed': jobinfo['installed']}
+        job = self.jobs[id_] = CrabJobState(jobinfo['installed'])
+        self.status_dirty.add(id_)
+
+        if self.adaptive_timeout:
+            if histograms is None:
+                histograms = self._load_histograms([id_]) or {}
+
+            job.histogram = histograms.get(id_, CrabHistogram())
 
         self._schedule_job(id_, jobinfo)
         self._configure_job(id_)
@@ -246,63 +501,99 @@ class CrabMonitor(CrabMinutely):
                 self._update_max_id_values(event)
                 self._process_event(id_, event)
 
-            self._compute_reliability(id_)
-
     def _schedule_job(self, id_, jobinfo=None):
         """Sets or updates job scheduling information.
 
         The job information can either be passed in as a dict, or it
         will be fetched from the storage backend.  If scheduling information
         (i.e. a "time" string, and optionally a timezone) is present,
-        a CrabSchedule object is constructed and stored in the sched dict."""
+        a CrabSchedule object is constructed and stored in the job state."""
 
         if jobinfo is None:
             jobinfo = self.store.get_job_info(id_)
 
-        self.status[id_]['scheduled'] = False
+        job = self.jobs[id_]
+        job.schedule = None
+        job.scheduled = False
+        self.status_dirty.add(id_)
 
         if jobinfo is not None and jobinfo['time'] is not None:
             try:
-                self.sched[id_] = CrabSchedule(jobinfo['time'],
-                                               jobinfo['timezone'])
+                job.schedule = CrabSchedule(jobinfo['time'],
+                                            jobinfo['timezone'])
             except CrabError as err:
                 print('Warning: could not add schedule:', str(err))
 
             else:
-                self.status[id_]['scheduled'] = True
+                job.scheduled = True
 
     def _configure_job(self, id_):
         """Sets the job configuration.
 
         The configuration will be fetched from the storage backend
-        and stored in the config dict."""
+        and stored in the job state."""
 
         default_time = {'graceperiod': 2, 'timeout': 5}
 
-        if id_ not in self.config:
-            self.config[id_] = {}
-
+        job = self.jobs[id_]
         dbconfig = self.store.get_job_config(id_)
 
         for parameter in default_time:
             if dbconfig is not None and dbconfig[parameter] is not None:
-                self.config[id_][parameter] = timedelta(
-                                              minutes=dbconfig[parameter])
+                setattr(job, parameter, timedelta(
+                    minutes=dbconfig[parameter]))
             else:
-                self.config[id_][parameter] = timedelta(
-                                              minutes=default_time[parameter])
+                setattr(job, parameter, timedelta(
+                    minutes=default_time[parameter]))
+
+        job.fixed_timeout = (dbconfig is not None and
+                             dbconfig['timeout'] is not None)
+
+    def _load_histograms(self, ids):
+        """Fetches histograms of the run durations of the given jobs,
+        for the configured number of days, if adaptive timeouts
+        are in use.
+
+        Returns a dictionary of histograms by job ID number,
+        or None if they could not be fetched."""
+
+        if not (self.adaptive_timeout and ids):
+            return {}
+
+        try:
+            return self.store.get_jobs_histograms(
+                ids, start=(datetime.now(pytz.UTC) -
+                            timedelta(days=self.timeout_days)).date())
+
+        except CrabError as err:
+            print('Error: could not fetch job durations:', str(err))
+            return None
+
+    def _get_timeout(self, job):
+        """Determines the timeout for a run of the given job.
+
+        This is the configured timeout, unless adaptive timeouts are in
+        use, the job does not have an explicitly configured timeout and
+        enough of its runs have been seen."""
+
+        if (self.adaptive_timeout and not job.fixed_timeout and
+                job.histogram is not None and
+                job.histogram.total >= self.timeout_min_runs):
+            timeout = timedelta(seconds=(
+                self.timeout_factor *
+                job.histogram.percentile(self.timeout_percentile)))
+
+            return min(max(timeout, self.timeout_min), self.timeout_max)
+
+        return job.timeout
 
     def _remove_job(self, id_):
         """Removes a job from the instance data structures."""
 
+        self.status_dirty.add(id_)
+
         try:
-            del self.status[id_]
-            if id_ in self.config:
-                del self.config[id_]
-            if id_ in self.sched:
-                del self.sched[id_]
-            if id_ in self.last_start:
-                del self.last_start[id_]
+            del self.jobs[id_]
             if id_ in self.timeout:
                 del self.timeout[id_]
             if id_ in self.late_timeout:
@@ -331,34 +622,33 @@ class CrabMonitor(CrabMinutely):
         structures accordingly."""
 
         datetime_ = event['datetime']
+        job = self.jobs[id_]
+        self.status_dirty.add(id_)
 
         if event['status'] is not None:
             status = event['status']
-            prevstatus = self.status[id_]['status']
+            prevstatus = job.status
 
             # Avoid overwriting a status with a less important one.
 
             if status == CrabStatus.CLEARED:
-                self.status[id_]['status'] = status
+                job.status = status
 
             elif CrabStatus.is_trivial(status):
                 if prevstatus is None or CrabStatus.is_ok(prevstatus):
-                    self.status[id_]['status'] = status
+                    job.status = status
 
             elif CrabStatus.is_warning(status):
                 if prevstatus is None or not CrabStatus.is_error(prevstatus):
-                    self.status[id_]['status'] = status
+                    job.status = status
 
             # Always set success / failure status (the remaining options).
 
             else:
-                self.status[id_]['status'] = status
+                job.status = status
 
             if not CrabStatus.is_trivial(status):
-                history = self.status[id_]['history']
-                if len(history) >= HISTORY_COUNT:
-                    del history[0]
-                history.append(status)
+                job.add_history(status)
 
         # Handle ALREADYRUNNING as a 'start' type event, so that
         # the MISSED alarm is not raised and the timeout period
@@ -366,10 +656,10 @@ class CrabMonitor(CrabMinutely):
 
         if (event['type'] == CrabEvent.START or
                 event['status'] == CrabStatus.ALREADYRUNNING):
-            self.status[id_]['running'] = True
+            job.running = True
             if not self.passive:
-                self.last_start[id_] = datetime_
-                self.timeout[id_] = datetime_ + self.config[id_]['timeout']
+                job.last_start = datetime_
+                self.timeout[id_] = datetime_ + self._get_timeout(job)
                 if id_ in self.late_timeout:
                     del self.late_timeout[id_]
                 if id_ in self.miss_timeout:
@@ -377,23 +667,53 @@ class CrabMonitor(CrabMinutely):
 
         elif (event['type'] == CrabEvent.FINISH or
                 event['status'] == CrabStatus.TIMEOUT):
-            self.status[id_]['running'] = False
+            job.running = False
             if not self.passive:
                 if id_ in self.timeout:
                     del self.timeout[id_]
 
-    def _compute_reliability(self, id_):
-        """Uses the history list of the specified job to recalculate its
-        reliability percentage and store it in the 'reliability'
-        entry of the status dict."""
-
-        history = self.status[id_]['history']
-        if len(history) == 0:
-            self.status[id_]['reliability'] = 0
-        else:
-            self.status[id_]['reliability'] = int(
-                100 * len([x for x in history if x == CrabStatus.SUCCESS]) /
-                len(history))
+    def _publish_status(self):
+        """Publishes a snapshot of the current job status.
+
+        This is done copy-on-write: the new snapshot's status dictionary
+        shares the immutable CrabJobStatus records of the previous
+        snapshot, except for jobs marked as changed in the status_dirty
+        set, for which new records are constructed.  The snapshot
+        is then published by a single assignment, so other threads
+        can read it without locking and never see a partial update.
+        The warning and error counts are adjusted for the changed jobs
+        at the same time."""
+
+        previous = self.snapshot
+        status = previous.status.copy()
+        counts = [0, previous.numwarning, previous.numerror]
+
+        for id_ in self.status_dirty:
+            old = status.pop(id_, None)
+            if old is not None:
+                counts[old.severity] -= 1
+
+            job = self.jobs.get(id_)
+            if job is None:
+                continue
+
+            new = status[id_] = CrabJobStatus(
+                status=job.status,
+                running=job.running,
+                reliability=job.reliability,
+                scheduled=job.scheduled,
+                installed=job.installed,
+                history=job.get_history())
+
+            counts[new.severity] += 1
+
+        self.status_dirty = set()
+        self.num_warning = counts[1]
+        self.num_error = counts[2]
+
+        self.snapshot = CrabStatusSnapshot(
+            self.max_startid, self.max_alarmid, self.max_finishid,
+            status, self.num_warning, self.num_error)
 
     def _write_alarm(self, id_, status):
         """Inserts an alarm into the storage backend."""
@@ -402,6 +722,9 @@ class CrabMonitor(CrabMinutely):
             print('Warning: trying to write alarm in passive mode')
             return
 
+        if self.lease is not None and not self.lease.is_held():
+            return
+
         try:
             self.store.log_alarm(id_, status)
         except CrabError as err:
@@ -410,39 +733,46 @@ class CrabMonitor(CrabMinutely):
     def get_job_status(self, id_=None):
         """Fetches the status of all jobs as a dict.
 
-        For efficiency this returns a reference to our job status dict.
-        Callers should not modify it.  If a job ID is specified, the
-        status entry for that job is returned, or a dummy entry if it is not
-        in the status dict."""
+        This returns the status dict from the most recently published
+        snapshot, containing CrabJobStatus records.  If a job ID is
+        specified, the record for that job is returned, or a dummy
+        entry if it is not in the status dict."""
 
         self.status_ready.wait()
 
+        status = self.snapshot.status
+
         if id_ is None:
-            return self.status
+            return status
 
         else:
-            if id_ in self.status:
-                return self.status[id_]
-            else:
-                return {'status': None, 'running': False}
+            return status.get(id_, UNKNOWN_JOB_STATUS)
 
     def wait_for_event_since(self, startid, alarmid, finishid, timeout=120):
         """Function which waits for new events.
 
-        It does this by comparing the IDs with our maximum values seen so
-        far.  If no new events have already be seen, wait for the new_event
-        Condition to fire.
+        It does this by comparing the IDs with those of the most recently
+        published status snapshot.  If no new events have already be seen,
+        wait for the new_event Condition to fire.
+
+        A random time up to 20s is added to the timeout to stagger requests.
+
+        Returns a CrabStatusSnapshot object, which is shared between all
+        callers waiting for the same events."""
+
+        self.status_ready.wait()
 
-        A random time up to 20s is added to the timeout to stagger requests."""
+        snapshot = self.snapshot
 
-        if (self.max_startid > startid or
-                self.max_alarmid > alarmid or
-                self.max_finishid > finishid):
+        if (snapshot.startid > startid or
+                snapshot.alarmid > alarmid or
+                snapshot.finishid > finishid):
             pass
         else:
             with self.new_event:
-                self.new_event.wait(timeout + self.random.randint(0, 20))
+                # Check that a new snapshot was not published before
+                # we acquired the Condition's lock.
+                if self.snapshot is snapshot:
+                    self.new_event.wait(timeout + self.random.randint(0, 20))
 
-        return {'startid': self.max_startid, 'alarmid': self.max_alarmid,
-                'finishid': self.max_finishid, 'status': self.status,
-                'numwarning': self.num_warning, 'numerror': self.num_error}
+        return self.snapshot
@@ -16,41 +16,246 @@
 
 from __future__ import print_function
 
-from crab import CrabError
-from crab.notify import CrabNotify, CrabNotifyJob
+from collections import deque
+from datetime import datetime, timedelta
+import heapq
+from itertools import count
+import pytz
+from threading import Event
+
+from crab import CrabError, CrabStatus
+from crab.notify import CrabNotifyJob
 from crab.service import CrabMinutely
 from crab.util.schedule import CrabSchedule
 
+# Statuses for which immediate alerts are sent.
+ALERT_STATUS = frozenset((CrabStatus.FAIL, CrabStatus.COULDNOTSTART,
+                          CrabStatus.TIMEOUT, CrabStatus.MISSED))
+
+
+class CrabAlertBatch(object):
+    """Alerts waiting to be sent to a single recipient.
+
+    The "jobs" dictionary contains a [notification, start, end] list
+    for each job, giving the range of times of its events, so that
+    events for the same job are reported only once."""
+
+    __slots__ = ('send', 'jobs')
+
+    def __init__(self, send):
+        self.send = send
+        self.jobs = {}
+
+    def add(self, id_, notification, datetime_):
+        """Adds an event at the given time for the given job."""
+
+        entry = self.jobs.get(id_)
+
+        if entry is None:
+            self.jobs[id_] = [notification, datetime_, datetime_]
+        else:
+            entry[1] = min(entry[1], datetime_)
+            entry[2] = max(entry[2], datetime_)
+
 
 class CrabNotifyService(CrabMinutely):
     """Service to send notifications as required.
 
-    Currently only a single daily schedule is implemented."""
+    Scheduled notifications are kept in an index (a heap) by the time
+    at which they are next due, so that each minute only the schedules
+    which have fired need to be examined.  Notifications without their
+    own schedule use a single daily schedule.  The notifications
+    are also indexed by job ID.  The list of notifications is only
+    re-read from the store when its notification_version attribute shows
+    that they may have changed, and at the interval given by the "refresh"
+    configuration parameter (in minutes), in case they were changed
+    by another server sharing the database.
+
+    If the "alert" configuration parameter is set, failures, timeouts
+    and missed jobs reported by the monitor (via the add_event listener)
+    are also notified immediately.  Alerts are collected for each
+    recipient for "alert_window" seconds, and at most one message is
+    sent to each recipient in every "alert_interval" seconds."""
 
-    def __init__(self, config, store, notify):
+    def __init__(self, config, store, notify, lease=None):
         """Constructor method.
 
-        Stores CrabNotify object and daily CrabSchedule object."""
+        Stores CrabNotify object and daily CrabSchedule object.
+        If a lease is given, notifications are only sent while it
+        is held."""
 
         CrabMinutely.__init__(self)
 
         self.store = store
         self.notify = notify
+        self.lease = lease
         self.schedule = CrabSchedule(config['daily'],
                                      config['timezone'])
-        self.config = {}
-        self.sched = {}
+        self.refresh = timedelta(minutes=int(config.get('refresh', 15)))
+
+        self.index = []
+        self.sequence = count()
+        self.due = {}
+        self.sched = {None: self.schedule}
+        self.members = {}
+        self.job_notifications = {}
+        self.refreshed = None
+        self.version = None
+
+        self.alert = bool(config.get('alert', False))
+        self.alert_window = timedelta(
+            seconds=int(config.get('alert_window', 60)))
+        self.alert_interval = timedelta(
+            seconds=int(config.get('alert_interval', 900)))
+        self.alert_queue = deque()
+        self.alert_ready = Event()
+        self.alert_pending = {}
+        self.alert_sent = {}
+
+    def run(self):
+        """Thread run function.
+
+        Waits for alerts to be queued, processing them as they arrive,
+        and calls _check_minute from CrabMinutely at least every
+        few seconds."""
+
+        while True:
+            self.alert_ready.wait(5)
+            self.alert_ready.clear()
+
+            try:
+                self.process_alerts(datetime.now(pytz.UTC))
+            except Exception as e:
+                print('Error: could not process alerts:', str(e))
+
+            self._check_minute()
 
     def run_minutely(self, datetime_):
-        """Issues notifications if any are scheduled for the given minute."""
+        """Issues notifications if any are scheduled for the given minute.
+
+        When the lease is not held, the index is advanced past the
+        given minute without sending notifications."""
+
+        held = self.lease is None or self.lease.is_held()
+
+        if held and self._is_stale(datetime_):
+            self._refresh(datetime_)
 
         current = []
-        match_daily = self.schedule.match(datetime_)
 
-        if match_daily:
-            daily_start = self.schedule.previous_datetime(datetime_)
+        while self.index and self.index[0][0] <= datetime_:
+            (fire, sequence, key) = heapq.heappop(self.index)
+
+            # Skip entries which have been superseded or removed.
+            if self.due.get(key) != sequence:
+                continue
+
+            schedule = self.sched[key]
+            start = schedule.previous_datetime(fire)
+
+            for notification in self.members[key]:
+                current.append(CrabNotifyJob(notification, start, fire))
+
+            self._push(key, schedule.next_datetime(fire))
+
+        if current and held:
+            self.notify(current)
+
+    def add_event(self, id_, event):
+        """Queues an event for immediate notification.
+
+        This is intended to be given to the monitor as a listener.
+        It is called from the monitor thread, so just adds events
+        with a status in ALERT_STATUS to a queue for this thread."""
+
+        if event['status'] in ALERT_STATUS:
+            self.alert_queue.append((id_, event))
+            self.alert_ready.set()
+
+    def process_alerts(self, datetime_):
+        """Collects queued alerts by recipient, and sends those for
+        which the coalescing window and minimum interval have passed."""
+
+        held = self.lease is None or self.lease.is_held()
+
+        if held and self.alert_queue and self._is_stale(datetime_):
+            self._refresh(datetime_.replace(second=0, microsecond=0))
+
+        while self.alert_queue:
+            (id_, event) = self.alert_queue.popleft()
+
+            if held:
+                self._add_alert(id_, event, datetime_)
+
+        if not held:
+            self.alert_pending = {}
+            return
+
+        current = []
+
+        for (recipient, batch) in list(self.alert_pending.items()):
+            if batch.send <= datetime_:
+                del self.alert_pending[recipient]
+                self.alert_sent[recipient] = datetime_
+
+                for (notification, start, end) in batch.jobs.values():
+                    current.append(CrabNotifyJob(
+                        dict(notification, skip_ok=True),
+                        start, end + timedelta(seconds=1)))
+
+        for (recipient, sent) in list(self.alert_sent.items()):
+            if sent + self.alert_interval <= datetime_:
+                del self.alert_sent[recipient]
+
+        if current:
+            self.notify(current)
+
+    def _add_alert(self, id_, event, datetime_):
+        """Adds an event to the batch of alerts for each recipient
+        of the job's notifications, unless they skip events of its
+        severity."""
+
+        if CrabStatus.is_warning(event['status']):
+            skip = 'skip_warning'
         else:
-            daily_start = None
+            skip = 'skip_error'
+
+        for notification in self.job_notifications.get(id_, ()):
+            if notification[skip]:
+                continue
+
+            recipient = (notification['method'], notification['address'])
+            batch = self.alert_pending.get(recipient)
+
+            if batch is None:
+                send = datetime_ + self.alert_window
+                sent = self.alert_sent.get(recipient)
+
+                if sent is not None:
+                    send = max(send, sent + self.alert_interval)
+
+                batch = self.alert_pending[recipient] = CrabAlertBatch(send)
+
+            batch.add(id_, notification, event['datetime'])
+
+    def _is_stale(self, datetime_):
+        """Determines whether the list of notifications should be
+        re-read from the store."""
+
+        return (self.refreshed is None or
+                self.refreshed + self.refresh <= datetime_ or
+                self.version != getattr(self.store, 'notification_version',
+                                        None))
+
+    def _refresh(self, datetime_):
+        """Re-reads the list of notifications from the store.
+
+        Notifications are grouped by schedule, and schedules which were
+        not already in the index are added, due at the first time they
+        match after the previous refresh, so that they are not missed if
+        they were due in the meantime."""
+
+        version = getattr(self.store, 'notification_version', None)
 
         try:
             notifications = self.store.get_notifications()
@@ -59,37 +264,56 @@ class CrabNotifyService(CrabMinutely):
             print('Error fetching notifications:', str(err))
             return
 
+        if self.refreshed is None:
+            since = datetime_ - timedelta(minutes=1)
+        else:
+            since = self.refreshed
+
+        members = {}
+        job_notifications = {}
+        sched = {None: self.schedule}
+
         for notification in notifications:
-            n_id = notification['notifyid']
-
-            if (n_id in self.config and n_id in self.sched and
-                    notification['time'] == self.config[n_id]['time'] and
-                    notification['timezone'] == self.config[n_id]['timezone']):
-                schedule = self.sched[n_id]
-            else:
-                self.config[n_id] = notification
-                if notification['time'] is not None:
-                    try:
-                        schedule = CrabSchedule(notification['time'],
-                                                notification['timezone'])
-                    except CrabError as err:
-                        schedule = None
-                        print('Warning: could not read notification schedule:',
-                              str(err))
-                else:
-                    schedule = None
-
-                self.sched[n_id] = schedule
-
-            if schedule is None:
-                if match_daily:
-                    current.append(CrabNotifyJob(
-                        notification, daily_start, datetime_))
-            else:
-                if schedule.match(datetime_):
-                    current.append(CrabNotifyJob(
-                        notification, schedule.previous_datetime(datetime_),
-                        datetime_))
+            key = None
 
-        if current:
-            self.notify(current)
+            if notification['time'] is not None:
+                key = (notification['time'], notification['timezone'])
+
+                if key not in sched:
+                    if key in self.sched:
+                        sched[key] = self.sched[key]
+                    else:
+                        try:
+                            sched[key] = CrabSchedule(*key)
+                        except CrabError as err:
+                            sched[key] = None
+                            print('Warning: could not read notification '
+                                  'schedule:', str(err))
+
+                if sched[key] is None:
+                    key = None
+
+            members.setdefault(key, []).append(notification)
+            job_notifications.setdefault(
+                notification['id'], []).append(notification)
+
+        self.sched = sched
+        self.members = members
+        self.job_notifications = job_notifications
+        self.refreshed = datetime_
+        self.version = version
+
+        for key in list(self.due.keys()):
+            if key not in members:
+                del self.due[key]
+
+        for key in members:
+            if key not in self.due:
+                self._push(key, sched[key].next_datetime(since))
+
+    def _push(self, key, fire):
+        """Adds a schedule to the index, due at the given time."""
+
+        sequence = next(self.sequence)
+        self.due[key] = sequence
+        heapq.heappush(self.index, (fire, sequence, key))
@@ -16,11 +16,96 @@
 
 from __future__ import print_function
 
+from crab import CrabError
 from crab.util.crontab import parse_crontab, write_crontab
 from crab.util.statuspattern import check_status_patterns
 
+# Approximate amount of live output (in characters) to keep for each job.
+LIVE_OUTPUT_SIZE = 1024 * 1024
+
+
+class CrabJobIndex:
+    """In-memory copy of the job records for a host and user, as
+    returned by the store's _get_jobs method (including deleted jobs).
+
+    This can be given to the store's _check_job method in place of
+    querying the database for each job, and is updated to reflect the
+    changes which _check_job makes.  The "find" method returns matching
+    jobs in the order in which _get_jobs would have returned them.
+
+    Job identifiers are compared ignoring case unless "case_sensitive"
+    is specified, which should match the behavior of the database."""
+
+    def __init__(self, jobs, case_sensitive=False):
+        self.jobs = list(jobs)
+        self.order = dict((job['id'], i) for (i, job) in enumerate(self.jobs))
+        self.counter = len(self.jobs)
+        self.case_sensitive = case_sensitive
+
+    def find(self, crabid=None, command=None, without_crabid=False):
+        """Finds jobs matching the given criteria."""
+
+        if crabid is not None:
+            crabid = self._crabid_key(crabid)
+
+        matches = [
+            job for job in self.jobs
+            if (crabid is None or
+                (job['crabid'] is not None and
+                 self._crabid_key(job['crabid']) == crabid)) and
+            (command is None or job['command'] == command) and
+            not (without_crabid and job['crabid'] is not None)]
+
+        # Order as _get_jobs does: by crabid (nulls first) and then
+        # installation time (so that updated jobs come last).
+        matches.sort(key=lambda job: (job['crabid'] is not None,
+                                      self._crabid_key(job['crabid'] or ''),
+                                      self.order[job['id']]))
+
+        return matches
+
+    def insert(self, id_, crabid, command, time, timezone):
+        """Records that a job has been inserted."""
+
+        self.jobs.append({'id': id_, 'crabid': crabid, 'command': command,
+                          'time': time, 'timezone': timezone,
+                          'deleted': None})
+        self._touch(id_)
+
+    def update(self, job, crabid=None, command=None, time=None,
+               timezone=None):
+        """Records that a job has been updated, as by the store's
+        _update_job method."""
+
+        job['deleted'] = None
+
+        for (key, value) in (('crabid', crabid), ('command', command),
+                             ('time', time), ('timezone', timezone)):
+            if value is not None:
+                job[key] = value
+
+        self._touch(job['id'])
+
+    def _touch(self, id_):
+        """Marks a job as the most recently installed."""
+
+        self.order[id_] = self.counter
+        self.counter += 1
+
+    def _crabid_key(self, crabid):
+        """Prepares a job identifier for comparison."""
+
+        if self.case_sensitive:
+            return crabid
+
+        return crabid.lower()
+
 
 class CrabStore:
+    # Whether the store distinguishes job identifiers which differ
+    # only in case.
+    crabid_case_sensitive = False
+
     def get_jobs(self, host=None, user=None, **kwargs):
         """Fetches a list of all of the cron jobs,
         excluding deleted jobs by default.
@@ -51,9 +136,12 @@ class CrabStore:
         with self.lock as c:
             self._update_job(c, id_, **kwargs)
 
-    def log_start(self, host, user, crabid, command):
+    def log_start(self, host, user, crabid, command, datetime_=None):
         """Inserts a job start record into the database.
 
+        The start is recorded at the current time, unless a datetime
+        is given, for example for an event reported late by a client.
+
         Returns a dictionary including a boolean value indicating
         whether the job inhibit setting is active or not."""
 
@@ -62,7 +150,7 @@ class CrabStore:
         with self.lock as c:
             id_ = self._check_job(c, host, user, crabid, command)
 
-            self._log_start(c, id_, command)
+            self._log_start(c, id_, command, datetime_)
 
             # Read the job configuration in order to determine whether
             # this job is currently inhibited.
@@ -71,14 +159,18 @@ class CrabStore:
             if config is not None and config['inhibit']:
                 data['inhibit'] = True
 
+        # Discard any live output left from a previous run of the job.
+        self._discard_live_output(host, user, id_)
+
         return data
 
     def log_finish(self, host, user, crabid, command, status,
-                   stdout=None, stderr=None):
+                   stdout=None, stderr=None, datetime_=None):
         """Inserts a job finish record into the database.
 
         The output will be passed to the write_job_output method,
-        unless both stdout and stderr are empty."""
+        unless both stdout and stderr are empty.  As for log_start,
+        a datetime can be given for the finish."""
 
         with self.lock as c:
             id_ = self._check_job(c, host, user, crabid, command)
@@ -91,7 +183,96 @@ class CrabStore:
                     '\n'.join((x for x in (stdout, stderr)
                                if x is not None)))
 
-            finishid = self._log_finish(c, id_, command, status)
+            finishid = self._log_finish(c, id_, command, status, datetime_)
+
+        # The live output is superseded by the output sent on finishing.
+        self._discard_live_output(host, user, id_)
+
+        self._write_finish_output(finishid, host, user, id_, crabid,
+                                  stdout, stderr)
+
+    def log_events(self, events):
+        """Inserts a batch of job start and finish records into the
+        database in a single transaction.
+
+        Each event is a dictionary containing the action ("start" or
+        "finish"), host, user, crabid, command and datetime (which may be
+        None), and for finish events the status, stdout and stderr.
+        The events should already have been checked by the caller.
+
+        Returns a list containing a dictionary for each event.  For start
+        events this indicates whether the job is inhibited, as for
+        log_start.
+
+        Since the events may have been delayed, for example by being
+        spooled by the client, live output is only discarded for jobs
+        whose latest event is a finish in this batch."""
+
+        results = []
+        latest = {}
+        outputs = []
+        live_jobs = self._live_output_jobs()
+        clear = []
+
+        with self.lock as c:
+            for event in events:
+                (host, user, crabid, command) = (
+                    event['host'], event['user'], event['crabid'],
+                    event['command'])
+
+                id_ = self._check_job(c, host, user, crabid, command)
+
+                config = self._get_job_config(c, id_)
+
+                if event['action'] == 'start':
+                    self._log_start(c, id_, command, event['datetime'])
+                    latest[id_] = None
+
+                    results.append({'inhibit': bool(
+                        config is not None and config['inhibit'])})
+
+                else:
+                    (status, stdout, stderr) = (
+                        event['status'], event['stdout'], event['stderr'])
+
+                    if config is not None:
+                        status = check_status_patterns(
+                            status, config,
+                            '\n'.join((x for x in (stdout, stderr)
+                                       if x is not None)))
+
+                    finishid = self._log_finish(c, id_, command, status,
+                                                event['datetime'])
+
+                    outputs.append((finishid, host, user, id_, crabid,
+                                    stdout, stderr))
+
+                    latest[id_] = (host, user, event['datetime'])
+
+                    results.append({})
+
+            for (id_, finish) in latest.items():
+                if finish is None or id_ not in live_jobs:
+                    continue
+
+                (host, user, datetime_) = finish
+
+                if datetime_ is None or not self._has_start_after(
+                        c, id_, datetime_):
+                    clear.append((host, user, id_))
+
+        for (host, user, id_) in clear:
+            self._discard_live_output(host, user, id_)
+
+        for output in outputs:
+            self._write_finish_output(*output)
+
+        return results
+
+    def _write_finish_output(self, finishid, host, user, id_, crabid,
+                             stdout, stderr):
+        """Writes the output of a job, as received on finishing,
+        unless both stdout and stderr are empty."""
 
         if stdout or stderr:
             # If a crabid was not specified, check whether the job
@@ -105,6 +286,15 @@ class CrabStore:
             self.write_job_output(finishid, host, user, id_, crabid,
                                   stdout, stderr)
 
+    def log_output(self, host, user, crabid, command,
+                   stdout=None, stderr=None):
+        """Appends output from a running job to its live output."""
+
+        with self.lock as c:
+            id_ = self._check_job(c, host, user, crabid, command)
+
+        self.write_live_output(host, user, id_, stdout or '', stderr or '')
+
     def get_job_config(self, id_):
         """Retrieve configuration data for a job by ID number."""
 
@@ -144,6 +334,106 @@ class CrabStore:
             return self._get_job_output(
                 c, finishid, host, user, id_, crabid)
 
+    def get_job_outputs(self, finishes):
+        """Fetches the standard output and standard error for a number
+        of job finishes.
+
+        The finishes are given as (finishid, host, user, id_, crabid)
+        tuples, as for the arguments of get_job_output.  Returns
+        a dictionary of (stdout, stderr) pairs by finish ID.
+
+        This will use the outputstore's corresponding method if it is defined,
+        otherwise it reads from this store."""
+
+        finishes = list(finishes)
+
+        if self.outputstore is not None:
+            if hasattr(self.outputstore, 'get_job_outputs'):
+                return self.outputstore.get_job_outputs(finishes)
+
+            return dict((finish[0], self.outputstore.get_job_output(*finish))
+                        for finish in finishes)
+
+        with self.lock as c:
+            return self._get_job_outputs(c, [x[0] for x in finishes])
+
+    def write_live_output(self, host, user, id_, stdout, stderr):
+        """Appends to the live output of a running job.
+
+        This will use the outputstore's corresponding method if it is defined,
+        otherwise it writes to this store."""
+
+        self._live_output_jobs().add(id_)
+
+        if self.outputstore is not None and hasattr(self.outputstore,
+                                                    'write_live_output'):
+            return self.outputstore.write_live_output(
+                host, user, id_, stdout, stderr)
+
+        with self.lock as c:
+            return self._write_live_output(c, id_, stdout, stderr)
+
+    def get_live_output(self, host, user, id_):
+        """Fetches the live output of a running job.
+
+        Returns a pair of strings, which are empty if there
+        is no live output."""
+
+        if self.outputstore is not None and hasattr(self.outputstore,
+                                                    'get_live_output'):
+            return self.outputstore.get_live_output(host, user, id_)
+
+        with self.lock as c:
+            return self._get_live_output(c, id_)
+
+    def get_live_output_jobs(self):
+        """Fetches the set of ID numbers of jobs which have live output.
+
+        This will use the outputstore's corresponding method if it is defined,
+        otherwise it reads from this store."""
+
+        if self.outputstore is not None and hasattr(self.outputstore,
+                                                    'get_live_output_jobs'):
+            return self.outputstore.get_live_output_jobs()
+
+        with self.lock as c:
+            return self._get_live_output_jobs(c)
+
+    def clear_live_output(self, host, user, id_):
+        """Discards the live output of a job."""
+
+        if self.outputstore is not None and hasattr(self.outputstore,
+                                                    'clear_live_output'):
+            return self.outputstore.clear_live_output(host, user, id_)
+
+        with self.lock as c:
+            return self._clear_live_output(c, id_)
+
+    def _discard_live_output(self, host, user, id_):
+        """Discards the live output of a job if any has been written,
+        so that jobs which do not send live output do not incur
+        the cost of clearing it."""
+
+        live_jobs = self._live_output_jobs()
+
+        if id_ in live_jobs:
+            live_jobs.discard(id_)
+            self.clear_live_output(host, user, id_)
+
+    def _live_output_jobs(self):
+        """Returns the set of ID numbers of jobs which may have
+        live output.
+
+        The set is read from the store when first required, and
+        thereafter maintained in memory.  Live output written by another
+        server sharing the database is therefore not discarded by this
+        server, but is removed with old events by delete_old_events."""
+
+        if self.live_output_jobs is None:
+            self.live_output_jobs = self.get_live_output_jobs()
+
+        return self.live_output_jobs
+
     def get_crontab(self, host, user):
         """Fetches the job entries for a particular host and user and builds
         a crontab style representation.
@@ -169,15 +459,16 @@ class CrabStore:
         skipped if they have a specified user name or client host name
         which does not match the given host or user name.
 
-        Returns a list of warning strings."""
+        The existing jobs are read in a single query and compared with
+        the crontab in memory, so that the database is only written to
+        for jobs which have changed.  Similarly the raw crontab is only
+        written if it differs from the stored copy.
 
-        # Save the raw crontab.
-        self.write_raw_crontab(host, user, crontab)
+        Returns a list of warning strings."""
 
-        # Prepare set of existing job ID numbers.
-        idset = set()
-        for job in self.get_jobs(host, user):
-            idset.add(job['id'])
+        # Save the raw crontab, if it has changed.
+        if self.get_raw_crontab(host, user) != crontab:
+            self.write_raw_crontab(host, user, crontab)
 
         # Parse the crontab.
         (jobs, warning) = parse_crontab(crontab, timezone=timezone)
@@ -186,6 +477,14 @@ class CrabStore:
         # job from the idset set as we encounter it.
         idsaved = set()
         with self.lock as c:
+            index = CrabJobIndex(
+                self._get_jobs(c, host, user, include_deleted=True),
+                case_sensitive=self.crabid_case_sensitive)
+
+            # Prepare set of existing job ID numbers.
+            idset = set(job['id'] for job in index.jobs
+                        if job['deleted'] is None)
+
             for job in jobs:
                 if allow_filter:
                     vars_ = job['vars']
@@ -204,7 +503,8 @@ class CrabStore:
 
                 id_ = self._check_job(
                     c, host, user, job['crabid'],
-                    job['command'], job['time'], job['timezone'])
+                    job['command'], job['time'], job['timezone'],
+                    index=index)
 
                 if id_ in idsaved:
                     warning.append(
@@ -230,7 +530,7 @@ class CrabStore:
             return self._check_job(c, *args, **kwargs)
 
     def _check_job(self, c, host, user, crabid, command,
-                   time=None, timezone=None):
+                   time=None, timezone=None, index=None):
         """Ensure that a job exists in the store.
 
         Tries to find (and update if necessary) the corresponding job.
@@ -238,16 +538,33 @@ class CrabStore:
 
         In either case, the job's ID number is returned.
 
+        If a CrabJobIndex for the host and user is given, jobs are looked
+        up in it rather than in the database, and it is kept up to date.
+
         This is a private method because the lock must be acquired
         prior to calling it."""
 
+        if index is None:
+            def find(**kwargs):
+                return self._get_jobs(c, host, user, include_deleted=True,
+                                      **kwargs)
+
+            def update(job, *args):
+                self._update_job(c, job['id'], *args)
+
+        else:
+            find = index.find
+
+            def update(job, *args):
+                self._update_job(c, job['id'], *args)
+                index.update(job, *args)
+
         id_ = None
 
         # We know the crabid, so use it to search
 
         if crabid is not None:
-            jobs = self._get_jobs(c, host, user, include_deleted=True,
-                                  crabid=crabid)
+            jobs = find(crabid=crabid)
 
             if jobs:
                 job = jobs[0]
@@ -260,24 +577,26 @@ class CrabStore:
                     pass
 
                 else:
-                    self._update_job(c, id_, None, command, time, timezone)
+                    update(job, None, command, time, timezone)
 
             else:
                 # Need to check if the job already existed without
                 # a job ID, in which case we update it to add the job ID.
 
-                jobs = self._get_jobs(c, host, user, include_deleted=True,
-                                      command=command, without_crabid=True)
+                jobs = find(command=command, without_crabid=True)
                 if jobs:
                     job = jobs[0]
                     id_ = job['id']
 
-                    self._update_job(c, id_, crabid, None, time, timezone)
+                    update(job, crabid, None, time, timezone)
 
                 else:
                     id_ = self._insert_job(c, host, user, crabid, time,
                                            command, timezone)
 
+                    if index is not None:
+                        index.insert(id_, crabid, command, time, timezone)
+
         # We don't know the crabid, so we must search by command.
         # In general we can't distinguish multiple copies of the same
         # command running at different times.
@@ -285,8 +604,7 @@ class CrabStore:
         # time ranges / steps.
 
         else:
-            jobs = self._get_jobs(c, host, user, include_deleted=True,
-                                  command=command)
+            jobs = find(command=command)
 
             if jobs:
                 job = jobs[0]
@@ -298,12 +616,15 @@ class CrabStore:
                     pass
 
                 else:
-                    self._update_job(c, id_, None, None, time, timezone)
+                    update(job, None, None, time, timezone)
 
             else:
                 id_ = self._insert_job(c, host, user, crabid,
                                        time, command, timezone)
 
+                if index is not None:
+                    index.insert(id_, crabid, command, time, timezone)
+
         if id_ is None:
             raise CrabError('store error: failed to identify job')
 
@@ -21,15 +21,23 @@ from threading import Lock
 
 import pytz
 
-from crab import CrabError, CrabStatus
-from crab.store import CrabStore
+from crab import CrabError, CrabEvent, CrabStatus
+from crab.store import CrabStore, LIVE_OUTPUT_SIZE
+from crab.util.datetime import format_datetime
+from crab.util.histogram import CrabHistogram, duration_bucket
+
+# Maximum number of values to include in a single "IN" condition.
+MAX_IN_VALUES = 250
 
 
 class CrabDBLock():
-    def __init__(self, conn, error_class, cursor_args={}, ping=False):
+    def __init__(self, conn, error_class, cursor_args={}, ping=False,
+                 integrity_error=None):
         self.lock = Lock()
         self.conn = conn
         self.error_class = error_class
+        self.integrity_error = (error_class if integrity_error is None
+                                else integrity_error)
         self.cursor_args = cursor_args
         self.ping = ping
 
@@ -112,10 +120,19 @@ class CrabStoreDB(CrabStore):
         job output.  An outputstore should implement write_job_output
         and get_job_output, and if provided will be used instead of
         writing the stdout and stderr from the cron jobs to the database.
-        The outputstore should only raise instances of CrabError."""
+        The outputstore should only raise instances of CrabError.
+
+        The notification_version attribute is incremented whenever
+        a change is made which could affect the list of notifications
+        returned by get_notifications, allowing it to be cached.
+
+        The live_output_jobs attribute holds the set of jobs which may
+        have live output, once it has been read."""
 
         self.lock = lock
         self.outputstore = outputstore
+        self.notification_version = 0
+        self.live_output_jobs = None
 
     def _get_jobs(self, c, host, user, include_deleted=False,
                   crabid=None, command=None, without_crabid=False):
@@ -172,6 +189,8 @@ class CrabStoreDB(CrabStore):
                   'VALUES (?, ?, ?, ?, ?, ?)',
                   [host, user, crabid, time, command, timezone])
 
+        self.notification_version += 1
+
         return c.lastrowid
 
     def _delete_job(self, c, id_):
@@ -181,6 +200,8 @@ class CrabStoreDB(CrabStore):
                   'WHERE id=?',
                   [id_])
 
+        self.notification_version += 1
+
     def _update_job(self, c, id_,
                     crabid=None, command=None, time=None, timezone=None):
         """Marks a job as not deleted, and updates its information.
@@ -211,41 +232,449 @@ class CrabStoreDB(CrabStore):
         c.execute('UPDATE job SET ' + ', '.join(fields) + ' '
                   'WHERE id=?', params)
 
-    def _log_start(self, c, id_, command):
+        self.notification_version += 1
+
+    def _log_start(self, c, id_, command, datetime_=None):
         """Inserts a job start record into the database.
 
         Private method to perform only the actual insertion.  The lock
-        should already have been acquired."""
+        should already have been acquired.
+
+        The current time is used unless a datetime is given."""
 
-        c.execute('INSERT INTO jobstart (jobid, command) '
-                  'VALUES (?, ?)',
-                  [id_, command])
+        if datetime_ is None:
+            c.execute('INSERT INTO jobstart (jobid, command) '
+                      'VALUES (?, ?)',
+                      [id_, command])
+        else:
+            c.execute('INSERT INTO jobstart (jobid, command, datetime) '
+                      'VALUES (?, ?, ?)',
+                      [id_, command, format_datetime(datetime_)])
 
-    def _log_finish(self, c, id_, command, status):
+    def _log_finish(self, c, id_, command, status, datetime_=None):
         """Inserts a job finish record into the database.
 
         Private method to perform only the actual insertion.  The lock
         should already have been acquired.
 
+        The current time is used unless a datetime is given.
+        The finish is paired with the start of the run which it ended,
+        if found, and the run's duration recorded.  The job's statistics
+        for the day are also updated.
+
         Returns the finish record ID."""
 
-        c.execute('INSERT INTO jobfinish (jobid, command, status) ' +
-                  'VALUES (?, ?, ?)',
-                  [id_, command, status])
+        if datetime_ is None:
+            c.execute('INSERT INTO jobfinish (jobid, command, status) ' +
+                      'VALUES (?, ?, ?)',
+                      [id_, command, status])
+        else:
+            c.execute('INSERT INTO jobfinish '
+                      '(jobid, command, status, datetime) '
+                      'VALUES (?, ?, ?, ?)',
+                      [id_, command, status, format_datetime(datetime_)])
 
-        return c.lastrowid
+        finishid = c.lastrowid
+
+        if status != CrabStatus.ALREADYRUNNING:
+            if datetime_ is None:
+                datetime_ = self._query_to_dict(
+                    c,
+                    'SELECT datetime AS "datetime [timestamp]" '
+                    'FROM jobfinish WHERE id=?', [finishid])['datetime']
+
+            start = self._get_run_start(c, id_, finishid, datetime_)
+            duration = None
+
+            if start is not None:
+                duration = _duration_seconds(start['datetime'], datetime_)
+
+                c.execute('UPDATE jobfinish SET startid=?, duration=? '
+                          'WHERE id=?',
+                          [start['startid'], duration, finishid])
+
+            self._update_job_stats(
+                c, id_, datetime_, _stats_counts(CrabEvent.FINISH, status),
+                duration)
+
+        return finishid
+
+    def _get_run_start(self, c, id_, finishid, datetime_):
+        """Finds the start of the run of a job which ended with
+        the given finish.
+
+        This is the most recent start not followed by another
+        finish (other than ALREADYRUNNING).  Returns a dictionary
+        containing the startid and datetime, or None if there
+        is no such start."""
+
+        start = self._query_to_dict(
+            c,
+            'SELECT id AS startid, datetime AS "datetime [timestamp]" '
+            'FROM jobstart WHERE jobid=? AND datetime<=? '
+            'ORDER BY datetime DESC LIMIT 1',
+            [id_, format_datetime(datetime_)])
+
+        if start is None:
+            return None
+
+        other = self._query_to_dict(
+            c,
+            'SELECT id FROM jobfinish '
+            'WHERE jobid=? AND id<>? AND status<>? '
+            'AND datetime>=? AND datetime<=? LIMIT 1',
+            [id_, finishid, CrabStatus.ALREADYRUNNING,
+             format_datetime(start['datetime']), format_datetime(datetime_)])
+
+        if other is not None:
+            return None
+
+        return start
+
+    def _has_start_after(self, c, id_, datetime_):
+        """Determines whether a job has a start recorded after
+        the given datetime."""
 
-    def log_alarm(self, id_, status):
+        return self._query_to_dict(
+            c,
+            'SELECT id FROM jobstart WHERE jobid=? AND datetime>? LIMIT 1',
+            [id_, format_datetime(datetime_)]) is not None
+
+    def log_alarm(self, id_, status, datetime_=None):
         """Inserts an alarm regarding a job into the database.
 
         This is for alarms generated interally by crab, for example
         from the monitor thread.  Such alarms are currently stored
         in an separate table and do not have any associated output
-        records."""
+        records.  The job's statistics for the day are also updated.
+
+        The current time is used unless a datetime is given."""
 
         with self.lock as c:
+            self._log_alarm(c, id_, status, datetime_)
+
+    def _log_alarm(self, c, id_, status, datetime_=None):
+        """Inserts an alarm record into the database.
+
+        Private method to perform only the actual insertion (and update
+        the statistics).  The lock should already have been acquired."""
+
+        if datetime_ is None:
             c.execute('INSERT INTO jobalarm (jobid, status) VALUES (?, ?)',
                       [id_, status])
+        else:
+            c.execute('INSERT INTO jobalarm (jobid, status, datetime) '
+                      'VALUES (?, ?, ?)',
+                      [id_, status, format_datetime(datetime_)])
+
+        counts = _stats_counts(CrabEvent.ALARM, status)
+
+        if counts:
+            if datetime_ is None:
+                datetime_ = self._query_to_dict(
+                    c,
+                    'SELECT datetime AS "datetime [timestamp]" '
+                    'FROM jobalarm WHERE id=?', [c.lastrowid])['datetime']
+
+            self._update_job_stats(c, id_, datetime_, counts)
+
+    def import_job_events(self, id_, events):
+        """Inserts a batch of historical events for a job in a single
+        transaction, for example when importing a backup.
+
+        Each event is a dictionary containing the type (a CrabEvent value),
+        datetime, command (for starts and finishes) and status (for alarms
+        and finishes).  Finishes may also include stdout and stderr.
+        Unlike log_events, the job is identified by ID number, and the
+        finish statuses are stored as given rather than being checked
+        against the job's status patterns.  Starts should be imported
+        before finishes so that the durations of runs can be found."""
+
+        outputs = []
+
+        with self.lock as c:
+            for event in events:
+                type_ = event['type']
+
+                if type_ == CrabEvent.START:
+                    self._log_start(c, id_, event['command'],
+                                    event['datetime'])
+
+                elif type_ == CrabEvent.ALARM:
+                    self._log_alarm(c, id_, event['status'],
+                                    event['datetime'])
+
+                elif type_ == CrabEvent.FINISH:
+                    finishid = self._log_finish(
+                        c, id_, event['command'], event['status'],
+                        event['datetime'])
+
+                    (stdout, stderr) = (event.get('stdout'),
+                                        event.get('stderr'))
+
+                    if stdout or stderr:
+                        outputs.append((finishid, stdout or '',
+                                        stderr or ''))
+
+                else:
+                    raise CrabError('unknown event type: ' + str(type_))
+
+        if outputs:
+            info = self.get_job_info(id_)
+
+            for (finishid, stdout, stderr) in outputs:
+                self.write_job_output(finishid, info['host'], info['user'],
+                                      id_, info['crabid'], stdout, stderr)
+
+    def _update_job_stats(self, c, id_, datetime_, counts, duration=None):
+        """Adds the given counts, and optionally a run duration
+        (in seconds), to a job's statistics for the day (in UTC)
+        of the given datetime.
+
+        The counts are given as a dictionary by column name.
+        Counters are incremented in the database, rather than
+        being read and rewritten, so that servers sharing
+        the database do not overwrite each other's updates.
+        The duration is also added to the job's histogram for the day."""
+
+        fields = []
+        params = []
+
+        for (column, count) in counts.items():
+            fields.append('{0}={0}+?'.format(column))
+            params.append(count)
+
+        if duration is not None:
+            fields.extend([
+                'duration_count=duration_count+1',
+                'duration_total=duration_total+?',
+                'duration_min=CASE WHEN duration_min IS NULL OR '
+                'duration_min>? THEN ? ELSE duration_min END',
+                'duration_max=CASE WHEN duration_max IS NULL OR '
+                'duration_max<? THEN ? ELSE duration_max END'])
+            params.extend([duration] * 5)
+
+        if not fields:
+            return
+
+        day = _format_date(datetime_.astimezone(pytz.UTC).date())
+
+        columns = list(counts.keys())
+        values = [counts[x] for x in columns]
+
+        if duration is not None:
+            columns.extend(['duration_count', 'duration_total',
+                            'duration_min', 'duration_max'])
+            values.extend([1, duration, duration, duration])
+
+        self._update_or_insert(
+            c,
+            'UPDATE jobstats SET ' + ', '.join(fields) + ' '
+            'WHERE jobid=? AND day=?', params + [id_, day],
+            'INSERT INTO jobstats (jobid, day, ' + ', '.join(columns) + ') '
+            'VALUES (' + _placeholders([id_, day] + values) + ')',
+            [id_, day] + values)
+
+        if duration is not None:
+            bucket = duration_bucket(duration)
+
+            self._update_or_insert(
+                c,
+                'UPDATE jobhistogram SET count=count+1 '
+                'WHERE jobid=? AND day=? AND bucket=?', [id_, day, bucket],
+                'INSERT INTO jobhistogram '
+                '(jobid, day, bucket, count) VALUES (?, ?, ?, 1)',
+                [id_, day, bucket])
+
+    def _update_or_insert(self, c, update, update_params,
+                          insert, insert_params):
+        """Performs an update, or if that affects no rows, an insert.
+
+        Another server sharing the database may insert the same row
+        between the two statements.  In that case the insert fails
+        on the table's unique constraint and the update is repeated,
+        so that the transaction (and the event being logged) is not
+        aborted."""
+
+        c.execute(update, update_params)
+
+        if c.rowcount < 1:
+            try:
+                c.execute(insert, insert_params)
+
+            except self.lock.integrity_error:
+                c.execute(update, update_params)
+
+    def get_jobs_stats(self, ids, start=None, end=None):
+        """Fetches the total statistics for a number of jobs over
+        the given range of days.
+
+        The start and end are dates (in UTC), with the end day
+        excluded.  Returns a dictionary by job ID number of dictionaries
+        giving the number of runs, success, warning, fail, late, missed
+        and timeout events, the duration_min, duration_avg and duration_max
+        (in seconds, or None if no durations were recorded) and the
+        reliability (as a percentage, or None if there were no runs).
+        Jobs without statistics in the date range are omitted."""
+
+        conditions = []
+        params = []
+
+        if start is not None:
+            conditions.append('day>=?')
+            params.append(_format_date(start))
+
+        if end is not None:
+            conditions.append('day<?')
+            params.append(_format_date(end))
+
+        stats = {}
+
+        with self.lock as c:
+            for chunk in _chunks(ids):
+                for row in self._query_to_dict_list(
+                        c,
+                        'SELECT jobid, SUM(runs) AS runs, '
+                        'SUM(success) AS success, SUM(warning) AS warning, '
+                        'SUM(fail) AS fail, SUM(late) AS late, '
+                        'SUM(missed) AS missed, SUM(timeout) AS timeout, '
+                        'SUM(duration_count) AS duration_count, '
+                        'SUM(duration_total) AS duration_total, '
+                        'MIN(duration_min) AS duration_min, '
+                        'MAX(duration_max) AS duration_max '
+                        'FROM jobstats WHERE ' + ' AND '.join(
+                            ['jobid IN (' + _placeholders(chunk) + ')'] +
+                            conditions) + ' '
+                        'GROUP BY jobid',
+                        list(chunk) + params):
+                    stats[row.pop('jobid')] = _stats_totals(row)
+
+        return stats
+
+    def get_jobs_histograms(self, ids, start=None, end=None):
+        """Fetches histograms of the run durations of a number of
+        jobs over the given range of days.
+
+        The start and end are dates (in UTC), as for get_jobs_stats.
+        Returns a dictionary of CrabHistogram objects by job ID number.
+        Jobs without recorded durations in the date range are omitted."""
+
+        conditions = []
+        params = []
+
+        if start is not None:
+            conditions.append('day>=?')
+            params.append(_format_date(start))
+
+        if end is not None:
+            conditions.append('day<?')
+            params.append(_format_date(end))
+
+        histograms = {}
+
+        with self.lock as c:
+            for chunk in _chunks(ids):
+                c.execute(
+                    'SELECT jobid, bucket, SUM(count) FROM jobhistogram '
+                    'WHERE ' + ' AND '.join(
+                        ['jobid IN (' + _placeholders(chunk) + ')'] +
+                        conditions) + ' '
+                    'GROUP BY jobid, bucket',
+                    list(chunk) + params)
+
+                for (id_, bucket, count) in c.fetchall():
+                    if id_ not in histograms:
+                        histograms[id_] = CrabHistogram()
+
+                    histograms[id_].add_bucket(int(bucket), int(count))
+
+        return histograms
+
+    def rebuild_job_stats(self, start=None):
+        """Recalculates the job statistics and duration histograms
+        from the events in the database.
+
+        The statistics are replaced from the given date (in UTC)
+        onwards, or entirely if no date is given.  Note that statistics
+        for days whose events have been removed by the cleaning service
+        will be lost if they are included.  Finishes which have not
+        been paired with their start (e.g. those logged before durations
+        were recorded) are updated.  Each job is processed in a separate
+        transaction.
+
+        Returns the number of jobs processed."""
+
+        conditions = []
+        params = []
+
+        if start is not None:
+            conditions.append('datetime>=?')
+            params.append(_format_date(start))
+
+        with self.lock as c:
+            ids = [x['id'] for x in self._query_to_dict_list(
+                c, 'SELECT id FROM job', [])]
+
+        for id_ in ids:
+            where_clause = 'WHERE ' + ' AND '.join(['jobid=?'] + conditions)
+
+            with self.lock as c:
+                for table in ('jobstats', 'jobhistogram'):
+                    if start is None:
+                        c.execute('DELETE FROM ' + table + ' WHERE jobid=?',
+                                  [id_])
+                    else:
+                        c.execute('DELETE FROM ' + table + ' '
+                                  'WHERE jobid=? AND day>=?',
+                                  [id_, _format_date(start)])
+
+                last_start = None
+
+                for event in self._query_to_dict_list(
+                        c,
+                        'SELECT id AS eventid, 1 AS type, ' +
+                        '    datetime AS "datetime [timestamp]", ' +
+                        '    NULL AS status, NULL AS duration ' +
+                        '    FROM jobstart ' + where_clause + ' ' +
+                        'UNION ALL SELECT id AS eventid, 2 AS type, ' +
+                        '    datetime AS "datetime [timestamp]", status, ' +
+                        '    NULL AS duration ' +
+                        '    FROM jobalarm ' + where_clause + ' ' +
+                        'UNION ALL SELECT id AS eventid, 3 AS type, ' +
+                        '    datetime AS "datetime [timestamp]", status, ' +
+                        '    duration ' +
+                        '    FROM jobfinish ' + where_clause + ' ' +
+                        'ORDER BY datetime ASC, type ASC',
+                        ([id_] + params) * 3):
+                    (type_, datetime_) = (event['type'], event['datetime'])
+
+                    if type_ == CrabEvent.START:
+                        last_start = event
+                        continue
+
+                    counts = _stats_counts(type_, event['status'])
+                    if not counts:
+                        continue
+
+                    duration = None
+                    if type_ == CrabEvent.FINISH:
+                        duration = event['duration']
+
+                        if duration is None and last_start is not None:
+                            duration = _duration_seconds(
+                                last_start['datetime'], datetime_)
+
+                            c.execute('UPDATE jobfinish SET startid=?, '
+                                      'duration=? WHERE id=?',
+                                      [last_start['eventid'], duration,
+                                       event['eventid']])
+
+                        last_start = None
+
+                    self._update_job_stats(c, id_, datetime_, counts,
+                                           duration)
+
+        return len(ids)
 
     def get_job_info(self, id_):
         """Retrieve information about a job by ID number."""
@@ -258,6 +687,51 @@ class CrabStoreDB(CrabStore):
                 'deleted AS "deleted [timestamp]" '
                 'FROM job WHERE id = ?', [id_])
 
+    def get_jobs_info(self, ids):
+        """Retrieve information about a number of jobs by ID number.
+
+        Returns a dictionary of job information (as given by
+        get_job_info) by ID number.  Jobs which are not found
+        are omitted."""
+
+        info = {}
+
+        with self.lock as c:
+            for chunk in _chunks(ids):
+                for row in self._query_to_dict_list(
+                        c,
+                        'SELECT id, host, user, command, crabid, time, '
+                        'timezone, installed AS "installed [timestamp]", '
+                        'deleted AS "deleted [timestamp]" '
+                        'FROM job WHERE id IN (' + _placeholders(chunk) + ')',
+                        chunk):
+                    info[row.pop('id')] = row
+
+        return info
+
+    def get_jobs_configs(self, ids):
+        """Retrieve configuration data for a number of jobs by ID number.
+
+        Returns a dictionary of configurations (as given by
+        get_job_config) by job ID number.  Jobs without a configuration
+        are omitted."""
+
+        configs = {}
+
+        with self.lock as c:
+            for chunk in _chunks(ids):
+                for row in self._query_to_dict_list(
+                        c,
+                        'SELECT jobid, id AS configid, graceperiod, '
+                        'timeout, success_pattern, warning_pattern, '
+                        'fail_pattern, note, inhibit '
+                        'FROM jobconfig WHERE jobid IN (' +
+                        _placeholders(chunk) + ')',
+                        chunk):
+                    configs[row.pop('jobid')] = row
+
+        return configs
+
     def _get_job_config(self, c, id_):
         """Private/protected version of get_job_config which does
         not acquire the lock."""
@@ -293,6 +767,8 @@ class CrabStoreDB(CrabStore):
                      success_pattern, warning_pattern, fail_pattern,
                      note, inhibit])
 
+                self.notification_version += 1
+
                 return c.lastrowid
 
             else:
@@ -323,6 +799,18 @@ class CrabStoreDB(CrabStore):
             c.execute('UPDATE jobconfig SET inhibit=0 WHERE jobid=?',
                       [id_])
 
+    def get_inhibited_jobs(self):
+        """Fetches a list of the (non-deleted) jobs for which the
+        inhibit setting is active, giving the host, user, crabid
+        and command of each."""
+
+        with self.lock as c:
+            return self._query_to_dict_list(
+                c,
+                'SELECT host, user, crabid, command FROM job '
+                'JOIN jobconfig ON jobconfig.jobid = job.id '
+                'WHERE jobconfig.inhibit = 1 AND job.deleted IS NULL', [])
+
     def get_orphan_configs(self):
         """Make a list of orphaned job configuration records."""
 
@@ -339,6 +827,8 @@ class CrabStoreDB(CrabStore):
             c.execute('UPDATE jobconfig SET jobid = ? '
                       'WHERE id = ?', [id_, configid])
 
+            self.notification_version += 1
+
     def get_job_finishes(self, id_, limit=100,
                          finishid=None, before=None, after=None,
                          include_alreadyrunning=False):
@@ -392,21 +882,22 @@ class CrabStoreDB(CrabStore):
     def get_job_events(self, id_, limit=100, start=None, end=None):
         """Fetches a combined list of events relating to the specified job.
 
-        Return events, newest first (with finishes first for the same
-        datetime).  This ordering allows us to apply the SQL limit on
-        number of result rows to find the most recent events.  It gives
-        the correct ordering for the job info page."""
+        Finish events include the duration of the run (in seconds) if it
+        was recorded.  Return events, newest first (with finishes first
+        for the same datetime).  This ordering allows us to apply the SQL
+        limit on number of result rows to find the most recent events.
+        It gives the correct ordering for the job info page."""
 
         conditions = ['jobid=?']
         params = [id_]
 
         if start is not None:
             conditions.append('datetime>=?')
-            params.append(start.astimezone(pytz.UTC))
+            params.append(format_datetime(start))
 
         if end is not None:
             conditions.append('datetime<?')
-            params.append(end.astimezone(pytz.UTC))
+            params.append(format_datetime(end))
 
         where_clause = 'WHERE ' + ' AND '.join(conditions)
         params = params * 3
@@ -423,24 +914,97 @@ class CrabStoreDB(CrabStore):
                 'SELECT ' +
                 '    id AS eventid, 1 AS type, ' +
                 '    datetime AS "datetime [timestamp]", ' +
-                '    command, NULL AS status ' +
+                '    command, NULL AS status, NULL AS duration ' +
                 '    FROM jobstart ' + where_clause + ' ' +
                 'UNION SELECT ' +
                 '    id AS eventid, 2 AS type, ' +
                 '    datetime AS "datetime [timestamp]", ' +
-                '    NULL AS command, status ' +
+                '    NULL AS command, status, NULL AS duration ' +
                 '    FROM jobalarm ' + where_clause + ' ' +
                 'UNION SELECT ' +
                 '    id AS eventid, 3 AS type, ' +
                 '    datetime AS "datetime [timestamp]", ' +
-                '    command, status ' +
+                '    command, status, duration ' +
                 '    FROM jobfinish ' + where_clause + ' ' +
                 'ORDER BY datetime DESC, type DESC ' + limit_clause,
                 params)
 
+    def get_jobs_events(self, ids, start=None, end=None):
+        """Fetches the events for a number of jobs in the given
+        time range.
+
+        Returns a dictionary by job ID number of lists of events, in the
+        same form and order as those returned by get_job_events.
+        Jobs without events in the time range are omitted."""
+
+        conditions = []
+        params = []
+
+        if start is not None:
+            conditions.append('datetime>=?')
+            params.append(format_datetime(start))
+
+        if end is not None:
+            conditions.append('datetime<?')
+            params.append(format_datetime(end))
+
+        events = {}
+
+        with self.lock as c:
+            for chunk in _chunks(ids):
+                where_clause = 'WHERE ' + ' AND '.join(
+                    ['jobid IN (' + _placeholders(chunk) + ')'] + conditions)
+
+                for row in self._query_to_dict_list(
+                        c,
+                        'SELECT ' +
+                        '    jobid, id AS eventid, 1 AS type, ' +
+                        '    datetime AS "datetime [timestamp]", ' +
+                        '    command, NULL AS status, NULL AS duration ' +
+                        '    FROM jobstart ' + where_clause + ' ' +
+                        'UNION SELECT ' +
+                        '    jobid, id AS eventid, 2 AS type, ' +
+                        '    datetime AS "datetime [timestamp]", ' +
+                        '    NULL AS command, status, NULL AS duration ' +
+                        '    FROM jobalarm ' + where_clause + ' ' +
+                        'UNION SELECT ' +
+                        '    jobid, id AS eventid, 3 AS type, ' +
+                        '    datetime AS "datetime [timestamp]", ' +
+                        '    command, status, duration ' +
+                        '    FROM jobfinish ' + where_clause + ' ' +
+                        'ORDER BY jobid, datetime DESC, type DESC',
+                        (list(chunk) + params) * 3):
+                    events.setdefault(row.pop('jobid'), []).append(row)
+
+        return events
+
+    def get_job_event_page(self, id_, type_, after=0, limit=1000):
+        """Fetches events of one type (a CrabEvent value) for a job,
+        in order of ID number, starting after the given event ID.
+
+        This allows the whole history of a job to be read in pages
+        of a limited size.  Each event includes the eventid, datetime,
+        command and status."""
+
+        (table, columns) = {
+            CrabEvent.START: ('jobstart', 'command, NULL AS status'),
+            CrabEvent.ALARM: ('jobalarm', 'NULL AS command, status'),
+            CrabEvent.FINISH: ('jobfinish', 'command, status'),
+        }[type_]
+
+        with self.lock as c:
+            return self._query_to_dict_list(
+                c,
+                'SELECT id AS eventid, datetime AS "datetime [timestamp]", ' +
+                columns + ' FROM ' + table + ' '
+                'WHERE jobid=? AND id>? ORDER BY id ASC LIMIT ?',
+                [id_, after, limit])
+
     def get_events_since(self, startid, alarmid, finishid):
         """Extract minimal summary information for events on all jobs
-        since the given IDs, oldest first."""
+        since the given IDs, oldest first.
+
+        Finish events include the duration of the run, if recorded."""
 
         with self.lock as c:
             return self._query_to_dict_list(
@@ -448,17 +1012,17 @@ class CrabStoreDB(CrabStore):
                 'SELECT ' +
                 '    jobid, id AS eventid, 1 AS type, ' +
                 '    datetime AS "datetime [timestamp]", ' +
-                '    NULL AS status FROM jobstart ' +
+                '    NULL AS status, NULL AS duration FROM jobstart ' +
                 '    WHERE id > ? ' +
                 'UNION SELECT ' +
                 '    jobid, id AS eventid, 2 AS type, ' +
                 '    datetime AS "datetime [timestamp]", ' +
-                '    status FROM jobalarm ' +
+                '    status, NULL AS duration FROM jobalarm ' +
                 '    WHERE id > ? ' +
                 'UNION SELECT ' +
                 '    jobid, id AS eventid, 3 AS type, ' +
                 '    datetime AS "datetime [timestamp]", ' +
-                '    status FROM jobfinish ' +
+                '    status, duration FROM jobfinish ' +
                 '    WHERE id > ? ' +
                 'ORDER BY datetime ASC, type ASC',
                 [startid, alarmid, finishid])
@@ -497,13 +1061,71 @@ class CrabStoreDB(CrabStore):
                  limit])
 
     def delete_old_events(self, datetime_):
-        """Delete events older than the given datetime."""
+        """Delete events older than the given datetime.
+
+        The job statistics are retained.  Live output is also deleted
+        for jobs which have not started since the given datetime,
+        such as jobs which were killed before they could finish."""
 
         with self.lock as c:
             c.execute('DELETE FROM jobalarm WHERE datetime<?', [datetime_])
             c.execute('DELETE FROM jobstart WHERE datetime<?', [datetime_])
             c.execute('DELETE FROM jobfinish WHERE datetime<?', [datetime_])
 
+            if self.outputstore is None or not hasattr(
+                    self.outputstore, 'write_live_output'):
+                c.execute('DELETE FROM joblive WHERE jobid NOT IN '
+                          '(SELECT jobid FROM jobstart)')
+
+        if self.outputstore is not None and hasattr(
+                self.outputstore, 'delete_old_live_output'):
+            self.outputstore.delete_old_live_output(datetime_)
+
+        # Re-read the set of jobs with live output when next required.
+        self.live_output_jobs = None
+
+    def acquire_lease(self, name, holder, duration):
+        """Attempts to acquire, or renew, the named lease.
+
+        The lease is taken if it is not currently held, is already held
+        by the given holder, or has expired.  It is then recorded as
+        held until the given duration (a timedelta) has elapsed.
+
+        The database's clock is used, rather than that of this server,
+        so that servers whose clocks differ agree on when the lease
+        expires.
+
+        Returns True if the given holder now holds the lease."""
+
+        with self.lock as c:
+            c.execute('SELECT CURRENT_TIMESTAMP AS "now [timestamp]"', [])
+            datetime_ = c.fetchone()[0].replace(tzinfo=pytz.UTC)
+
+            now = format_datetime(datetime_)
+            expires = format_datetime(datetime_ + duration)
+
+            c.execute('UPDATE lease SET holder=?, expires=? '
+                      'WHERE name=? AND (holder=? OR expires<?)',
+                      [holder, expires, name, holder, now])
+
+            entry = self._query_to_dict(
+                c, 'SELECT holder FROM lease WHERE name=?', [name])
+
+            if entry is None:
+                c.execute('INSERT INTO lease (name, holder, expires) '
+                          'VALUES (?, ?, ?)',
+                          [name, holder, expires])
+                return True
+
+            return entry['holder'] == holder
+
+    def release_lease(self, name, holder):
+        """Releases the named lease, if held by the given holder."""
+
+        with self.lock as c:
+            c.execute('DELETE FROM lease WHERE name=? AND holder=?',
+                      [name, holder])
+
     def _write_job_output(self, c, finishid, host, user, id_, crabid,
                           stdout, stderr):
         """Writes the job output to the database.
@@ -534,6 +1156,97 @@ class CrabStoreDB(CrabStore):
 
         return row
 
+    def _get_job_outputs(self, c, finishids):
+        """Fetches the standard output and standard error for a number
+        of finish IDs.
+
+        Returns a dictionary of (stdout, stderr) pairs by finish ID."""
+
+        output = dict((finishid, ('', '')) for finishid in finishids)
+
+        for chunk in _chunks(output.keys()):
+            c.execute('SELECT finishid, stdout, stderr FROM joboutput '
+                      'WHERE finishid IN (' + _placeholders(chunk) + ')',
+                      chunk)
+
+            for row in c.fetchall():
+                output[row[0]] = (row[1], row[2])
+
+        return output
+
+    def _write_live_output(self, c, id_, stdout, stderr):
+        """Appends to the live output of a job.
+
+        Each chunk of output is stored as a separate row, so that
+        appending does not require the existing output to be rewritten.
+        Old rows are deleted once the job has more than LIVE_OUTPUT_SIZE
+        characters of output."""
+
+        c.execute('INSERT INTO joblive (jobid, stdout, stderr) '
+                  'VALUES (?, ?, ?)',
+                  [id_, stdout, stderr])
+
+        first = self._first_live_output(c, id_)
+
+        if first is not None:
+            c.execute('DELETE FROM joblive WHERE jobid=? AND id<?',
+                      [id_, first])
+
+    def _get_live_output(self, c, id_):
+        """Fetches the live output of a job by combining its chunks.
+
+        Only the most recent chunks, up to LIVE_OUTPUT_SIZE characters,
+        are read."""
+
+        first = self._first_live_output(c, id_)
+
+        if first is None:
+            c.execute('SELECT stdout, stderr FROM joblive '
+                      'WHERE jobid=? ORDER BY id ASC', [id_])
+        else:
+            c.execute('SELECT stdout, stderr FROM joblive '
+                      'WHERE jobid=? AND id>=? ORDER BY id ASC', [id_, first])
+
+        stdout = []
+        stderr = []
+
+        for row in c.fetchall():
+            stdout.append(row[0])
+            stderr.append(row[1])
+
+        return (''.join(stdout), ''.join(stderr))
+
+    def _first_live_output(self, c, id_):
+        """Finds the ID of the earliest chunk of a job's live output which
+        is needed to give LIVE_OUTPUT_SIZE characters of output.
+
+        Returns None if all of the chunks are needed."""
+
+        c.execute('SELECT id, LENGTH(stdout) + LENGTH(stderr) FROM joblive '
+                  'WHERE jobid=? ORDER BY id DESC', [id_])
+
+        size = 0
+
+        for (chunk, length) in c.fetchall():
+            size += length
+
+            if size >= LIVE_OUTPUT_SIZE:
+                return chunk
+
+        return None
+
+    def _get_live_output_jobs(self, c):
+        """Fetches the set of jobs which have live output."""
+
+        c.execute('SELECT DISTINCT jobid FROM joblive')
+
+        return set(row[0] for row in c.fetchall())
+
+    def _clear_live_output(self, c, id_):
+        """Deletes the live output of a job."""
+
+        c.execute('DELETE FROM joblive WHERE jobid=?', [id_])
+
     def _write_raw_crontab(self, c, host, user, crontab):
         entry = self._query_to_dict(
             c,
@@ -563,10 +1276,15 @@ class CrabStoreDB(CrabStore):
 
     def get_notifications(self):
         """Fetches a list of notifications, combining those defined
-        by a config ID with those defined by user and/or host."""
+        by a config ID with those defined by user and/or host.
+
+        The notifications defined by user and/or host are matched to
+        the jobs here, by looking up each job's host and user in a
+        dictionary of the notifications, rather than in the database,
+        where the join could not make use of an index."""
 
         with self.lock as c:
-            return self._query_to_dict_list(
+            notifications = self._query_to_dict_list(
                 c,
                 'SELECT jobnotify.id AS notifyid, method, address, '
                 '    skip_ok, skip_warning, skip_error, include_output, '
@@ -575,17 +1293,42 @@ class CrabStoreDB(CrabStore):
                 '    FROM jobnotify '
                 '    JOIN jobconfig ON jobnotify.configid = jobconfig.id '
                 '    JOIN job ON job.id = jobconfig.jobid '
-                '    WHERE configid IS NOT NULL AND job.deleted IS NULL '
-                'UNION SELECT jobnotify.id AS notifyid, method, address, '
-                '    skip_ok, skip_warning, skip_error, include_output, '
-                '    job.id AS id, jobnotify.time AS time, '
-                '    COALESCE(jobnotify.timezone, job.timezone) AS timezone '
-                '    FROM jobnotify JOIN job '
-                '        ON COALESCE(job.user = jobnotify.user, 1) '
-                '        AND COALESCE(job.host = jobnotify.host, 1) '
-                '    WHERE configid IS NULL AND job.deleted IS NULL',
+                '    WHERE configid IS NOT NULL AND job.deleted IS NULL',
                 [])
 
+            match = {}
+            for notification in self._query_to_dict_list(
+                    c,
+                    'SELECT id AS notifyid, host, user, method, address, '
+                    '    skip_ok, skip_warning, skip_error, include_output, '
+                    '    time, timezone '
+                    '    FROM jobnotify WHERE configid IS NULL',
+                    []):
+                key = (notification.pop('host'), notification.pop('user'))
+                match.setdefault(key, []).append(notification)
+
+            if not match:
+                return notifications
+
+            jobs = self._query_to_dict_list(
+                c,
+                'SELECT id, host, user, timezone FROM job '
+                '    WHERE deleted IS NULL',
+                [])
+
+        for job in jobs:
+            (host, user) = (job['host'], job['user'])
+
+            for key in set(((host, user), (host, None),
+                            (None, user), (None, None))):
+                for notification in match.get(key, ()):
+                    notification = dict(notification, id=job['id'])
+                    if notification['timezone'] is None:
+                        notification['timezone'] = job['timezone']
+                    notifications.append(notification)
+
+        return notifications
+
     def get_job_notifications(self, configid):
         """Fetches all of the notifications configured for the given
         configid."""
@@ -598,6 +1341,31 @@ class CrabStoreDB(CrabStore):
                 'skip_ok, skip_warning, skip_error, include_output '
                 'FROM jobnotify WHERE configid=?', [configid])
 
+    def get_configs_notifications(self, configids):
+        """Fetches the notifications configured for a number of
+        configids.
+
+        Returns a dictionary of lists of notifications (as given by
+        get_job_notifications) by configid.  Configurations without
+        notifications are omitted."""
+
+        notifications = {}
+
+        with self.lock as c:
+            for chunk in _chunks(configids):
+                for row in self._query_to_dict_list(
+                        c,
+                        'SELECT configid, id AS notifyid, '
+                        'method, address, time, timezone, '
+                        'skip_ok, skip_warning, skip_error, include_output '
+                        'FROM jobnotify WHERE configid IN (' +
+                        _placeholders(chunk) + ')',
+                        chunk):
+                    notifications.setdefault(
+                        row.pop('configid'), []).append(row)
+
+        return notifications
+
     def get_match_notifications(self, host=None, user=None):
         """Fetches matching notifications which are not tied to a
         configuration entry."""
@@ -651,12 +1419,16 @@ class CrabStoreDB(CrabStore):
                            skip_warning, skip_error, include_output,
                            notifyid])
 
+            self.notification_version += 1
+
     def delete_notification(self, notifyid):
         """Removes a notification from the database."""
 
         with self.lock as c:
             c.execute('DELETE FROM jobnotify WHERE id=?', [notifyid])
 
+            self.notification_version += 1
+
     def _query_to_dict(self, c, sql, param=[]):
         """Convenience method which returns a single row from
         _query_to_dict_list.
@@ -698,3 +1470,86 @@ class CrabStoreDB(CrabStore):
             output.append(dict)
 
         return output
+
+
+def _chunks(values):
+    """Splits the given values into lists of at most MAX_IN_VALUES."""
+
+    values = list(values)
+
+    return [values[i:i + MAX_IN_VALUES]
+            for i in range(0, len(values), MAX_IN_VALUES)]
+
+
+def _placeholders(values):
+    """Constructs a list of parameter placeholders for the given values."""
+
+    return ', '.join('?' * len(values))
+
+
+def _format_date(date_):
+    """Converts a date (or datetime) into a string, as stored in
+    the jobstats table."""
+
+    return date_.strftime('%Y-%m-%d')
+
+
+def _duration_seconds(start, end):
+    """Calculates the duration between two datetimes in whole
+    seconds."""
+
+    return int((end - start).total_seconds())
+
+
+def _stats_counts(type_, status):
+    """Determines which job statistics counters an event contributes to.
+
+    Returns a dictionary of counts by column name, which is empty if
+    the event is not counted (e.g. ALREADYRUNNING finishes and CLEARED
+    alarms)."""
+
+    if type_ == CrabEvent.FINISH:
+        if status == CrabStatus.ALREADYRUNNING:
+            return {}
+        elif status == CrabStatus.SUCCESS:
+            return {'runs': 1, 'success': 1}
+        elif CrabStatus.is_warning(status):
+            return {'runs': 1, 'warning': 1}
+        else:
+            return {'runs': 1, 'fail': 1}
+
+    elif type_ == CrabEvent.ALARM:
+        column = {CrabStatus.LATE: 'late',
+                  CrabStatus.MISSED: 'missed',
+                  CrabStatus.TIMEOUT: 'timeout'}.get(status)
+
+        if column is not None:
+            return {column: 1}
+
+    return {}
+
+
+def _stats_totals(row):
+    """Adds derived values to a row of summed job statistics.
+
+    The reliability is calculated in the same way as by the monitor,
+    i.e. as the percentage of runs, missed runs and timeouts which
+    were successful."""
+
+    for key in list(row.keys()):
+        if row[key] is not None:
+            row[key] = int(row[key])
+
+    if row['duration_count']:
+        row['duration_avg'] = row['duration_total'] // row['duration_count']
+    else:
+        row['duration_avg'] = None
+
+    total = row['runs'] + row['missed'] + row['timeout']
+
+    if total:
+        row['reliability'] = int(100 * row['success'] / total)
+    else:
+        row['reliability'] = None
+
+    return row
@@ -13,18 +13,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import calendar
 import errno
 import os
 
+# Parallel reading requires the concurrent.futures module (Python 3.2+).
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
 from crab import CrabError
+from crab.store import LIVE_OUTPUT_SIZE
 from crab.util.string import alphanum
 
+# Number of threads to use when reading the output of several jobs.
+READ_THREADS = 8
+
 
 class CrabStoreFile:
     """Store class for cron job output.
 
-    This backend currently implements only the write_job_output and
-    get_job_output methods, to allow it to be used as an
+    This backend currently implements only the methods for job output,
+    live output and raw crontabs, to allow it to be used as an
     "outputstore" along with CrabStoreDB."""
 
     def __init__(self, dir):
@@ -47,8 +58,9 @@ class CrabStoreFile:
 
         self.outputdir = os.path.join(dir, 'output')
         self.tabdir = os.path.join(dir, 'crontab')
+        self.livedir = os.path.join(dir, 'live')
 
-        for directory in [self.outputdir, self.tabdir]:
+        for directory in [self.outputdir, self.tabdir, self.livedir]:
             if not os.path.exists(directory):
                 try:
                     os.mkdir(directory)
@@ -149,6 +161,133 @@ class CrabStoreFile:
 
         return (stdout, stderr)
 
+    def get_job_outputs(self, finishes):
+        """Reads the output for a number of job finishes, given as
+        (finishid, host, user, id_, crabid) tuples.
+
+        The files are read in parallel by a pool of threads, where
+        available.  Returns a dictionary of (stdout, stderr) pairs
+        by finish ID."""
+
+        finishes = list(finishes)
+
+        if len(finishes) < 2 or ThreadPoolExecutor is None:
+            return dict((finish[0], self.get_job_output(*finish))
+                        for finish in finishes)
+
+        with ThreadPoolExecutor(max_workers=READ_THREADS) as executor:
+            output = executor.map(lambda x: self.get_job_output(*x),
+                                  finishes)
+
+            return dict(zip((x[0] for x in finishes), output))
+
+    def write_live_output(self, host, user, id_, stdout, stderr):
+        """Appends to the live output files of a running job.
+
+        Once a file holds more than twice LIVE_OUTPUT_SIZE bytes,
+        it is cut down to (approximately) the last LIVE_OUTPUT_SIZE."""
+
+        path = self._make_live_path(host, user, id_)
+
+        (dir, file) = os.path.split(path)
+
+        if not os.path.exists(dir):
+            try:
+                os.makedirs(dir)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise CrabError(
+                        'file store error: could not make directory: ' +
+                        str(err))
+
+        try:
+            for (ext, data) in ((self.outext, stdout),
+                                (self.errext, stderr)):
+                if not data:
+                    continue
+
+                filename = path + '.' + ext
+
+                with open(filename, 'a') as file:
+                    file.write(data)
+
+                if os.path.getsize(filename) > 2 * LIVE_OUTPUT_SIZE:
+                    self._trim_live_file(filename)
+
+        except (IOError, OSError) as err:
+            raise CrabError('file store error: could not write files: ' +
+                            str(err))
+
+    def get_live_output(self, host, user, id_):
+        """Reads the live output files of a running job."""
+
+        path = self._make_live_path(host, user, id_)
+        output = []
+
+        try:
+            for ext in (self.outext, self.errext):
+                filename = path + '.' + ext
+
+                if os.path.exists(filename):
+                    with open(filename) as file:
+                        output.append(file.read())
+                else:
+                    output.append('')
+
+        except IOError as err:
+            raise CrabError('file store error: could not read files: ' +
+                            str(err))
+
+        return tuple(output)
+
+    def get_live_output_jobs(self):
+        """Finds the ID numbers of jobs which have live output files."""
+
+        jobs = set()
+
+        for (dirpath, dirnames, filenames) in os.walk(self.livedir):
+            for filename in filenames:
+                (name, ext) = os.path.splitext(filename)
+
+                if name.isdigit():
+                    jobs.add(int(name))
+
+        return jobs
+
+    def delete_old_live_output(self, datetime_):
+        """Deletes live output files which have not been written
+        since the given datetime."""
+
+        threshold = calendar.timegm(datetime_.utctimetuple())
+
+        for (dirpath, dirnames, filenames) in os.walk(self.livedir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+
+                try:
+                    if os.stat(path).st_mtime < threshold:
+                        os.unlink(path)
+
+                except OSError as err:
+                    if err.errno != errno.ENOENT:
+                        raise CrabError(
+                            'file store error: could not delete file: ' +
+                            str(err))
+
+    def clear_live_output(self, host, user, id_):
+        """Deletes the live output files of a job, if present."""
+
+        path = self._make_live_path(host, user, id_)
+
+        for ext in (self.outext, self.errext):
+            try:
+                os.unlink(path + '.' + ext)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise CrabError(
+                        'file store error: could not delete file: ' +
+                        str(err))
+
     def write_raw_crontab(self, host, user, crontab):
         """Writes the given crontab to a file."""
 
@@ -229,6 +368,30 @@ class CrabStoreFile:
         return os.path.join(self.outputdir, alphanum(host), alphanum(user),
                             job, *finishpath)
 
+    def _trim_live_file(self, filename):
+        """Discards all but the last LIVE_OUTPUT_SIZE bytes of a live
+        output file, starting from the beginning of a line."""
+
+        with open(filename, 'rb') as file:
+            file.seek(-LIVE_OUTPUT_SIZE, os.SEEK_END)
+            data = file.read()
+
+        data = data[data.find(b'\n') + 1:]
+
+        with open(filename, 'wb') as file:
+            file.write(data)
+
+    def _make_live_path(self, host, user, id_):
+        """Determine the full path to use to store live output
+        (excluding file extensions).
+
+        Live output is stored by job ID number, rather than
+        crabid, since there is only one set of live output per job
+        and it need not be found again if the job is renamed."""
+
+        return os.path.join(self.livedir, alphanum(host), alphanum(user),
+                            str(id_))
+
     def _make_crontab_path(self, host, user):
         """Determine the full path to be used to store a crontab."""
 
@@ -19,7 +19,8 @@ import re
 import pytz
 
 import mysql.connector
-from mysql.connector.errors import Error as _MySQLError
+from mysql.connector.errors import Error as _MySQLError, \
+    IntegrityError as _MySQLIntegrityError
 from mysql.connector.cursor import MySQLCursor
 
 from crab.store.db import CrabStoreDB, CrabDBLock
@@ -61,5 +62,5 @@ class CrabStoreMySQL(CrabStoreDB):
             lock=CrabDBLock(
                 conn, error_class=_MySQLError,
                 cursor_args={'cursor_class': CrabStoreMySQLCursor},
-                ping=True),
+                ping=True, integrity_error=_MySQLIntegrityError),
             outputstore=outputstore)
@@ -24,6 +24,9 @@ from crab.store.db import CrabStoreDB, CrabDBLock
 
 
 class CrabStoreSQLite(CrabStoreDB):
+    # SQLite compares text case-sensitively by default.
+    crabid_case_sensitive = True
+
     def __init__(self, filename, outputstore=None):
         if filename != ':memory:' and not os.path.exists(filename):
             raise Exception('SQLite file does not exist')
@@ -37,5 +40,6 @@ class CrabStoreSQLite(CrabStoreDB):
 
         CrabStoreDB.__init__(
             self,
-            lock=CrabDBLock(conn, error_class=sqlite3.DatabaseError),
+            lock=CrabDBLock(conn, error_class=sqlite3.DatabaseError,
+                            integrity_error=sqlite3.IntegrityError),
             outputstore=outputstore)
@@ -0,0 +1,72 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Workaround lack of JSON in Python 2.4
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import os
+
+
+def cache_path(name):
+    """Determines the path of the named file in the user's cache
+    directory."""
+
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+        'crab', name)
+
+
+def read_cache(name, key):
+    """Reads information from the named cache file.
+
+    The information is returned only if it was stored with the given
+    key (which should be a JSON-compatible value), otherwise None is
+    returned, as it also is if the file can not be read."""
+
+    try:
+        with open(cache_path(name)) as file_:
+            cache = json.load(file_)
+
+        if cache['key'] == key:
+            return cache['data']
+
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+
+    return None
+
+
+def write_cache(name, key, data):
+    """Writes information to the named cache file, along with the key
+    under which it should be found.
+
+    Errors are ignored, since the cache is not essential."""
+
+    path = cache_path(name)
+
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        temporary = '{0}.{1}'.format(path, os.getpid())
+        with open(temporary, 'w') as file_:
+            json.dump({'key': key, 'data': data}, file_)
+        os.rename(temporary, path)
+
+    except (IOError, OSError):
+        pass
@@ -0,0 +1,184 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import os
+import select
+
+DEFAULT_LIMIT = 8 * 1024 * 1024
+DEFAULT_TAIL = 1024 * 1024
+DEFAULT_MEMORY = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class CrabOutputCapture:
+    """Bounded buffer for capturing the output of a job.
+
+    The first "limit" bytes of output are retained: in memory up to
+    "memory" bytes, after which they are spilled to a temporary file.
+    Beyond this, only the last "tail" bytes are kept, in a ring buffer,
+    and the amount of output skipped between the two is counted.
+    The memory used is therefore bounded by "memory" plus "tail",
+    however much output the job writes."""
+
+    def __init__(self, limit=DEFAULT_LIMIT, tail=DEFAULT_TAIL,
+                 memory=DEFAULT_MEMORY):
+        self.limit = limit
+        self.memory = memory
+        self.size = 0
+
+        self._head = bytearray()
+        self._file = None
+        self._head_size = 0
+
+        self._tail = bytearray(tail)
+        self._tail_pos = 0
+        self._tail_size = 0
+
+    def write(self, data):
+        """Adds data (a byte string) to the buffer."""
+
+        self.size += len(data)
+
+        if self._head_size < self.limit:
+            head = data[:self.limit - self._head_size]
+            data = data[len(head):]
+            self._head_size += len(head)
+
+            if self._file is None and self._head_size > self.memory:
+                # Import here as most jobs do not need a temporary file.
+                import tempfile
+                self._file = tempfile.TemporaryFile()
+                self._file.write(self._head)
+                self._head = None
+
+            if self._file is None:
+                self._head.extend(head)
+            else:
+                self._file.write(head)
+
+        if data:
+            self._write_tail(data)
+
+    def _write_tail(self, data):
+        """Adds data to the tail ring buffer."""
+
+        capacity = len(self._tail)
+        if not capacity:
+            return
+
+        if len(data) >= capacity:
+            data = data[-capacity:]
+
+        n = min(len(data), capacity - self._tail_pos)
+        self._tail[self._tail_pos:self._tail_pos + n] = data[:n]
+        self._tail[:len(data) - n] = data[n:]
+
+        self._tail_pos = (self._tail_pos + len(data)) % capacity
+        self._tail_size = min(self._tail_size + len(data), capacity)
+
+    @property
+    def skipped(self):
+        """Number of bytes of output which were not retained."""
+
+        return self.size - self._head_size - self._tail_size
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """Generator yielding the retained output as a series of byte
+        strings.
+
+        If output was skipped, a line noting how much is inserted
+        between the head and tail of the output."""
+
+        if self._file is None:
+            for offset in range(0, len(self._head), chunk_size):
+                yield bytes(self._head[offset:offset + chunk_size])
+
+        else:
+            self._file.seek(0)
+            while True:
+                chunk = self._file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            self._file.seek(0, 2)
+
+        if self.skipped:
+            yield ('\n[... {0} bytes of output omitted ...]\n'.format(
+                self.skipped)).encode('ascii')
+
+        if self._tail_size:
+            if self._tail_size < len(self._tail):
+                tail = self._tail[:self._tail_size]
+            else:
+                tail = (self._tail[self._tail_pos:] +
+                        self._tail[:self._tail_pos])
+
+            for offset in range(0, len(tail), chunk_size):
+                yield bytes(tail[offset:offset + chunk_size])
+
+    def __iter__(self):
+        return self.chunks()
+
+    def getvalue(self):
+        """Returns the retained output as a single byte string."""
+
+        return b''.join(self.chunks())
+
+    def close(self):
+        """Releases the temporary file, if one was used."""
+
+        if self._file is not None:
+            self._file.close()
+
+
+def capture_process_output(process, stdout, stderr, live=None):
+    """Reads the standard output and error pipes of a subprocess
+    into the given CrabOutputCapture objects.
+
+    This is an alternative to Popen.communicate which does not hold all of
+    the output in memory.  It returns once both pipes have been closed and
+    the process has exited, giving the process's return code.
+
+    If a "live" object (such as a CrabLiveOutput) is given, the output
+    is also passed to its write method, along with the name of the
+    stream ("stdout" or "stderr")."""
+
+    captures = {}
+    for (pipe, capture, key) in ((process.stdout, stdout, 'stdout'),
+                                 (process.stderr, stderr, 'stderr')):
+        if pipe is not None:
+            captures[pipe.fileno()] = (pipe, capture, key)
+
+    while captures:
+        try:
+            (readable, _, _) = select.select(list(captures.keys()), [], [])
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for fd in readable:
+            data = os.read(fd, CHUNK_SIZE)
+
+            if data:
+                (_, capture, key) = captures[fd]
+                capture.write(data)
+                if live is not None:
+                    live.write(key, data)
+            else:
+                captures.pop(fd)[0].close()
+
+    return process.wait()
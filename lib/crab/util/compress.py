@@ -0,0 +1,187 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import zlib
+
+# zstd support requires the optional zstandard module.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from crab import CrabError
+
+CHUNK_SIZE = 64 * 1024
+
+# Supported content encodings, in order of preference.
+if zstandard is not None:
+    ENCODINGS = ('zstd', 'gzip')
+else:
+    ENCODINGS = ('gzip',)
+
+
+def choose_encoding(accepted):
+    """Chooses the preferred content encoding which is included in
+    the given list of encodings, or returns None if there is none."""
+
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            return encoding
+
+    return None
+
+
+def parse_encodings(header):
+    """Parses a comma-separated list of content encodings, such as
+    the value of an Accept-Encoding header.
+
+    Encodings given a quality value of zero are omitted."""
+
+    encodings = []
+
+    if header:
+        for item in header.split(','):
+            parts = [x.strip() for x in item.split(';')]
+            quality = 1.0
+
+            for param in parts[1:]:
+                if param.startswith('q='):
+                    try:
+                        quality = float(param[2:])
+                    except ValueError:
+                        pass
+
+            if parts[0] and quality > 0:
+                encodings.append(parts[0].lower())
+
+    return encodings
+
+
+def get_compressor(encoding):
+    """Constructs an object with "compress" and "flush" methods which
+    can be used to compress a stream of data with the given encoding."""
+
+    if encoding == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    elif encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor().compressobj()
+
+    raise CrabError('unsupported content encoding: ' + str(encoding))
+
+
+def compress(data, encoding):
+    """Compresses the given byte string with the given encoding."""
+
+    compressor = get_compressor(encoding)
+
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data, encoding):
+    """Decompresses the given byte string with the given encoding."""
+
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+    elif encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    raise CrabError('unsupported content encoding: ' + str(encoding))
+
+
+class CrabDecompressReader:
+    """File-like object which decompresses data as it is read from
+    another file.
+
+    Only a bounded amount of compressed data is read at a time, and
+    a CrabError is raised if the decompressed data exceeds the given
+    limit, so that a small compressed message can not expand to use
+    an excessive amount of memory."""
+
+    def __init__(self, file_, encoding, limit):
+        if encoding in ('gzip', 'x-gzip'):
+            # Import here as the gzip module is only needed by the server.
+            import gzip
+            self.reader = gzip.GzipFile(fileobj=file_, mode='rb')
+
+        elif encoding == 'zstd' and zstandard is not None:
+            self.reader = zstandard.ZstdDecompressor().stream_reader(file_)
+
+        else:
+            raise CrabError('unsupported content encoding: ' + str(encoding))
+
+        self.limit = limit
+        self.size = 0
+        self.buffer = b''
+
+    def read(self, size=-1):
+        """Reads up to the given number of bytes, or until the end of
+        the data if the size is negative."""
+
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        self.buffer = b''
+
+        while size < 0 or length < size:
+            chunk = self._read_chunk()
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+
+        data = b''.join(chunks)
+
+        if 0 <= size < len(data):
+            self.buffer = data[size:]
+            data = data[:size]
+
+        return data
+
+    def readline(self):
+        """Reads one line, including the terminating newline if
+        present."""
+
+        while b'\n' not in self.buffer:
+            chunk = self._read_chunk()
+            if not chunk:
+                break
+            self.buffer += chunk
+
+        (line, newline, self.buffer) = self.buffer.partition(b'\n')
+
+        return line + newline
+
+    def _read_chunk(self):
+        """Reads a chunk of decompressed data, checking that the
+        limit has not been exceeded."""
+
+        try:
+            chunk = self.reader.read(CHUNK_SIZE)
+
+        except (IOError, EOFError, zlib.error) as err:
+            raise CrabError('could not decompress data: ' + str(err))
+
+        except Exception as err:
+            if zstandard is not None and isinstance(err, zstandard.ZstdError):
+                raise CrabError('could not decompress data: ' + str(err))
+            raise
+
+        self.size += len(chunk)
+
+        if self.size > self.limit:
+            raise CrabError('decompressed data exceeds size limit')
+
+        return chunk
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from datetime import timedelta
+
 import pytz
 
 from crab import CrabEvent, CrabStatus
@@ -89,12 +91,21 @@ class CrabEventFilter:
                 if CrabStatus.is_warning(e['status']):
                     self.warnings += 1
 
+            # Use the duration recorded by the store if present,
+            # otherwise find it from the start which is squashed.
+            duration = e.get('duration')
+
             if squash_start and e['type'] == CrabEvent.FINISH:
                 start = _find_previous_start(events, i)
                 if start is not None:
                     squash.add(start)
-                    delta = e['datetime'] - events[start]['datetime']
-                    e['duration'] = str(delta)
+                    if duration is None:
+                        duration = int((e['datetime'] -
+                                        events[start]['datetime']
+                                        ).total_seconds())
+
+            if duration is not None:
+                e['duration'] = str(timedelta(seconds=duration))
 
             e['datetime'] = self.in_timezone(e['datetime'])
 
@@ -14,26 +14,42 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
 import pytz
 import re
 
-# There really ought to be a better way of doing this!  You could read
-# /etc/sysconfig/clock but that would only work on certain systems.  The
-# following might work anywhere the timezone database is installed in the
-# correct place.
-#
-# The Perl module DateTime::TimeZone::Local::Unix uses this method, among
-# others.  TODO: implement some of the other methods.
+from crab.util.cache import read_cache, write_cache
+
+ZONEINFO_DIR = '/usr/share/zoneinfo'
+
+# Files which name the timezone, on various systems, with regular
+# expressions matching the timezone in each line.
+TIMEZONE_FILES = (
+    ('/etc/timezone', re.compile(r'^\s*([-+_A-Za-z0-9/]+)\s*$')),
+    ('/etc/sysconfig/clock',
+     re.compile(r'^\s*(?:ZONE|TIMEZONE)\s*=\s*"?([-+_A-Za-z0-9/]+)"?')),
+    ('/etc/conf.d/clock',
+     re.compile(r'^\s*(?:TIMEZONE|TZ)\s*=\s*"?([-+_A-Za-z0-9/]+)"?')),
+)
 
 
 def guess_timezone():
     """Function to try to determine the operating system's timezone setting.
 
-    Currently this checks for a TZ environment variable.  Otherwise
-    it checks if /etc/localtime is a link or tries to find the file in
-    /usr/share/zoneinfo which matches.  It uses pytz to get a list of
-    common timezones to try."""
+    This checks, in order:
+
+    * The TZ environment variable.
+    * Whether /etc/localtime is a link into the zoneinfo directory
+      (as set up by systemd's timedatectl).
+    * Files naming the timezone: /etc/timezone, /etc/sysconfig/clock
+      and /etc/conf.d/clock.
+    * The digest of /etc/localtime, which is looked up in an index of
+      the digests of the files in /usr/share/zoneinfo.
+
+    The index is built from pytz's list of common timezones and kept in
+    a cache file, so that it need only be rebuilt when the zoneinfo
+    directory or pytz is updated, or /etc/localtime changes."""
 
     if 'TZ' in os.environ:
         return os.environ['TZ']
@@ -49,25 +65,103 @@ def guess_timezone():
     except:
         pass
 
-    # Final method: read /etc/localtime and look for the same file in
-    # /usr/share/zoneinfo/.
+    for (filename, pattern) in TIMEZONE_FILES:
+        zone = _read_timezone_file(filename, pattern)
+        if zone is not None:
+            return zone
+
+    # Final method: find the digest of /etc/localtime in the index of
+    # files in /usr/share/zoneinfo/.
     try:
-        f = open('/etc/localtime', 'rb')
-        localtime = f.read()
-        f.close()
+        digest = _file_digest('/etc/localtime')
     except:
         return None
 
-    for zone in pytz.common_timezones:
-        try:
-            f = open('/usr/share/zoneinfo/' + zone, 'rb')
-            timezone = f.read()
-            f.close()
+    return _zoneinfo_lookup(digest)
 
-            if timezone == localtime:
-                return zone
 
-        except:
-            pass
+def _zoneinfo_lookup(digest):
+    """Looks up the timezone of a zoneinfo file by its digest.
+
+    If the digest is not found, the cached index might be out of date,
+    so it is rebuilt.  Digests which still do not match any timezone are
+    recorded in the index (with no timezone) so that the index is not
+    rebuilt every time."""
+
+    index = _zoneinfo_index()
+
+    if digest not in index:
+        index = _zoneinfo_index(rebuild=True, missing=digest)
+
+    return index.get(digest)
+
+
+def _read_timezone_file(filename, pattern):
+    """Looks for a timezone name in the given file, returning it if
+    it is recognized by pytz."""
+
+    try:
+        with open(filename) as f:
+            for line in f:
+                m = pattern.search(line)
+                if m:
+                    zone = m.group(1)
+                    if zone in pytz.all_timezones:
+                        return zone
+    except:
+        pass
 
     return None
+
+
+def _file_digest(filename):
+    """Computes the SHA-1 digest of the given file."""
+
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _zoneinfo_index(rebuild=False, missing=None):
+    """Returns a dictionary mapping the digests of zoneinfo files
+    to timezone names.
+
+    The dictionary is read from the cache, if it was built for the
+    current zoneinfo files (judging by their modification times) and
+    version of pytz, unless the rebuild option is given.  Otherwise it
+    is built and written to the cache.  Where several timezones have
+    identical files, the first in pytz's list is used.  If a "missing"
+    digest is given, it is recorded as having no timezone if it is not
+    found in the new index."""
+
+    key = [ZONEINFO_DIR, pytz.__version__]
+    for filename in ('', 'tzdata.zi', 'zone.tab'):
+        try:
+            key.append(os.path.getmtime(os.path.join(ZONEINFO_DIR, filename)))
+        except OSError:
+            key.append(None)
+
+    if key[2] is None:
+        return {}
+
+    index = None
+    if not rebuild:
+        index = read_cache('zoneinfo.json', key)
+
+    if index is None:
+        index = {}
+
+        for zone in pytz.common_timezones:
+            try:
+                digest = _file_digest(os.path.join(ZONEINFO_DIR, zone))
+            except:
+                continue
+
+            if digest not in index:
+                index[digest] = zone
+
+        if missing is not None and missing not in index:
+            index[missing] = None
+
+        write_cache('zoneinfo.json', key, index)
+
+    return index
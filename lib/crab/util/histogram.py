@@ -0,0 +1,103 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from math import floor, log
+
+# Ratio between the bounds of successive buckets.  With four buckets
+# per doubling, estimated percentiles are within about 20% of the
+# true value.
+BUCKET_RATIO = 2.0 ** 0.25
+
+
+def duration_bucket(seconds):
+    """Determines the histogram bucket number for a duration
+    in seconds.
+
+    Bucket 0 contains durations of less than a second, and bucket
+    n (for n > 0) those from BUCKET_RATIO ** (n - 1) up to
+    BUCKET_RATIO ** n seconds."""
+
+    if seconds < 1:
+        return 0
+
+    # Add a small amount to avoid rounding exact bounds downwards.
+    return 1 + int(floor(log(seconds, BUCKET_RATIO) + 1e-9))
+
+
+def bucket_bounds(bucket):
+    """Returns the (lower, upper) bounds of a histogram bucket,
+    in seconds."""
+
+    if bucket == 0:
+        return (0.0, 1.0)
+
+    return (BUCKET_RATIO ** (bucket - 1), BUCKET_RATIO ** bucket)
+
+
+class CrabHistogram:
+    """Histogram of job durations, using fixed logarithmic buckets.
+
+    The counts are kept in a dictionary by bucket number, so that
+    histograms can be stored as (bucket, count) pairs and combined
+    simply by adding the counts."""
+
+    def __init__(self, counts=None):
+        self.counts = {}
+        self.total = 0
+
+        if counts is not None:
+            for (bucket, count) in counts.items():
+                self.add_bucket(bucket, count)
+
+    def add(self, seconds, count=1):
+        """Adds a duration, in seconds, to the histogram."""
+
+        self.add_bucket(duration_bucket(seconds), count)
+
+    def add_bucket(self, bucket, count=1):
+        """Adds the given count to a histogram bucket."""
+
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += count
+
+    def merge(self, other):
+        """Adds the counts of another histogram to this one."""
+
+        for (bucket, count) in other.counts.items():
+            self.add_bucket(bucket, count)
+
+    def percentile(self, percent):
+        """Estimates the given percentile of the durations, in seconds.
+
+        The value is interpolated linearly within the bucket in which
+        the percentile falls.  Returns None if the histogram is empty."""
+
+        if not self.total:
+            return None
+
+        target = self.total * percent / 100.0
+        cumulative = 0
+
+        for bucket in sorted(self.counts.keys()):
+            count = self.counts[bucket]
+
+            if count and cumulative + count >= target:
+                (lower, upper) = bucket_bounds(bucket)
+                return lower + (upper - lower) * (
+                    max(target - cumulative, 0) / count)
+
+            cumulative += count
+
+        return bucket_bounds(max(self.counts.keys()))[1]
@@ -0,0 +1,153 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import fcntl
+# Workaround lack of JSON in Python 2.4
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import os
+import sys
+from threading import Lock
+import time
+
+from crab import CrabError
+
+
+class CrabSpool:
+    """Directory in which records, such as client events or outgoing
+    email, are kept until they can be delivered.
+
+    Each record is stored as a JSON file, written to a temporary name
+    and then renamed, so that partially written records are never read.
+    The file names begin with the time at which the record was spooled,
+    so that they can be replayed in order."""
+
+    def __init__(self, directory):
+        """Constructor for spool objects.
+
+        The directory is created if it does not already exist."""
+
+        self.directory = directory
+        self.counter = 0
+        self.counter_lock = Lock()
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory, 0o700)
+            except OSError:
+                err = sys.exc_info()[1]
+                if err.errno != errno.EEXIST:
+                    raise CrabError('could not create spool directory: ' +
+                                    str(err))
+
+    def add(self, record):
+        """Adds an event (given as a dictionary) to the spool.
+
+        Returns the name of the spooled event."""
+
+        with self.counter_lock:
+            self.counter += 1
+            counter = self.counter
+
+        name = '%017.6f-%d-%d.json' % (time.time(), os.getpid(), counter)
+        path = os.path.join(self.directory, name)
+        temporary = os.path.join(self.directory, '.' + name)
+
+        try:
+            with open(temporary, 'w') as file_:
+                json.dump(record, file_)
+
+            os.rename(temporary, path)
+
+        except (IOError, OSError):
+            err = sys.exc_info()[1]
+            raise CrabError('could not write to spool: ' + str(err))
+
+        return name
+
+    def entries(self):
+        """Returns a sorted list of the names of the spooled events."""
+
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            err = sys.exc_info()[1]
+            raise CrabError('could not read spool directory: ' + str(err))
+
+        return sorted(x for x in names
+                      if x.endswith('.json') and not x.startswith('.'))
+
+    def read(self, name):
+        """Reads the named event from the spool."""
+
+        try:
+            with open(os.path.join(self.directory, name)) as file_:
+                return json.load(file_)
+
+        except (IOError, ValueError):
+            err = sys.exc_info()[1]
+            raise CrabError('could not read spooled event: ' + str(err))
+
+    def remove(self, name):
+        """Removes the named event from the spool."""
+
+        try:
+            os.unlink(os.path.join(self.directory, name))
+        except OSError:
+            err = sys.exc_info()[1]
+            if err.errno != errno.ENOENT:
+                raise CrabError('could not remove spooled event: ' +
+                                str(err))
+
+    def size(self, name):
+        """Determines the size in bytes of the named event's file."""
+
+        try:
+            return os.path.getsize(os.path.join(self.directory, name))
+        except OSError:
+            return 0
+
+    def lock(self):
+        """Attempts to take an exclusive lock on the spool, so that only
+        one process replays its events at a time.
+
+        Returns an open file which holds the lock until it is closed,
+        or None if another process holds the lock."""
+
+        try:
+            file_ = open(os.path.join(self.directory, '.lock'), 'a')
+        except IOError:
+            err = sys.exc_info()[1]
+            raise CrabError('could not open spool lock file: ' + str(err))
+
+        try:
+            fcntl.flock(file_.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            file_.close()
+            return None
+
+        return file_
+
+    def age(self, name):
+        """Determines the age in seconds of the named event,
+        based on its name."""
+
+        try:
+            return time.time() - float(name.split('-', 1)[0])
+        except ValueError:
+            return 0.0
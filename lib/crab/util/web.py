@@ -13,8 +13,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from datetime import datetime
+
 import markupsafe
 
+from crab.util.datetime import format_datetime
+
 
 def abbr(text, limit=60, tolerance=10):
     """Returns an abbreviated and HTML-escaped version of the specified text.
@@ -43,3 +47,15 @@ def abbr(text, limit=60, tolerance=10):
 
     else:
         return str(markupsafe.escape(text))
+
+
+def json_default(obj):
+    """Default function for use with JSONEncoder.
+
+    Allows datetime objects, such as the installation time of a job,
+    to be included in JSON responses."""
+
+    if isinstance(obj, datetime):
+        return format_datetime(obj)
+
+    raise TypeError('Cannot JSON-encode object')
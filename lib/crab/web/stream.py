@@ -0,0 +1,451 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import errno
+from json import JSONEncoder
+import select
+import socket
+from threading import Event, Thread
+import time
+
+from crab.util.web import json_default
+
+STATUS_FIELDS = ('status', 'running', 'reliability', 'scheduled')
+
+
+class _StreamClient:
+    """Connection state for a single stream subscriber."""
+
+    __slots__ = ('sock', 'fd', 'inbuf', 'outbuf', 'subscribed', 'closing',
+                 'last_write')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.inbuf = b''
+        self.outbuf = bytearray()
+        self.subscribed = False
+        self.closing = False
+        self.last_write = time.time()
+
+
+class CrabStreamService(Thread):
+    """Service pushing job status updates to web clients as
+    Server-Sent Events.
+
+    All subscribers are handled by this single thread using poll,
+    so that viewers of the dashboard do not each occupy one of the
+    web server's worker threads while waiting for new events.  Each
+    new subscriber is sent the complete job status, and thereafter
+    only the entries which have changed."""
+
+    def __init__(self, config, monitor, service):
+        """Constructor for the stream service.
+
+        Takes the "stream" section of the server configuration,
+        which must include a port number, a reference to the monitor
+        and the dictionary of services (whose status is included in
+        the messages).
+
+        The service listens on the local host only unless a "host"
+        is configured.  The "allow_origin" entry can give a list
+        of web origins permitted to subscribe.  Otherwise only pages
+        from the same host name as the stream (such as the Crab
+        web interface on its usual port) are allowed."""
+
+        Thread.__init__(self)
+
+        self.monitor = monitor
+        self.service = service
+        self.host = config.get('host', '127.0.0.1')
+        self.port = int(config['port'])
+        self.heartbeat = int(config.get('heartbeat', 30))
+        self.max_buffer = int(config.get('max_buffer', 1024 * 1024))
+
+        allow_origin = config.get('allow_origin', None)
+        if allow_origin is None:
+            self.allow_origin = None
+        else:
+            if not isinstance(allow_origin, (list, tuple)):
+                allow_origin = allow_origin.split()
+            self.allow_origin = set(
+                x.rstrip('/').encode('ascii') for x in allow_origin)
+
+        self.json_encoder = JSONEncoder(default=json_default)
+        self.ready = Event()
+        self.poller = None
+        self.clients = {}
+        self.sent = {}
+        self.snapshot = None
+        self.service_status = None
+        self.full_message = None
+
+    def run(self):
+        """Thread run function.
+
+        Opens the listening socket and then loops, handling any
+        socket activity and checking the monitor for new events."""
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(64)
+        listener.setblocking(False)
+        self.port = listener.getsockname()[1]
+
+        listener_fd = listener.fileno()
+        self.poller = select.poll()
+        self.poller.register(listener_fd, select.POLLIN)
+
+        self.monitor.status_ready.wait()
+        self.ready.set()
+
+        while True:
+            try:
+                events = self.poller.poll(1000)
+            except select.error as err:
+                if err.args[0] != errno.EINTR:
+                    raise
+                events = []
+
+            for (fd, event) in events:
+                if fd == listener_fd:
+                    self._accept(listener)
+                    continue
+
+                client = self.clients.get(fd)
+                if client is None:
+                    continue
+
+                try:
+                    if event & (select.POLLIN | select.POLLHUP |
+                                select.POLLERR):
+                        self._read(client)
+                    if event & select.POLLOUT and fd in self.clients:
+                        self._flush(client)
+
+                except Exception as e:
+                    if not isinstance(e, socket.error):
+                        print('Error: stream exception handling client:',
+                              str(e))
+                    self._close(client)
+
+            try:
+                self._check_status()
+            except Exception as e:
+                print('Error: stream exception checking status:', str(e))
+
+            self._check_heartbeat()
+
+    def _accept(self, listener):
+        """Accepts a new connection."""
+
+        try:
+            (sock, address) = listener.accept()
+        except socket.error as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                print('Warning: stream could not accept connection:',
+                      str(err))
+            return
+
+        sock.setblocking(False)
+        client = _StreamClient(sock)
+        self.clients[client.fd] = client
+        self.poller.register(client.fd, select.POLLIN)
+
+    def _read(self, client):
+        """Reads data from a client.
+
+        Only the request header is of interest: once this has been
+        received the client is subscribed, and anything it sends
+        subsequently is discarded."""
+
+        data = client.sock.recv(4096)
+
+        if not data:
+            self._close(client)
+            return
+
+        if client.subscribed or client.closing:
+            return
+
+        client.inbuf += data
+
+        if b'\r\n\r\n' not in client.inbuf:
+            if len(client.inbuf) > 8192:
+                self._close(client)
+            return
+
+        (request, headers) = _parse_request(client.inbuf)
+        client.inbuf = b''
+
+        if (len(request) < 2 or request[0] != b'GET' or
+                request[1].split(b'?', 1)[0] != b'/jobstatus'):
+            self._write(client, b'HTTP/1.0 404 Not Found\r\n'
+                                b'Content-Length: 0\r\n\r\n')
+            self._close(client, flush=True)
+            return
+
+        origin = headers.get(b'origin')
+        if origin is not None and not self._check_origin(
+                origin, headers.get(b'host')):
+            self._write(client, b'HTTP/1.0 403 Forbidden\r\n'
+                                b'Content-Length: 0\r\n\r\n')
+            self._close(client, flush=True)
+            return
+
+        client.subscribed = True
+        self._write(client, b'HTTP/1.1 200 OK\r\n'
+                            b'Content-Type: text/event-stream\r\n'
+                            b'Cache-Control: no-cache\r\n' +
+                    (b'' if origin is None else
+                     b'Access-Control-Allow-Origin: ' + origin + b'\r\n'
+                     b'Vary: Origin\r\n') +
+                    b'\r\n'
+                    b'retry: 10000\n\n')
+
+        if self.full_message is None:
+            self.full_message = self._format_event(self._full_status())
+
+        self._write(client, self.full_message)
+
+    def _check_origin(self, origin, host):
+        """Determines whether a page from the given origin may
+        subscribe to the stream."""
+
+        if self.allow_origin is not None:
+            return origin in self.allow_origin
+
+        if host is None:
+            return False
+
+        return _host_name(origin.split(b'://', 1)[-1]) == _host_name(host)
+
+    def _write(self, client, data):
+        """Queues data to be sent to a client, and attempts to send it.
+
+        If the client is not reading its messages quickly enough,
+        so that too much data is queued, it is disconnected.  (It can
+        then reconnect and receive the complete status again.)"""
+
+        if client.fd not in self.clients:
+            return
+
+        client.outbuf.extend(data)
+        client.last_write = time.time()
+
+        if len(client.outbuf) > self.max_buffer:
+            self._close(client)
+            return
+
+        try:
+            self._flush(client)
+        except socket.error:
+            self._close(client)
+
+    def _flush(self, client):
+        """Sends as much queued data as the client's socket will accept.
+
+        Updates the poll registration so that we are informed
+        when the socket becomes writable if data remains.  A client which
+        is closing is disconnected once all of its data has been sent."""
+
+        if client.outbuf:
+            try:
+                sent = client.sock.send(client.outbuf)
+                del client.outbuf[:sent]
+            except socket.error as err:
+                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+
+        if client.closing:
+            if not client.outbuf:
+                self._close(client)
+                return
+
+            mask = select.POLLOUT
+
+        else:
+            mask = select.POLLIN
+            if client.outbuf:
+                mask |= select.POLLOUT
+
+        self.poller.modify(client.fd, mask)
+
+    def _close(self, client, flush=False):
+        """Disconnects a client.
+
+        If "flush" is specified, the client is only marked as closing,
+        and is disconnected once its remaining data has been sent,
+        without blocking this thread."""
+
+        if client.fd not in self.clients:
+            return
+
+        if flush and client.outbuf:
+            client.closing = True
+
+            try:
+                self._flush(client)
+            except socket.error:
+                self._close(client)
+
+            return
+
+        del self.clients[client.fd]
+
+        try:
+            self.poller.unregister(client.fd)
+        except KeyError:
+            pass
+
+        client.sock.close()
+
+    def _check_status(self):
+        """Checks whether the monitor has published a new status snapshot
+        and if so sends the differences to all subscribed clients."""
+
+        snapshot = self.monitor.snapshot
+        service_status = self._service_status()
+
+        if (snapshot is self.snapshot and
+                service_status == self.service_status):
+            return
+
+        self.snapshot = snapshot
+        self.service_status = service_status
+        self.full_message = None
+
+        current = _status_summary(snapshot.status)
+        (changed, removed) = _status_delta(self.sent, current)
+        self.sent = current
+
+        if not self.clients:
+            return
+
+        message = self._format_event(self._status_message(
+            dict((id_, dict(zip(STATUS_FIELDS, current[id_])))
+                 for id_ in changed),
+            removed=removed))
+
+        for client in list(self.clients.values()):
+            if client.subscribed:
+                self._write(client, message)
+
+    def _check_heartbeat(self):
+        """Sends a comment line to clients to which nothing has been
+        written recently, so that broken connections are detected."""
+
+        threshold = time.time() - self.heartbeat
+
+        for client in list(self.clients.values()):
+            if client.last_write < threshold:
+                if client.closing:
+                    # The client has not read its final response.
+                    self._close(client)
+                elif client.subscribed:
+                    self._write(client, b': heartbeat\n\n')
+
+    def _full_status(self):
+        """Prepares a message containing the status of every job."""
+
+        return self._status_message(dict(
+            (id_, dict(zip(STATUS_FIELDS, summary)))
+            for (id_, summary) in self.sent.items()), full=True)
+
+    def _status_message(self, status, removed=[], full=False):
+        """Constructs a status message dictionary in the style of the
+        response of the jobstatus query."""
+
+        snapshot = self.snapshot
+
+        return {
+            'full': full,
+            'startid': snapshot.startid,
+            'alarmid': snapshot.alarmid,
+            'finishid': snapshot.finishid,
+            'numwarning': snapshot.numwarning,
+            'numerror': snapshot.numerror,
+            'status': status,
+            'removed': removed,
+            'service': dict(self.service_status or ()),
+        }
+
+    def _service_status(self):
+        """Determines whether each of the services is running."""
+
+        return tuple(sorted(
+            (name, self.service[name].is_alive()) for name in self.service))
+
+    def _format_event(self, message):
+        """Formats a message dictionary as a Server-Sent Event."""
+
+        return ('event: status\ndata: ' +
+                self.json_encoder.encode(message) + '\n\n').encode('utf-8')
+
+
+def _status_summary(status):
+    """Extracts the fields of the job status which are of interest to the
+    dashboard, giving a dictionary of tuples."""
+
+    return dict(
+        (id_, tuple(getattr(entry, field) for field in STATUS_FIELDS))
+        for (id_, entry) in list(status.items()))
+
+
+def _status_delta(previous, current):
+    """Compares two status summaries.
+
+    Returns a list of the job IDs which are new or have changed,
+    and a list of those which have been removed.
+
+    >>> _status_delta({1: (0, False), 2: (0, False)},
+    ...               {1: (0, True), 3: (1, False)})
+    ([1, 3], [2])
+    """
+
+    changed = sorted(
+        id_ for (id_, summary) in current.items()
+        if previous.get(id_) != summary)
+
+    removed = sorted(id_ for id_ in previous if id_ not in current)
+
+    return (changed, removed)
+
+
+def _parse_request(data):
+    """Splits a request header into the request line, as a list
+    of words, and a dictionary of header fields with lower case names."""
+
+    lines = data.split(b'\r\n\r\n', 1)[0].split(b'\r\n')
+    headers = {}
+
+    for line in lines[1:]:
+        if b':' in line:
+            (name, value) = line.split(b':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    return (lines[0].split(), headers)
+
+
+def _host_name(host):
+    """Removes the port number, if present, from a host header value."""
+
+    if host.startswith(b'['):
+        return host.split(b']', 1)[0] + b']'
+
+    return host.rsplit(b':', 1)[0] if b':' in host else host
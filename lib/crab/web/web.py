@@ -14,7 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from json import JSONEncoder
 import mimetypes
 import os
@@ -26,10 +26,15 @@ from cherrypy import HTTPError, HTTPRedirect
 from mako import exceptions
 from mako.lookup import TemplateLookup
 from mako.template import Template
+import pytz
 
 from crab import CrabError, CrabStatus
 from crab.util.filter import CrabEventFilter
 from crab.util.datetime import format_datetime, parse_datetime
+from crab.util.web import json_default
+
+LIVE_OUTPUT_TAIL = 64 * 1024
+STATS_DAYS = 30
 
 
 def empty_to_none(value):
@@ -39,6 +44,16 @@ def empty_to_none(value):
     return value
 
 
+def _accepts_gzip():
+    """Determines whether the current request accepts gzip encoding."""
+
+    for encoding in cherrypy.request.headers.elements('Accept-Encoding'):
+        if encoding.value in ('gzip', 'x-gzip') and encoding.qvalue > 0:
+            return True
+
+    return False
+
+
 class CrabWebQuery:
     """CherryPy handler class for the JSON query part of the crab web
     interface."""
@@ -51,27 +66,37 @@ class CrabWebQuery:
         self.monitor = monitor
         self.service = service
 
-        def to_json(obj):
-            if isinstance(obj, datetime):
-                return format_datetime(obj)
-            raise TypeError('Cannot JSON-encode object')
-
-        self.json_encoder = JSONEncoder(default=to_json)
+        self.json_encoder = JSONEncoder(default=json_default)
 
     @cherrypy.expose
     def jobstatus(self, startid, alarmid, finishid):
         """CherryPy handler returning the job status dict fetched
-        from the monitor thread."""
+        from the monitor thread.
+
+        The response is taken from the encoded form cached by the
+        monitor's status snapshot, so that it is shared by all
+        of the requests waiting for the same event.  It is sent
+        compressed if the client accepts gzip encoding."""
 
         try:
-            s = self.monitor.wait_for_event_since(int(startid),
-                                                  int(alarmid), int(finishid))
-            s['service'] = dict((s, self.service[s].is_alive())
-                                for s in self.service)
-            return self.json_encoder.encode(s)
+            snapshot = self.monitor.wait_for_event_since(
+                int(startid), int(alarmid), int(finishid))
         except ValueError:
             raise HTTPError(400, 'Query parameter not an integer')
 
+        service = tuple(sorted((s, self.service[s].is_alive())
+                               for s in self.service))
+
+        compress = _accepts_gzip()
+
+        headers = cherrypy.response.headers
+        headers['Content-Type'] = 'application/json'
+        headers['Vary'] = 'Accept-Encoding'
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+
+        return snapshot.encode(service, compress)
+
     @cherrypy.expose
     def jobinfo(self, id_):
         """CherryPy handler returning the job information for the given job."""
@@ -197,12 +222,22 @@ class CrabWeb:
             else:
                 notification = None
 
+            # Fetch statistics for recent days.
+            stats_start = (datetime.now(pytz.UTC) -
+                           timedelta(days=STATS_DAYS)).date()
+            stats = self.store.get_jobs_stats(
+                [id_], start=stats_start).get(id_)
+            histogram = self.store.get_jobs_histograms(
+                [id_], start=stats_start).get(id_)
+
             return self._write_template(
                 'job.html',
                 {'id': id_, 'info': info, 'config': config,
                  'status': self.monitor.get_job_status(id_),
                  'notification': notification, 'events': events,
-                 'lastdatetime': lastdatetime})
+                 'lastdatetime': lastdatetime,
+                 'stats': stats, 'stats_days': STATS_DAYS,
+                 'histogram': histogram})
 
         elif command == 'clear':
             if submit_confirm:
@@ -344,6 +379,17 @@ class CrabWeb:
                  'stdout': stdout, 'stderr': stderr,
                  'next': finishid_next, 'prev': finishid_prev})
 
+        elif command == 'live':
+            (stdout, stderr) = self.store.get_live_output(
+                info['host'], info['user'], id_)
+
+            # Show only the end of the output, as it may be long.
+            return self._write_template(
+                'joblive.html',
+                {'id': id_,
+                 'stdout': stdout[-LIVE_OUTPUT_TAIL:],
+                 'stderr': stderr[-LIVE_OUTPUT_TAIL:]})
+
         elif command == 'config':
             if submit_relink:
                 try:
@@ -24,7 +24,48 @@ function refreshJobEvents(enddate) {
     history.replaceState(stateObj, '', '/job/' + jobidnumber + '?' + params);
 }
 
+function followJobEvents(url) {
+    var source = new EventSource(url);
+
+    // Reload the event list when this job's status changes, unless
+    // an earlier page of events is being viewed.
+    source.addEventListener('status', function (event) {
+        var data = JSON.parse(event.data);
+
+        if (data['full'] || ! (jobidnumber in data['status'])) {
+            return;
+        }
+
+        if (history.state && history.state.enddate) {
+            return;
+        }
+
+        refreshJobEvents(null);
+    });
+}
+
+function refreshLiveOutput() {
+    $.ajax('/job/' + jobidnumber + '/live', {
+        dataType: 'html',
+        success: function (data, text, xhr) {
+            $('#liveoutput').html(data);
+        },
+        timeout: 10000
+    });
+}
+
 $(document).ready(function () {
+    if ($('#liveoutput').length) {
+        refreshLiveOutput();
+        setInterval(refreshLiveOutput, 15000);
+    }
+
+    var streamURL = crabStreamURL('/jobstatus');
+
+    if (streamURL !== null) {
+        followJobEvents(streamURL);
+    }
+
     $('#eventsform').change(function (event) {
         if (history.state && ('enddate' in history.state)) {
             refreshJobEvents(history.state.enddate);
@@ -172,6 +172,28 @@ function refreshStatusCometLoop(startid, alarmid, finishid) {
     });
 }
 
+function refreshStatusStream(url) {
+    var source = new EventSource(url);
+
+    source.addEventListener('status', function (event) {
+        var data = JSON.parse(event.data);
+
+        for (var i in data['removed']) {
+            $('#row_' + data['removed'][i]).remove();
+        }
+
+        updateStatus(data);
+        $('table#joblist').fadeTo(500, 1.0);
+    });
+
+    // The browser will try to reconnect automatically, and the server
+    // will then resend the status of all jobs.
+    source.onerror = function (event) {
+        $('table#joblist').fadeTo(500, 0.3);
+        setFavicon(disconnectFavicon);
+    };
+}
+
 function dashboardSorter(keyfield) {
     var sortdirection = 1;
 
@@ -212,7 +234,14 @@ function dashboardSortStatus(event) {
 }
 
 $(document).ready(function () {
-    refreshStatusCometLoop(0, 0, 0);
+    var streamURL = crabStreamURL('/jobstatus');
+
+    if (streamURL !== null) {
+        refreshStatusStream(streamURL);
+    }
+    else {
+        refreshStatusCometLoop(0, 0, 0);
+    }
 
     $('#command_refresh').click(function (event) {
         refreshStatusOnce();
@@ -74,6 +74,7 @@ setup(
                    'crab',
                    'crabd',
                    'crabd-check',
+                   'crabrelay',
                    'crabsh',
               ]],
     data_files=(
@@ -81,6 +82,7 @@ setup(
          [os.path.join('doc', doc) for doc in [
               'crab.ini',
               'crabd.ini',
+              'crabrelay.ini',
               'schema.sql',
            ]])] +
         find_files(os.path.join('share', 'crab'), None, ['res']) +
@@ -96,6 +98,9 @@ setup(
         'License :: OSI Approved :: GNU General Public License'
         ' v3 or later (GPLv3+)',
         'Programming Language :: Python',
+        'Programming Language :: Python :: 2.6',
+        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
         'Topic :: System :: Monitoring'
     ]
 )
@@ -39,3 +39,12 @@ function crabStatusIsWarning(status_) {
             return false;
     }
 }
+
+function crabStreamURL(path) {
+% if options.get('stream_port') is not None:
+    if (window.EventSource) {
+        return location.protocol + '//' + location.hostname + ':${options['stream_port'] | h}' + path;
+    }
+% endif
+    return null;
+}
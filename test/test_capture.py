@@ -0,0 +1,63 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+from crab.util.capture import CrabOutputCapture, capture_process_output
+
+
+class OutputCaptureTestCase(TestCase):
+    def test_small(self):
+        capture = CrabOutputCapture(limit=100, tail=10, memory=50)
+        capture.write(b'abc')
+        capture.write(b'def')
+
+        self.assertEqual(capture.size, 6)
+        self.assertEqual(capture.skipped, 0)
+        self.assertEqual(capture.getvalue(), b'abcdef')
+
+    def test_spill(self):
+        capture = CrabOutputCapture(limit=100, tail=10, memory=5)
+
+        for i in range(10):
+            capture.write(str(i).encode('ascii'))
+
+        self.assertEqual(capture.getvalue(), b'0123456789')
+
+        # Iterating again should give the same output.
+        self.assertEqual(b''.join(capture), b'0123456789')
+
+        capture.close()
+
+    def test_tail(self):
+        capture = CrabOutputCapture(limit=4, tail=6, memory=2)
+
+        capture.write(b'abcdefgh')
+        capture.write(b'ijklmnopqr')
+        capture.write(b'stu')
+
+        self.assertEqual(capture.size, 21)
+        self.assertEqual(capture.skipped, 11)
+
+        value = capture.getvalue()
+        self.assertTrue(value.startswith(b'abcd\n[... 11 bytes'))
+        self.assertTrue(value.endswith(b'...]\npqrstu'))
+
+        capture.close()
+
+    def test_process(self):
+        stdout = CrabOutputCapture(limit=1000, tail=100, memory=100)
+        stderr = CrabOutputCapture()
+
+        p = subprocess.Popen(
+            [sys.executable, '-c',
+             'import sys; sys.stdout.write("x" * 5000); '
+             'sys.stderr.write("error"); sys.exit(3)'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        self.assertEqual(capture_process_output(p, stdout, stderr), 3)
+
+        self.assertEqual(stdout.size, 5000)
+        self.assertEqual(stdout.skipped, 3900)
+        self.assertEqual(stderr.getvalue(), b'error')
+
+        stdout.close()
@@ -0,0 +1,212 @@
+from json import loads
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from threading import Thread
+from unittest import TestCase
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from crab import CrabError
+from crab.client import CrabClient, CrabNotSentError
+
+
+class DummyHandler(BaseHTTPRequestHandler):
+    """Minimal Crab server, recording the requests received and the
+    port from which each was sent."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._respond(b'{"crontab": ["* * * * * command1"]}')
+
+    def do_PUT(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size + 2)[:size]
+                if not size:
+                    break
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+
+        response = b'{}'
+        if self.path == '/api/0/events':
+            response = ('{"results": [' + ', '.join(
+                ['{}'] * len(loads(body.decode('utf-8')))) + ']}').encode(
+                'utf-8')
+
+        self._respond(response, body)
+
+    def _respond(self, response, body=None):
+        server = self.server
+        server.requests.append(
+            (self.client_address[1], self.command, self.path, body))
+
+        if server.drop:
+            server.drop -= 1
+            self.close_connection = True
+            return
+
+        self.send_response(server.status.get(self.path, 200))
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+        if server.close_idle:
+            # Close the connection without telling the client.
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class ClientTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        self.server = HTTPServer(('127.0.0.1', 0), DummyHandler)
+        self.server.requests = []
+        self.server.drop = 0
+        self.server.close_idle = False
+        self.server.status = {}
+
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.environ = os.environ.copy()
+        os.environ.update({
+            'CRABHOST': '127.0.0.1',
+            'CRABPORT': str(self.server.server_address[1]),
+            'CRABUSERNAME': 'user1',
+            'CRABCLIENTHOSTNAME': 'host1',
+            'CRABSYSCONFIG': self.directory,
+            'CRABUSERCONFIG': self.directory,
+        })
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_reuse(self):
+        client = CrabClient(command='command1', crabid='job1')
+
+        self.assertEqual(client.fetch_crontab(), '* * * * * command1')
+        self.assertEqual(client.fetch_crontab(), '* * * * * command1')
+        client.finish(status=0)
+
+        ports = [x[0] for x in self.server.requests]
+        self.assertEqual(len(ports), 3)
+        self.assertEqual(len(set(ports)), 1)
+        client.close()
+
+    def test_closed_idle(self):
+        client = CrabClient(command='command1', crabid='job1')
+        self.server.close_idle = True
+
+        client.fetch_crontab()
+
+        # Wait for the server to close the connection.
+        client._conn.sock.settimeout(10)
+        self.assertEqual(client._conn.sock.recv(1, socket.MSG_PEEK), b'')
+
+        client.finish(status=0)
+
+        requests = self.server.requests
+        self.assertEqual([x[1] for x in requests], ['GET', 'PUT'])
+        self.assertNotEqual(requests[0][0], requests[1][0])
+        client.close()
+
+    def test_no_resend(self):
+        client = CrabClient(command='command1', crabid='job1')
+        client.fetch_crontab()
+
+        # The server drops the connection after receiving the finish,
+        # which may have been logged, so it should not be sent again.
+        self.server.drop = 1
+
+        try:
+            client.finish(status=0)
+            self.fail('finish did not raise an error')
+        except CrabError as err:
+            self.assertNotIsInstance(err, CrabNotSentError)
+
+        self.assertEqual([x[1] for x in self.server.requests],
+                         ['GET', 'PUT'])
+        client.close()
+
+    def test_not_sent(self):
+        # Find a port on which nothing is listening.
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        os.environ['CRABPORT'] = str(sock.getsockname()[1])
+        sock.close()
+
+        client = CrabClient(command='command1', crabid='job1')
+
+        with self.assertRaises(CrabNotSentError):
+            client.finish(status=0)
+
+    def test_send_events_fallback(self):
+        client = CrabClient(command='command1', crabid='job1')
+
+        # The server does not support batches of events, and rejects
+        # the second event.
+        self.server.status['/api/0/events'] = 404
+        self.server.status['/api/0/finish/host1/user1/job2'] = 500
+
+        events = [
+            {'action': 'start', 'host': 'host1', 'user': 'user1',
+             'crabid': 'job1', 'command': 'command1'},
+            {'action': 'finish', 'host': 'host1', 'user': 'user1',
+             'crabid': 'job2', 'command': 'command2', 'status': 0},
+        ]
+
+        self.assertEqual(client.send_events(events), [{}])
+
+        with self.assertRaises(CrabError):
+            client.send_events(events[1:])
+
+        client.close()
+
+    def test_crabsh_spool(self):
+        spool_dir = os.path.join(self.directory, 'spool')
+
+        with open(os.path.join(self.directory, 'crab.ini'), 'w') as file:
+            file.write('[client]\nspool_dir = ' + spool_dir + '\n')
+
+        # Spool an event, as if the server had been unreachable
+        # during an earlier run.
+        client = CrabClient(command='command1', crabid='job1')
+        client.spool_event('finish', status=0, timestamp=0)
+        self.assertTrue(client.spool_pending())
+
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.path.abspath('lib')
+
+        subprocess.check_call(
+            [sys.executable, 'scripts/crabsh', '--id', 'job1',
+             '-c', 'echo test'], env=env)
+
+        # The new events should be spooled behind the earlier event
+        # and then all sent together after the job has finished.
+        self.assertFalse(client.spool_pending())
+        self.assertEqual([x[2] for x in self.server.requests],
+                         ['/api/0/events'])
+        self.assertEqual(
+            [x['action'] for x in loads(
+                self.server.requests[0][3].decode('utf-8'))],
+            ['finish', 'start', 'finish'])
@@ -0,0 +1,42 @@
+from io import BytesIO
+from unittest import TestCase
+
+from crab import CrabError
+from crab.util.compress import ENCODINGS, CrabDecompressReader, \
+    choose_encoding, compress, decompress, parse_encodings
+
+
+class CompressTestCase(TestCase):
+    def test_encodings(self):
+        self.assertEqual(parse_encodings('gzip, zstd;q=0.5, br;q=0'),
+                         ['gzip', 'zstd'])
+        self.assertEqual(parse_encodings(None), [])
+
+        self.assertEqual(choose_encoding(['br', 'gzip']), 'gzip')
+        self.assertIsNone(choose_encoding(['br']))
+
+    def test_round_trip(self):
+        data = b'{"stdout": "' + b'output ' * 1000 + b'"}\n'
+
+        for encoding in ENCODINGS:
+            compressed = compress(data, encoding)
+            self.assertLess(len(compressed), len(data) // 10)
+            self.assertEqual(decompress(compressed, encoding), data)
+
+    def test_reader(self):
+        data = b''.join(b'line ' + str(i).encode('ascii') + b'\n'
+                        for i in range(10000))
+
+        reader = CrabDecompressReader(
+            BytesIO(compress(data, 'gzip')), 'gzip', len(data))
+
+        self.assertEqual(reader.readline(), b'line 0\n')
+        self.assertEqual(reader.readline(), b'line 1\n')
+        self.assertEqual(reader.read(), data[14:])
+        self.assertEqual(reader.readline(), b'')
+
+        # Data which expands beyond the limit should not be accepted.
+        reader = CrabDecompressReader(
+            BytesIO(compress(data, 'gzip')), 'gzip', len(data) // 2)
+
+        self.assertRaises(CrabError, reader.read)
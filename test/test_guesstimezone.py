@@ -0,0 +1,116 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from crab.util import guesstimezone
+from crab.util.guesstimezone import TIMEZONE_FILES, _read_timezone_file, \
+    _zoneinfo_lookup
+
+
+class TimezoneFileTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_timezone_files(self):
+        contents = {
+            '/etc/timezone': 'Pacific/Honolulu\n',
+            '/etc/sysconfig/clock': '# Comment\nZONE="Pacific/Honolulu"\n',
+            '/etc/conf.d/clock': 'clock="UTC"\nTIMEZONE="Pacific/Honolulu"\n',
+        }
+
+        for (filename, pattern) in TIMEZONE_FILES:
+            path = os.path.join(self.directory, os.path.basename(filename))
+
+            with open(path, 'w') as f:
+                f.write(contents[filename])
+
+            self.assertEqual(_read_timezone_file(path, pattern),
+                             'Pacific/Honolulu')
+
+            # Names which pytz does not recognize should be ignored.
+            with open(path, 'w') as f:
+                f.write('Not/A_Zone\n')
+
+            self.assertIsNone(_read_timezone_file(path, pattern))
+
+
+class ZoneinfoIndexTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.directory, 'cache')
+
+        self.zoneinfo_dir = guesstimezone.ZONEINFO_DIR
+        guesstimezone.ZONEINFO_DIR = os.path.join(self.directory, 'zoneinfo')
+
+        for zone in ('UTC', 'Pacific/Honolulu', 'Pacific/Tahiti'):
+            self._write_zone(zone, zone)
+
+        # Count the files read to build the index.
+        self.digests = []
+        self.file_digest = guesstimezone._file_digest
+
+        def file_digest(filename):
+            digest = self.file_digest(filename)
+            self.digests.append(filename)
+            return digest
+
+        guesstimezone._file_digest = file_digest
+
+    def tearDown(self):
+        guesstimezone.ZONEINFO_DIR = self.zoneinfo_dir
+        guesstimezone._file_digest = self.file_digest
+
+        if self.environ is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.environ
+
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        digest = hashlib.sha1(b'Pacific/Honolulu').hexdigest()
+
+        self.assertEqual(_zoneinfo_lookup(digest), 'Pacific/Honolulu')
+        self.assertEqual(len(self.digests), 3)
+
+        # The index should now be read from the cache.
+        self.assertEqual(_zoneinfo_lookup(digest), 'Pacific/Honolulu')
+        self.assertEqual(len(self.digests), 3)
+
+    def test_stale(self):
+        _zoneinfo_lookup(hashlib.sha1(b'UTC').hexdigest())
+        self.assertEqual(len(self.digests), 3)
+
+        # Alter a file without changing the directory modification
+        # times used as the cache key.
+        self._write_zone('Pacific/Tahiti', 'new')
+
+        self.assertEqual(_zoneinfo_lookup(hashlib.sha1(b'new').hexdigest()),
+                         'Pacific/Tahiti')
+        self.assertEqual(len(self.digests), 6)
+
+    def test_missing(self):
+        digest = hashlib.sha1(b'other').hexdigest()
+
+        self.assertIsNone(_zoneinfo_lookup(digest))
+        self.assertEqual(len(self.digests), 6)
+
+        # The miss should be remembered rather than rebuilding again.
+        self.assertIsNone(_zoneinfo_lookup(digest))
+        self.assertEqual(len(self.digests), 6)
+
+    def _write_zone(self, zone, content):
+        path = os.path.join(guesstimezone.ZONEINFO_DIR, zone)
+        directory = os.path.dirname(path)
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(path, 'w') as f:
+            f.write(content)
@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from crab.util.histogram import CrabHistogram, bucket_bounds, \
+    duration_bucket
+
+
+class HistogramTestCase(TestCase):
+    def test_buckets(self):
+        self.assertEqual(duration_bucket(0), 0)
+        self.assertEqual(duration_bucket(1), 1)
+        self.assertEqual(duration_bucket(2), 5)
+
+        for seconds in (0, 1, 5, 59, 60, 3600, 86400):
+            (lower, upper) = bucket_bounds(duration_bucket(seconds))
+            self.assertLessEqual(lower, seconds)
+            self.assertLess(seconds, upper)
+
+    def test_percentile(self):
+        histogram = CrabHistogram()
+        self.assertIsNone(histogram.percentile(50))
+
+        for seconds in range(1, 101):
+            histogram.add(seconds)
+
+        self.assertEqual(histogram.total, 100)
+
+        for (percent, expect) in ((10, 10), (50, 50), (90, 90), (99, 99)):
+            self.assertAlmostEqual(histogram.percentile(percent), expect,
+                                   delta=(0.2 * expect))
+
+        # Histograms should combine by adding their counts.
+        other = CrabHistogram(histogram.counts)
+        other.merge(histogram)
+        self.assertEqual(other.total, 200)
+        self.assertEqual(other.percentile(50), histogram.percentile(50))
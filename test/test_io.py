@@ -1,6 +1,15 @@
+from datetime import datetime, timedelta
+from io import StringIO
+import json
 from unittest import main, TestCase
 
-from crab.server.io import _filter_dict, _notify_key
+import pytz
+
+from crab import CrabStatus
+from crab.server.io import CrabIOProgress, _filter_dict, _notify_key, \
+    export_config, export_ndjson, import_config
+
+from . import CrabDBTestCase
 
 
 class ServerIOTestCase(TestCase):
@@ -38,3 +47,87 @@ class ServerIOTestCase(TestCase):
         self.assertEqual(result, ('localhost', 'user',
                                   'email', 'user@localhost',
                                   '* * * * *', 'Pacific/Honolulu'))
+
+
+class NDJSONTestCase(CrabDBTestCase):
+    def test_round_trip(self):
+        """Test export and import of newline-delimited JSON, including
+        the event history."""
+
+        self.store.save_crontab('host1', 'user1', [
+            '0 * * * * CRABID=job1 command1',
+            '30 * * * * command2'])
+        ids = dict((x['command'], x['id']) for x in self.store.get_jobs())
+
+        configid = self.store.write_job_config(ids['command1'], timeout=10)
+        self.store.write_notification(
+            None, configid, None, None, 'email', 'a@localhost',
+            None, None, False, False, False, True)
+        self.store.write_notification(
+            None, None, 'host1', None, 'email', 'b@localhost',
+            None, None, True, False, False, False)
+
+        start = datetime(2026, 5, 1, tzinfo=pytz.UTC)
+        events = []
+        for n in range(3):
+            for (action, offset) in (('start', 0), ('finish', 60 * n)):
+                events.append({
+                    'action': action, 'host': 'host1', 'user': 'user1',
+                    'crabid': 'job1', 'command': 'command1',
+                    'datetime': start + timedelta(hours=n, seconds=offset),
+                    'status': CrabStatus.FAIL if n else CrabStatus.SUCCESS,
+                    'stdout': 'output {0}'.format(n), 'stderr': ''})
+        self.store.log_events(events)
+        self.store.log_alarm(ids['command1'], CrabStatus.LATE,
+                             start + timedelta(minutes=1))
+
+        file_ = StringIO()
+        progress = CrabIOProgress('Exported', file_=StringIO())
+        export_ndjson(self.store, file_, include_events=True,
+                      progress=progress)
+        self.assertEqual(progress.counts, {
+            'job': 2, 'event': 7, 'crontab': 1, 'notification': 1})
+
+        lines = file_.getvalue().splitlines()
+        self.assertEqual(json.loads(lines[0]),
+                         {'type': 'header', 'version': 1})
+
+        # Import into a new store.
+        original = self.store
+        self.setUp()
+        self.addCleanup(original.lock.conn.close)
+
+        file_.seek(0)
+        progress = CrabIOProgress('Imported', file_=StringIO())
+        import_config(self.store, file_, progress=progress)
+        self.assertEqual(progress.counts, {
+            'job': 2, 'event': 7, 'crontab': 1, 'notification': 1})
+
+        for store in (original, self.store):
+            id_ = store.check_job('host1', 'user1', 'job1', 'command1')
+            self.assertEqual(store.get_job_config(id_)['timeout'], 10)
+
+        def history(store):
+            id_ = store.check_job('host1', 'user1', 'job1', 'command1')
+            return [
+                (x['type'], x['datetime'], x['status'], x['duration'],
+                 store.get_job_output(x['eventid'], 'host1', 'user1', id_,
+                                      'job1') if x['type'] == 3 else None)
+                for x in store.get_job_events(id_)]
+
+        self.assertEqual(history(self.store), history(original))
+        self.assertEqual(*[
+            list(store.get_jobs_stats([store.check_job(
+                'host1', 'user1', 'job1', 'command1')]).values())
+            for store in (self.store, original)])
+        self.assertEqual(self.store.get_raw_crontab('host1', 'user1'),
+                         original.get_raw_crontab('host1', 'user1'))
+        self.assertEqual(len(self.store.get_match_notifications()), 1)
+
+        # Exports in the earlier JSON format should still be accepted.
+        file_ = StringIO()
+        export_config(original, file_)
+        file_.seek(0)
+        import_config(self.store, file_)
+        self.assertEqual(len(self.store.get_jobs()), 2)
+        self.assertEqual(len(self.store.get_match_notifications()), 1)
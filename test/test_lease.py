@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from crab.service.lease import CrabLeaseService
+
+from . import CrabDBTestCase
+
+
+class LeaseTestCase(CrabDBTestCase):
+    def test_lease(self):
+        minute = timedelta(minutes=1)
+
+        self.assertTrue(self.store.acquire_lease('test', 'a', minute))
+        self.assertFalse(self.store.acquire_lease('test', 'b', minute))
+
+        # The expiry time should be stored in the database's own format.
+        with self.store.lock as c:
+            c.execute('SELECT expires, CURRENT_TIMESTAMP FROM lease', [])
+            (expires, now) = c.fetchone()
+
+        self.assertEqual(len(expires), len(now))
+        self.assertTrue(expires > now)
+
+        # The holder should be able to renew the lease.
+        self.assertTrue(self.store.acquire_lease('test', 'a', minute))
+
+        # Leases with different names should be independent.
+        self.assertTrue(self.store.acquire_lease('other', 'b', minute))
+
+        # An expired lease should be available to another holder.
+        self.assertTrue(self.store.acquire_lease(
+            'test', 'a', timedelta(seconds=-1)))
+        self.assertTrue(self.store.acquire_lease('test', 'b', minute))
+        self.assertFalse(self.store.acquire_lease('test', 'a', minute))
+
+        # As should a released lease.
+        self.store.release_lease('test', 'a')
+        self.assertFalse(self.store.acquire_lease('test', 'a', minute))
+        self.store.release_lease('test', 'b')
+        self.assertTrue(self.store.acquire_lease('test', 'a', minute))
+
+    def test_service(self):
+        config = {'lease_name': 'crabd', 'lease_time': 60}
+
+        node_a = CrabLeaseService(dict(config, node='a'), self.store)
+        node_b = CrabLeaseService(dict(config, node='b'), self.store)
+
+        self.assertFalse(node_a.is_held())
+
+        self.assertTrue(node_a.renew())
+        self.assertFalse(node_b.renew())
+        self.assertTrue(node_a.is_held())
+        self.assertFalse(node_b.is_held())
+
+        # Simulate node A failing: node B should take over once the
+        # lease has been released or has expired.
+        self.store.release_lease('crabd', 'a')
+        self.assertTrue(node_b.renew())
+        self.assertFalse(node_a.renew())
+        self.assertFalse(node_a.is_held())
+        self.assertTrue(node_b.is_held())
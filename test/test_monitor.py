@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta
+import gzip
+from json import loads
+from unittest import TestCase
+
+import pytz
+
+from crab import CrabStatus
+from crab.service.monitor import CrabJobState, CrabJobStatus, CrabMonitor, \
+    CrabStatusSnapshot, HISTORY_COUNT
+
+from . import CrabDBTestCase
+
+
+class StatusSnapshotTestCase(TestCase):
+    def test_encode(self):
+        snapshot = CrabStatusSnapshot(3, 2, 1, {
+            1: CrabJobStatus(
+                status=0, running=False, reliability=100, scheduled=True,
+                installed=datetime(2016, 1, 2, 3, 4, 5, tzinfo=pytz.UTC),
+                history=(0,)),
+        }, 0, 0)
+
+        service = (('Monitor', True),)
+        encoded = snapshot.encode(service)
+        self.assertIsInstance(encoded, bytes)
+
+        # The encoded form should be cached.
+        self.assertIs(snapshot.encode(service), encoded)
+
+        message = loads(encoded.decode('utf-8'))
+        self.assertEqual(message['startid'], 3)
+        self.assertEqual(message['finishid'], 1)
+        self.assertEqual(message['service'], {'Monitor': True})
+        self.assertEqual(message['status']['1']['installed'],
+                         '2016-01-02 03:04:05')
+
+        compressed = snapshot.encode(service, compress=True)
+        self.assertIs(snapshot.encode(service, compress=True), compressed)
+        self.assertEqual(gzip.decompress(compressed), encoded)
+
+        # Different service status should give a different encoding.
+        message = loads(snapshot.encode((('Monitor', False),)).decode('utf-8'))
+        self.assertEqual(message['service'], {'Monitor': False})
+
+
+class MonitorPublishTestCase(TestCase):
+    def test_copy_on_write(self):
+        monitor = CrabMonitor(None)
+
+        for id_ in (1, 2):
+            monitor.jobs[id_] = CrabJobState(None)
+            monitor.status_dirty.add(id_)
+
+        monitor._publish_status()
+        first = monitor.snapshot
+        self.assertEqual(sorted(first.status.keys()), [1, 2])
+        self.assertEqual(first.numerror, 0)
+
+        # Change only one job: the other's record should be shared.
+        monitor.jobs[2].status = 1
+        monitor.jobs[2].add_history(1)
+        monitor.status_dirty.add(2)
+        monitor._publish_status()
+        second = monitor.snapshot
+
+        self.assertIs(second.status[1], first.status[1])
+        self.assertEqual(second.status[2].status, 1)
+        self.assertEqual(second.status[2].history, (1,))
+        self.assertEqual(first.status[2].status, None)
+        self.assertEqual(second.numerror, 1)
+
+        # Removing the job should also update the counts.
+        del monitor.jobs[2]
+        monitor.status_dirty.add(2)
+        monitor._publish_status()
+
+        self.assertEqual(list(monitor.snapshot.status.keys()), [1])
+        self.assertEqual(monitor.snapshot.numerror, 0)
+
+
+class JobStateTestCase(TestCase):
+    def test_history(self):
+        job = CrabJobState(None)
+        self.assertEqual(job.get_history(), ())
+        self.assertEqual(job.reliability, 0)
+
+        job.add_history(CrabStatus.SUCCESS)
+        job.add_history(CrabStatus.FAIL)
+        self.assertEqual(job.get_history(), (0, 1))
+        self.assertEqual(job.reliability, 50)
+
+        # Fill the ring buffer so that the oldest entries are replaced.
+        for i in range(HISTORY_COUNT - 1):
+            job.add_history(CrabStatus.SUCCESS)
+
+        history = job.get_history()
+        self.assertEqual(len(history), HISTORY_COUNT)
+        self.assertEqual(history[0], CrabStatus.FAIL)
+        self.assertEqual(job.reliability, 90)
+
+        job.add_history(CrabStatus.WARNING)
+        self.assertEqual(job.get_history()[0], CrabStatus.SUCCESS)
+        self.assertEqual(job.get_history()[-1], CrabStatus.WARNING)
+        self.assertEqual(job.reliability, 90)
+
+
+class AdaptiveTimeoutTestCase(CrabDBTestCase):
+    def test_adaptive_timeout(self):
+        start = datetime.now(pytz.UTC).replace(microsecond=0) - \
+            timedelta(days=1)
+        events = []
+
+        for n in range(6):
+            for (action, offset) in (('start', 0), ('finish', 600)):
+                events.append({
+                    'action': action, 'host': 'host1', 'user': 'user1',
+                    'crabid': 'job1', 'command': 'command1',
+                    'datetime': start + timedelta(hours=n, seconds=offset),
+                    'status': CrabStatus.SUCCESS,
+                    'stdout': '', 'stderr': ''})
+
+        # Leave the last run unfinished.
+        events.pop()
+        self.store.log_events(events)
+        id_ = self.store.check_job('host1', 'user1', 'job1', 'command1')
+        last_start = events[-1]['datetime']
+
+        monitor = CrabMonitor(self.store)
+        monitor._initialize_job(id_, load_events=True)
+        self.assertEqual(monitor.timeout[id_],
+                         last_start + timedelta(minutes=5))
+
+        monitor = CrabMonitor(self.store, config={
+            'adaptive_timeout': True, 'timeout_factor': 2.0})
+        monitor._initialize_job(id_, load_events=True)
+        self.assertEqual(monitor.jobs[id_].histogram.total, 5)
+        timeout = monitor.timeout[id_] - last_start
+        self.assertGreater(timeout, timedelta(seconds=1200))
+        self.assertLess(timeout, timedelta(seconds=1500))
+
+        # An explicitly configured timeout should take precedence.
+        self.store.write_job_config(id_, timeout=10)
+        monitor._initialize_job(id_, load_events=True)
+        self.assertEqual(monitor.timeout[id_],
+                         last_start + timedelta(minutes=10))
+
+    def test_histogram_updates(self):
+        start = datetime.now(pytz.UTC).replace(microsecond=0) - \
+            timedelta(hours=1)
+
+        self.store.log_start('host1', 'user1', 'job1', 'command1', start)
+        self.store.log_finish('host1', 'user1', 'job1', 'command1',
+                              CrabStatus.SUCCESS,
+                              datetime_=(start + timedelta(seconds=600)))
+        id_ = self.store.check_job('host1', 'user1', 'job1', 'command1')
+
+        # A job first seen by its finish event should not have
+        # that run counted twice.
+        monitor = CrabMonitor(self.store, config={'adaptive_timeout': True})
+        monitor._handle_events(self.store.get_events_since(0, 0, 0))
+        self.assertEqual(monitor.jobs[id_].histogram.total, 1)
+
+        # Subsequent runs are added as they are seen.
+        self.store.log_start('host1', 'user1', 'job1', 'command1',
+                             start + timedelta(seconds=1200))
+        self.store.log_finish('host1', 'user1', 'job1', 'command1',
+                              CrabStatus.SUCCESS,
+                              datetime_=(start + timedelta(seconds=1800)))
+        monitor._handle_events(self.store.get_events_since(
+            monitor.max_startid, monitor.max_alarmid, monitor.max_finishid))
+        self.assertEqual(monitor.jobs[id_].histogram.total, 2)
+
+        # Histograms should be reloaded on the next day.
+        monitor.jobs[id_].histogram.add(10000)
+        now = datetime.now(pytz.UTC)
+        monitor.histogram_date = now.date()
+        monitor.run_minutely(now)
+        self.assertEqual(monitor.jobs[id_].histogram.total, 3)
+
+        monitor.run_minutely(now + timedelta(days=1))
+        self.assertEqual(monitor.jobs[id_].histogram.total, 2)
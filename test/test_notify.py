@@ -0,0 +1,204 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+import os
+from unittest import TestCase
+
+import pytz
+
+from crab import CrabEvent, CrabStatus
+from crab.notify import CrabNotify, CrabNotifyJob
+from crab.service.notify import CrabNotifyService
+
+from . import CrabDBTestCase
+
+
+class DummySMTP:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, from_, to, message):
+        self.messages.append((to, message))
+
+
+class DummyStore:
+    def __init__(self, notifications):
+        self.notifications = notifications
+        self.notification_version = 0
+        self.queries = 0
+
+    def get_notifications(self):
+        self.queries += 1
+        return self.notifications
+
+
+def make_notification(notifyid, id_, address, time=None,
+                      skip_warning=False, skip_error=False):
+    return {'notifyid': notifyid, 'id': id_, 'method': 'email',
+            'address': address, 'time': time, 'timezone': 'UTC',
+            'skip_ok': False, 'skip_warning': skip_warning,
+            'skip_error': skip_error, 'include_output': False}
+
+
+class NotifyServiceTestCase(TestCase):
+    def setUp(self):
+        self.sent = []
+
+    def _make_service(self, notifications, **kwargs):
+        config = {'daily': '0 0 * * *', 'timezone': 'UTC'}
+        config.update(kwargs)
+        store = DummyStore(notifications)
+        service = CrabNotifyService(config, store, self.sent.append)
+        return (service, store)
+
+    def test_schedule(self):
+        (service, store) = self._make_service([
+            make_notification(1, 101, 'a', '30 * * * *'),
+            make_notification(2, 102, 'b'),
+        ], refresh=60)
+
+        minute = timedelta(minutes=1)
+        datetime_ = datetime(2026, 1, 1, 23, 29, tzinfo=pytz.UTC)
+
+        service.run_minutely(datetime_)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(store.queries, 1)
+
+        # The hourly notification should fire at half past.
+        service.run_minutely(datetime_ + minute)
+        self.assertEqual(len(self.sent), 1)
+        (job,) = self.sent[0]
+        self.assertEqual(job.n['notifyid'], 1)
+        self.assertEqual(job.start, datetime_ + minute - timedelta(hours=1))
+        self.assertEqual(job.end, datetime_ + minute)
+
+        # The list should not have been re-read.
+        service.run_minutely(datetime_ + 2 * minute)
+        self.assertEqual(store.queries, 1)
+
+        # The daily notification should fire at midnight.
+        midnight = datetime(2026, 1, 2, tzinfo=pytz.UTC)
+        service.run_minutely(midnight)
+        self.assertEqual(len(self.sent), 2)
+        (job,) = self.sent[1]
+        self.assertEqual(job.n['notifyid'], 2)
+        self.assertEqual(job.start, midnight - timedelta(days=1))
+
+        # Changes should be seen once the store's version changes,
+        # and a new schedule due since the last refresh should not be missed.
+        store.notifications.append(make_notification(3, 103, 'c', '5 0 * * *'))
+        service.run_minutely(midnight + 10 * minute)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(store.queries, 1)
+
+        store.notification_version += 1
+        service.run_minutely(midnight + 11 * minute)
+        self.assertEqual(store.queries, 2)
+        self.assertEqual(len(self.sent), 3)
+        (job,) = self.sent[2]
+        self.assertEqual(job.n['notifyid'], 3)
+        self.assertEqual(job.end, midnight + 5 * minute)
+
+        # The list should also be re-read periodically.
+        service.run_minutely(midnight + 71 * minute)
+        self.assertEqual(store.queries, 3)
+
+    def test_alert(self):
+        (service, store) = self._make_service([
+            make_notification(1, 101, 'a'),
+            make_notification(2, 101, 'b', skip_error=True),
+            make_notification(3, 102, 'a'),
+        ], alert=True, alert_window=60, alert_interval=600)
+
+        second = timedelta(seconds=1)
+        datetime_ = datetime(2026, 1, 1, 12, 0, tzinfo=pytz.UTC)
+
+        def event(status, offset):
+            return {'type': CrabEvent.FINISH, 'status': status,
+                    'datetime': datetime_ + offset * second}
+
+        service.add_event(101, event(CrabStatus.SUCCESS, 0))
+        service.add_event(101, event(CrabStatus.FAIL, 1))
+        service.add_event(102, event(CrabStatus.TIMEOUT, 2))
+        service.add_event(101, event(CrabStatus.FAIL, 3))
+
+        # Alerts should be held until the end of the window.
+        service.process_alerts(datetime_ + 5 * second)
+        self.assertEqual(self.sent, [])
+
+        service.process_alerts(datetime_ + 65 * second)
+        self.assertEqual(len(self.sent), 1)
+        jobs = sorted(self.sent[0], key=lambda x: x.n['notifyid'])
+        self.assertEqual([x.n['notifyid'] for x in jobs], [1, 3])
+        self.assertTrue(all(x.n['skip_ok'] for x in jobs))
+        self.assertEqual(jobs[0].start, datetime_ + second)
+        self.assertEqual(jobs[0].end, datetime_ + 4 * second)
+
+        # Further alerts should wait for the minimum interval.
+        service.add_event(101, event(CrabStatus.MISSED, 100))
+        service.process_alerts(datetime_ + 200 * second)
+        self.assertEqual(len(self.sent), 1)
+
+        service.process_alerts(datetime_ + 665 * second)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(sorted(x.n['address'] for x in self.sent[1]),
+                         ['a', 'b'])
+
+
+class NotifyTestCase(CrabDBTestCase):
+    def test_notify(self):
+        """Test that reports for several groups are sent in parallel."""
+
+        start = datetime(2026, 1, 2, tzinfo=pytz.UTC)
+        end = start + timedelta(days=1)
+
+        self.store.log_events([
+            {'action': 'finish', 'host': 'host1', 'user': 'user1',
+             'crabid': crabid, 'command': 'command',
+             'datetime': start + timedelta(hours=1),
+             'status': status, 'stdout': '', 'stderr': ''}
+            for (crabid, status) in (('job1', CrabStatus.SUCCESS),
+                                     ('job2', CrabStatus.FAIL),
+                                     ('job3', CrabStatus.SUCCESS))])
+
+        ids = [self.store.check_job('host1', 'user1', crabid, 'command')
+               for crabid in ('job1', 'job2', 'job3')]
+
+        smtp = DummySMTP()
+        notify = CrabNotify({
+            'crab': {'home': os.getcwd(), 'base_url': 'http://localhost'},
+            'email': {'server': 'localhost', 'from': 'crab',
+                      'subject_ok': 'OK', 'subject_warning': 'WARNING',
+                      'subject_error': 'ERROR'},
+            'notify': {'threads': 2},
+        }, self.store, smtp)
+
+        notify([
+            CrabNotifyJob(make_notification(1, ids[0], 'a'), start, end),
+            CrabNotifyJob(make_notification(2, ids[1], 'b'), start, end),
+            CrabNotifyJob(make_notification(3, ids[0], 'c'), start, end),
+            CrabNotifyJob(make_notification(3, ids[2], 'c'), start, end),
+        ])
+
+        subjects = {}
+        for (to, message) in smtp.messages:
+            for line in message.splitlines():
+                if line.startswith('Subject:'):
+                    subjects[tuple(to)] = line
+
+        self.assertEqual(sorted(subjects.keys()), [('a',), ('b',), ('c',)])
+        self.assertIn('ERROR', subjects[('b',)])
+        self.assertNotIn('ERROR', subjects[('a',)])
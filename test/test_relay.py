@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from crab.util.spool import CrabSpool
+from crab.server.relay import CrabRelayStore
+
+
+class DummyClient:
+    def __init__(self, directory):
+        self.spool = CrabSpool(directory)
+        self.inhibited = []
+
+    def fetch_inhibited(self):
+        return self.inhibited
+
+
+class RelayStoreTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.client = DummyClient(self.directory)
+        self.store = CrabRelayStore(self.client)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_spool(self):
+        self.assertEqual(self.store.log_start('h', 'u', 'job1', 'cmd'),
+                         {'inhibit': False})
+        self.store.log_finish('h', 'u', 'job1', 'cmd', 0, 'out', '')
+
+        spool = self.client.spool
+        events = [spool.read(x) for x in spool.entries()]
+
+        self.assertEqual([x['action'] for x in events], ['start', 'finish'])
+        self.assertEqual(events[1]['stdout'], 'out')
+        self.assertTrue(all(x['datetime'] for x in events))
+
+    def test_inhibit(self):
+        self.store.record_result(
+            {'action': 'start', 'host': 'h', 'user': 'u',
+             'crabid': 'job1', 'command': 'cmd'},
+            {'inhibit': True})
+
+        self.assertEqual(self.store.log_start('h', 'u', 'job1', 'other'),
+                         {'inhibit': True})
+        self.assertEqual(self.store.log_start('h', 'u', None, 'cmd'),
+                         {'inhibit': False})
+
+        # The cache should be replaced by the list from the server.
+        self.client.inhibited = [
+            {'host': 'h', 'user': 'u', 'crabid': None, 'command': 'cmd'}]
+        self.store.refresh_inhibit()
+
+        self.assertEqual(self.store.log_start('h', 'u', 'job1', 'other'),
+                         {'inhibit': False})
+        self.assertEqual(self.store.log_start('h', 'u', None, 'cmd'),
+                         {'inhibit': True})
+        self.assertEqual(self.store.get_inhibited_jobs(),
+                         self.client.inhibited)
+
+        # A forwarded start result should update the cache.
+        self.store.record_result(
+            {'action': 'start', 'host': 'h', 'user': 'u',
+             'crabid': None, 'command': 'cmd'},
+            {'inhibit': False})
+
+        self.assertEqual(self.store.log_start('h', 'u', None, 'cmd'),
+                         {'inhibit': False})
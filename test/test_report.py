@@ -0,0 +1,128 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+import os
+
+import pytz
+
+from crab import CrabStatus
+from crab.report import CrabReportGenerator, CrabReportJob
+from crab.report.html import report_to_html
+from crab.report.text import report_to_text
+
+from . import CrabDBTestCase
+
+
+class ReportTestCase(CrabDBTestCase):
+    def test_report(self):
+        """Test that reports are generated from bulk queries."""
+
+        start = datetime(2026, 1, 2, tzinfo=pytz.UTC)
+        end = start + timedelta(days=1)
+        events = []
+
+        for (n, status) in enumerate((CrabStatus.SUCCESS, CrabStatus.FAIL,
+                                      CrabStatus.WARNING)):
+            crabid = 'job{0}'.format(n)
+
+            for (offset, output) in ((1, 'inside'), (25, 'outside')):
+                events.append({
+                    'action': 'finish', 'host': 'host1', 'user': 'user1',
+                    'crabid': crabid, 'command': 'command',
+                    'datetime': start + timedelta(hours=offset),
+                    'status': status, 'stdout': crabid + output,
+                    'stderr': ''})
+
+        self.store.log_events(events)
+
+        ids = [self.store.check_job('host1', 'user1', 'job{0}'.format(n),
+                                    'command') for n in range(3)]
+
+        calls = []
+
+        def record(method):
+            original = getattr(self.store, method)
+
+            def wrapper(*args, **kwargs):
+                calls.append(method)
+                return original(*args, **kwargs)
+
+            setattr(self.store, method, wrapper)
+
+        for method in ('get_job_info', 'get_job_events', 'get_job_output',
+                       'get_jobs_info', 'get_jobs_events', 'get_job_outputs'):
+            record(method)
+
+        report = CrabReportGenerator(self.store)
+        jobs = [CrabReportJob(id_, start, end, False, False, False, True)
+                for id_ in ids]
+        skip_ok = [CrabReportJob(id_, start, end, True, False, False, False)
+                   for id_ in ids]
+
+        report.prefetch(jobs + skip_ok)
+        self.assertEqual(sorted(calls), [
+            'get_job_outputs', 'get_jobs_events', 'get_jobs_info'])
+
+        result = report(jobs)
+        self.assertEqual(result.num, 3)
+        self.assertEqual(result.ok, set([ids[0]]))
+        self.assertEqual(result.error, set([ids[1]]))
+        self.assertEqual(result.warning, set([ids[2]]))
+        self.assertEqual(sorted(result.stdout.values()),
+                         ['job0inside', 'job1inside', 'job2inside'])
+        self.assertEqual(result.info[ids[0]]['title'], 'job0')
+
+        result = report(skip_ok)
+        self.assertEqual(result.num, 2)
+        self.assertEqual(result.stdout, {})
+
+        # No further queries should have been required.
+        self.assertEqual(len(calls), 3)
+
+    def test_render_cache(self):
+        """Test that rendered job sections are reused between reports."""
+
+        start = datetime(2026, 1, 2, tzinfo=pytz.UTC)
+        end = start + timedelta(days=1)
+
+        self.store.log_events([{
+            'action': 'finish', 'host': 'host1', 'user': 'user1',
+            'crabid': 'job{0}'.format(n), 'command': 'command',
+            'datetime': start + timedelta(hours=1),
+            'status': CrabStatus.FAIL, 'stdout': 'output', 'stderr': ''}
+            for n in range(2)])
+
+        ids = [self.store.check_job('host1', 'user1', 'job{0}'.format(n),
+                                    'command') for n in range(2)]
+
+        report = CrabReportGenerator(self.store)
+        both = report([CrabReportJob(id_, start, end, False, False, False,
+                                     True) for id_ in ids])
+        first = report([CrabReportJob(ids[0], start, end, False, False,
+                                      False, True)])
+
+        cache = {}
+        text = report_to_text(both, cache=cache)
+        html = report_to_html(both, os.getcwd(), 'http://crab/', cache=cache)
+        self.assertEqual(len(cache), 4)
+
+        self.assertEqual(report_to_text(both), text)
+        self.assertEqual(
+            report_to_html(both, os.getcwd(), 'http://crab/'), html)
+
+        report_to_text(first, cache=cache)
+        report_to_html(first, os.getcwd(), 'http://crab/', cache=cache)
+        self.assertEqual(len(cache), 4)
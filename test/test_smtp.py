@@ -0,0 +1,140 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+import tempfile
+from threading import Thread
+import time
+from unittest import TestCase
+
+from crab.notify.smtp import CrabSMTPService
+
+
+class DummySMTPHandler(StreamRequestHandler):
+    """Minimal SMTP server session, recording the messages received."""
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self._reply('220 dummy')
+        data = None
+
+        for line in self.rfile:
+            line = line.decode('ascii').rstrip('\r\n')
+
+            if data is not None:
+                if line == '.':
+                    if server.reject:
+                        server.reject -= 1
+                        self._reply('451 try again later')
+                    else:
+                        server.messages.append('\n'.join(data))
+                        self._reply('250 ok')
+                    data = None
+                else:
+                    data.append(line)
+                continue
+
+            command = line[:4].upper()
+
+            if command == 'DATA':
+                data = []
+                self._reply('354 go ahead')
+            elif command == 'QUIT':
+                self._reply('221 bye')
+                break
+            else:
+                self._reply('250 ok')
+
+    def _reply(self, line):
+        self.wfile.write((line + '\r\n').encode('ascii'))
+
+
+class SMTPServiceTestCase(TestCase):
+    def setUp(self):
+        ThreadingTCPServer.allow_reuse_address = True
+        self.server = ThreadingTCPServer(('127.0.0.1', 0), DummySMTPHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.messages = []
+        self.server.reject = 0
+
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.dir = tempfile.mkdtemp()
+        self.config = {
+            'server': '127.0.0.1:{0}'.format(self.server.server_address[1]),
+            'workers': 1,
+            'retry_delay': 0.1,
+            'outbox': os.path.join(self.dir, 'outbox'),
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def _wait_for(self, n):
+        for i in range(100):
+            if len(self.server.messages) >= n:
+                break
+            time.sleep(0.05)
+
+    def test_delivery(self):
+        service = CrabSMTPService(self.config)
+        service.start()
+
+        try:
+            # Messages should be sent on a single connection.
+            service.send('crab', ['a@example.com'], 'Subject: 1\n\nOne')
+            service.send('crab', ['b@example.com'], 'Subject: 2\n\nTwo')
+            self._wait_for(2)
+            self.assertEqual(len(self.server.messages), 2)
+            self.assertEqual(self.server.connections, 1)
+
+            # A rejected message should be retried.
+            self.server.reject = 1
+            service.send('crab', ['c@example.com'], 'Subject: 3\n\nThree')
+            self._wait_for(3)
+            self.assertEqual(len(self.server.messages), 3)
+            self.assertIn('Three', self.server.messages[2])
+
+        finally:
+            service.stop()
+
+        self.assertEqual(service.outbox.entries(), [])
+
+    def test_outbox(self):
+        # Messages not sent before the service stops should be
+        # delivered by a new service using the same outbox.
+        service = CrabSMTPService(self.config)
+        service.send('crab', ['a@example.com'], 'Subject: 1\n\nOne')
+        self.assertEqual(len(service.outbox.entries()), 1)
+
+        service = CrabSMTPService(self.config)
+        service.start()
+
+        try:
+            self._wait_for(1)
+            self.assertEqual(len(self.server.messages), 1)
+
+        finally:
+            service.stop()
+
+        self.assertEqual(service.outbox.entries(), [])
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from crab.util.spool import CrabSpool
+
+
+class SpoolTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = CrabSpool(os.path.join(self.directory, 'spool'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_spool(self):
+        self.assertEqual(self.spool.entries(), [])
+
+        for i in range(3):
+            self.spool.add({'action': 'start', 'number': i})
+
+        names = self.spool.entries()
+        self.assertEqual(len(names), 3)
+        self.assertEqual([self.spool.read(x)['number'] for x in names],
+                         [0, 1, 2])
+        self.assertTrue(0.0 <= self.spool.age(names[0]) < 60.0)
+
+        self.spool.remove(names[0])
+        self.assertEqual(self.spool.entries(), names[1:])
+
+        # Removing an event a second time should not be an error.
+        self.spool.remove(names[0])
+
+    def test_lock(self):
+        lock = self.spool.lock()
+        self.assertIsNotNone(lock)
+
+        # A second attempt should fail while the first holds the lock.
+        other = CrabSpool(self.spool.directory)
+        self.assertIsNone(other.lock())
+
+        lock.close()
+
+        lock = other.lock()
+        self.assertIsNotNone(lock)
+        lock.close()
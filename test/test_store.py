@@ -1,3 +1,11 @@
+from datetime import date, datetime, timedelta
+
+import pytz
+
+from crab import CrabEvent, CrabStatus
+from crab.store import CrabJobIndex
+import crab.store.db
+
 from . import CrabDBTestCase
 
 
@@ -37,3 +45,421 @@ class JobIdentifyTestCase(CrabDBTestCase):
 
         id_ = self.store.check_job('host1', 'user1', 'crabid3', 'command4')
         self.assertEqual(id_, 7, 'New ID should create  another new job')
+
+
+class LiveOutputTestCase(CrabDBTestCase):
+    def test_live_output(self):
+        """Test that live output is appended and later discarded."""
+
+        self.store.log_start('host1', 'user1', 'job1', 'command1')
+        id_ = self.store.check_job('host1', 'user1', 'job1', 'command1')
+
+        self.assertEqual(self.store.get_live_output('host1', 'user1', id_),
+                         ('', ''))
+
+        self.store.log_output('host1', 'user1', 'job1', 'command1',
+                              'out 1\n', '')
+        self.store.log_output('host1', 'user1', 'job1', 'command1',
+                              'out 2\n', 'err 2\n')
+
+        self.assertEqual(self.store.get_live_output('host1', 'user1', id_),
+                         ('out 1\nout 2\n', 'err 2\n'))
+
+        self.store.log_finish('host1', 'user1', 'job1', 'command1', 0,
+                              'out 1\nout 2\n', 'err 2\n')
+
+        self.assertEqual(self.store.get_live_output('host1', 'user1', id_),
+                         ('', ''))
+
+    def test_live_output_not_written(self):
+        """Test that live output is only cleared if it was written."""
+
+        cleared = []
+        clear_live_output = self.store.clear_live_output
+
+        def wrapper(*args):
+            cleared.append(args)
+            return clear_live_output(*args)
+
+        self.store.clear_live_output = wrapper
+
+        self.store.log_start('host1', 'user1', 'job1', 'command1')
+        self.store.log_finish('host1', 'user1', 'job1', 'command1', 0)
+        self.assertEqual(cleared, [])
+
+        self.store.log_start('host1', 'user1', 'job1', 'command1')
+        self.store.log_output('host1', 'user1', 'job1', 'command1',
+                              'out 1\n', '')
+        self.store.log_finish('host1', 'user1', 'job1', 'command1', 0)
+        self.assertEqual(len(cleared), 1)
+
+    def test_live_output_clean(self):
+        """Test that live output of jobs which did not finish is
+        deleted with old events."""
+
+        start = datetime(2026, 1, 2, 3, 4, 5, tzinfo=pytz.UTC)
+
+        self.store.log_start('host1', 'user1', 'job1', 'command1', start)
+        self.store.log_output('host1', 'user1', 'job1', 'command1',
+                              'out 1\n', '')
+        self.store.log_start('host1', 'user1', 'job2', 'command2')
+        self.store.log_output('host1', 'user1', 'job2', 'command2',
+                              'out 2\n', '')
+
+        id1 = self.store.check_job('host1', 'user1', 'job1', 'command1')
+        id2 = self.store.check_job('host1', 'user1', 'job2', 'command2')
+
+        self.store.delete_old_events(start + timedelta(days=1))
+
+        self.assertEqual(self.store.get_live_output('host1', 'user1', id1),
+                         ('', ''))
+        self.assertEqual(self.store.get_live_output('host1', 'user1', id2),
+                         ('out 2\n', ''))
+        self.assertEqual(self.store.get_live_output_jobs(), set((id2,)))
+
+    def test_live_output_limit(self):
+        """Test that only the most recent live output is kept."""
+
+        self.store.log_start('host1', 'user1', 'job1', 'command1')
+        id_ = self.store.check_job('host1', 'user1', 'job1', 'command1')
+
+        size = crab.store.db.LIVE_OUTPUT_SIZE
+        crab.store.db.LIVE_OUTPUT_SIZE = 12
+
+        try:
+            for i in range(5):
+                self.store.log_output('host1', 'user1', 'job1', 'command1',
+                                      'out {0}\n'.format(i), '')
+
+            self.assertEqual(
+                self.store.get_live_output('host1', 'user1', id_),
+                ('out 3\nout 4\n', ''))
+
+            with self.store.lock as c:
+                c.execute('SELECT COUNT(*) FROM joblive WHERE jobid=?', [id_])
+                self.assertEqual(c.fetchone()[0], 2)
+
+        finally:
+            crab.store.db.LIVE_OUTPUT_SIZE = size
+
+
+class LogEventsTestCase(CrabDBTestCase):
+    def test_log_events(self):
+        """Test logging of a batch of events with given datetimes."""
+
+        start = datetime(2026, 1, 2, 3, 4, 5, tzinfo=pytz.UTC)
+        finish = datetime(2026, 1, 2, 3, 5, 0, tzinfo=pytz.UTC)
+
+        results = self.store.log_events([
+            {'action': 'start', 'host': 'host1', 'user': 'user1',
+             'crabid': 'job1', 'command': 'command1', 'datetime': start},
+            {'action': 'finish', 'host': 'host1', 'user': 'user1',
+             'crabid': 'job1', 'command': 'command1', 'datetime': finish,
+             'status': 0, 'stdout': 'output', 'stderr': ''},
+        ])
+
+        self.assertEqual(results, [{'inhibit': False}, {}])
+
+        id_ = self.store.check_job('host1', 'user1', 'job1', 'command1')
+        events = self.store.get_job_events(id_)
+
+        self.assertEqual([(x['type'], x['datetime']) for x in events],
+                         [(CrabEvent.FINISH, finish),
+                          (CrabEvent.START, start)])
+
+        finishid = self.store.get_job_finishes(id_)[0]['finishid']
+        self.assertEqual(self.store.get_job_output(
+            finishid, 'host1', 'user1', id_, 'job1'), ('output', ''))
+
+    def test_log_events_live_output(self):
+        """Test that replaying an old finish keeps the live output
+        of the job's current run."""
+
+        start = datetime(2026, 1, 2, 3, 4, 5, tzinfo=pytz.UTC)
+        finish = datetime(2026, 1, 2, 3, 5, 0, tzinfo=pytz.UTC)
+
+        self.store.log_start('host1', 'user1', 'job1', 'command1',
+                             start + timedelta(hours=1))
+        self.store.log_output('host1', 'user1', 'job1', 'command1',
+                              'out 1\n', '')
+        id_ = self.store.check_job('host1', 'user1', 'job1', 'command1')
+
+        self.store.log_events([
+            {'action': 'finish', 'host': 'host1', 'user': 'user1',
+             'crabid': 'job1', 'command': 'command1', 'datetime': finish,
+             'status': 0, 'stdout': '', 'stderr': ''},
+        ])
+
+        self.assertEqual(self.store.get_live_output('host1', 'user1', id_),
+                         ('out 1\n', ''))
+
+        self.store.log_events([
+            {'action': 'finish', 'host': 'host1', 'user': 'user1',
+             'crabid': 'job1', 'command': 'command1',
+             'datetime': start + timedelta(hours=2),
+             'status': 0, 'stdout': '', 'stderr': ''},
+        ])
+
+        self.assertEqual(self.store.get_live_output('host1', 'user1', id_),
+                         ('', ''))
+
+
+class SaveCrontabTestCase(CrabDBTestCase):
+    def test_save_crontab(self):
+        """Test that only changed jobs are written when saving a crontab."""
+
+        crontab = [
+            '0 * * * * CRABID=job1 command1',
+            '5 * * * * command2',
+            '10 * * * * command3',
+        ]
+
+        self.assertEqual(self.store.save_crontab('host1', 'user1', crontab),
+                         [])
+
+        jobs = self.store.get_jobs('host1', 'user1')
+        self.assertEqual(sorted(x['command'] for x in jobs),
+                         ['command1', 'command2', 'command3'])
+        ids = dict((x['command'], x['id']) for x in jobs)
+
+        # Saving the same crontab again should not write to the database.
+        writes = []
+
+        def record(method):
+            original = getattr(self.store, method)
+
+            def wrapper(*args):
+                writes.append(method)
+                return original(*args)
+
+            setattr(self.store, method, wrapper)
+
+        for method in ('_insert_job', '_update_job', '_delete_job',
+                       '_write_raw_crontab'):
+            record(method)
+
+        self.store.save_crontab('host1', 'user1', crontab)
+        self.assertEqual(writes, [])
+
+        # Change one job, remove another and add a third.
+        crontab[0] = '1 * * * * CRABID=job1 command1'
+        crontab[2] = '15 * * * * command4'
+
+        self.store.save_crontab('host1', 'user1', crontab)
+        self.assertEqual(sorted(writes), [
+            '_delete_job', '_insert_job', '_update_job',
+            '_write_raw_crontab'])
+
+        jobs = dict((x['command'], x) for x in
+                    self.store.get_jobs('host1', 'user1'))
+        self.assertEqual(sorted(jobs.keys()),
+                         ['command1', 'command2', 'command4'])
+        self.assertEqual(jobs['command1']['id'], ids['command1'])
+        self.assertEqual(jobs['command1']['time'], '1 * * * *')
+        self.assertEqual(jobs['command2']['id'], ids['command2'])
+
+    def test_job_index_case(self):
+        """Test matching of job identifiers differing only in case."""
+
+        jobs = [
+            {'id': 1, 'crabid': 'Job1', 'command': 'command1'},
+            {'id': 2, 'crabid': None, 'command': 'command2'},
+        ]
+
+        # The index should match case-insensitively by default, as MySQL
+        # does, so that a job can not be inserted twice.
+        index = CrabJobIndex(jobs)
+        self.assertEqual([x['id'] for x in index.find(crabid='job1')], [1])
+        self.assertEqual([x['id'] for x in index.find(crabid='JOB1')], [1])
+        self.assertEqual(index.find(crabid='job2'), [])
+
+        index = CrabJobIndex(jobs, case_sensitive=True)
+        self.assertEqual(index.find(crabid='job1'), [])
+        self.assertEqual([x['id'] for x in index.find(crabid='Job1')], [1])
+
+        # The index should behave as the SQLite database does.
+        self.assertTrue(self.store.crabid_case_sensitive)
+        self.store.save_crontab('host1', 'user1', ['0 * * * * CRABID=Job1 a'])
+        self.store.save_crontab('host1', 'user1', ['0 * * * * CRABID=job1 a'])
+        self.assertEqual(
+            [x['crabid'] for x in self.store.get_jobs('host1', 'user1')],
+            ['job1'])
+
+
+    def test_inhibited_jobs(self):
+        """Test listing of inhibited jobs."""
+
+        self.store.save_crontab('host1', 'user1', [
+            '0 * * * * CRABID=job1 command1',
+            '5 * * * * command2',
+        ])
+
+        id1 = self.store.check_job('host1', 'user1', 'job1', 'command1')
+        id2 = self.store.check_job('host1', 'user1', None, 'command2')
+
+        self.assertEqual(self.store.get_inhibited_jobs(), [])
+
+        self.store.write_job_config(id1, inhibit=True)
+        self.store.write_job_config(id2, inhibit=False)
+
+        self.assertEqual(self.store.get_inhibited_jobs(), [
+            {'host': 'host1', 'user': 'user1', 'crabid': 'job1',
+             'command': 'command1'}])
+
+        self.store.disable_inhibit(id1)
+        self.assertEqual(self.store.get_inhibited_jobs(), [])
+
+
+class NotificationTestCase(CrabDBTestCase):
+    def test_get_notifications(self):
+        self.store.save_crontab('host1', 'user1', [
+            'CRON_TZ=Europe/London',
+            '0 * * * * CRABID=job1 command1'])
+        self.store.save_crontab('host1', 'user2', ['0 * * * * command2'])
+        self.store.save_crontab('host2', 'user1', ['0 * * * * command3'])
+
+        ids = dict((x['command'], x['id']) for x in self.store.get_jobs())
+        configid = self.store.write_job_config(ids['command2'])
+
+        version = self.store.notification_version
+
+        for (configid, host, user, address) in (
+                (configid, None, None, 'a'),
+                (None, 'host1', None, 'b'),
+                (None, None, 'user1', 'c'),
+                (None, 'host1', 'user1', 'd'),
+                (None, None, None, 'e')):
+            self.store.write_notification(
+                None, configid, host, user, 'email', address,
+                None, None, False, False, False, False)
+
+        self.assertGreater(self.store.notification_version, version)
+
+        notifications = self.store.get_notifications()
+        found = {}
+        for notification in notifications:
+            found.setdefault(notification['address'], set()).add(
+                notification['id'])
+
+        self.assertEqual(found, {
+            'a': set([ids['command2']]),
+            'b': set([ids['command1'], ids['command2']]),
+            'c': set([ids['command1'], ids['command3']]),
+            'd': set([ids['command1']]),
+            'e': set(ids.values()),
+        })
+
+        # The job's timezone should be used if the notification has none.
+        for notification in notifications:
+            if notification['id'] == ids['command1']:
+                self.assertEqual(notification['timezone'], 'Europe/London')
+
+        # Deleted jobs should not be included.
+        version = self.store.notification_version
+        self.store.delete_job(ids['command1'])
+        self.assertGreater(self.store.notification_version, version)
+        self.assertNotIn(ids['command1'], set(
+            x['id'] for x in self.store.get_notifications()))
+
+
+class JobStatsTestCase(CrabDBTestCase):
+    def test_job_stats(self):
+        start = datetime(2026, 3, 1, 12, 0, tzinfo=pytz.UTC)
+        events = []
+
+        for (day, duration, status) in (
+                (0, 60, CrabStatus.SUCCESS),
+                (0, 180, CrabStatus.FAIL),
+                (1, 120, CrabStatus.WARNING),
+                (2, None, CrabStatus.SUCCESS)):
+            datetime_ = start + timedelta(days=day, hours=len(events))
+
+            if duration is not None:
+                events.append({
+                    'action': 'start', 'host': 'host1', 'user': 'user1',
+                    'crabid': 'job1', 'command': 'command1',
+                    'datetime': datetime_})
+
+            events.append({
+                'action': 'finish', 'host': 'host1', 'user': 'user1',
+                'crabid': 'job1', 'command': 'command1',
+                'datetime': datetime_ + timedelta(seconds=duration or 0),
+                'status': status, 'stdout': '', 'stderr': ''})
+
+        self.store.log_events(events)
+
+        id_ = self.store.check_job('host1', 'user1', 'job1', 'command1')
+        self.store.log_alarm(id_, CrabStatus.MISSED)
+        self.store.log_alarm(id_, CrabStatus.CLEARED)
+
+        expect = {
+            'runs': 4, 'success': 2, 'warning': 1, 'fail': 1,
+            'late': 0, 'missed': 1, 'timeout': 0,
+            'duration_count': 3, 'duration_total': 360,
+            'duration_min': 60, 'duration_avg': 120, 'duration_max': 180,
+            'reliability': 40}
+
+        self.assertEqual(self.store.get_jobs_stats([id_]), {id_: expect})
+
+        # Finishes should be paired with their starts.
+        self.assertEqual(
+            [x['duration'] for x in self.store.get_job_events(id_)
+             if x['type'] == CrabEvent.FINISH],
+            [None, 120, 180, 60])
+
+        histogram = self.store.get_jobs_histograms([id_])[id_]
+        self.assertEqual(histogram.total, 3)
+        self.assertAlmostEqual(histogram.percentile(50), 120, delta=24)
+
+        # Statistics should be recalculated identically from the events,
+        # including durations not already recorded.
+        self.store.lock.conn.execute(
+            'UPDATE jobfinish SET startid=NULL, duration=NULL')
+        self.assertEqual(self.store.rebuild_job_stats(), 1)
+        self.assertEqual(self.store.get_jobs_stats([id_]), {id_: expect})
+        self.assertEqual(
+            self.store.get_jobs_histograms([id_])[id_].counts,
+            histogram.counts)
+        self.assertEqual(
+            [x['duration'] for x in self.store.get_job_events(id_)
+             if x['type'] == CrabEvent.FINISH],
+            [None, 120, 180, 60])
+
+        stats = self.store.get_jobs_stats(
+            [id_], start=date(2026, 3, 2), end=date(2026, 3, 3))[id_]
+        self.assertEqual(stats['runs'], 1)
+        self.assertEqual(stats['warning'], 1)
+        self.assertEqual(stats['duration_avg'], 120)
+        self.assertEqual(stats['reliability'], 0)
+
+        # Statistics should be kept when old events are removed.
+        self.store.delete_old_events(datetime(2026, 3, 2, tzinfo=pytz.UTC))
+        self.assertEqual(self.store.get_jobs_stats([id_]), {id_: expect})
+
+    def test_job_stats_race(self):
+        """Test that a statistics row inserted by another server
+        between the update and insert is updated instead."""
+
+        id_ = self.store.check_job('host1', 'user1', 'job1', 'command1')
+        datetime_ = datetime(2026, 3, 1, 12, 0, tzinfo=pytz.UTC)
+
+        class RacingCursor:
+            def __init__(self, cursor):
+                self.cursor = cursor
+                self.rowcount = None
+
+            def execute(self, query, params):
+                self.cursor.execute(query, params)
+                self.rowcount = self.cursor.rowcount
+
+                if query.startswith('UPDATE jobstats') and self.rowcount < 1:
+                    self.cursor.execute(
+                        'INSERT INTO jobstats (jobid, day, runs) '
+                        'VALUES (?, ?, 1)', [id_, '2026-03-01'])
+
+        with self.store.lock as c:
+            self.store._update_job_stats(
+                RacingCursor(c), id_, datetime_, {'runs': 1})
+
+        self.assertEqual(
+            self.store.get_jobs_stats([id_])[id_]['runs'], 2)
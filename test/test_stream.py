@@ -0,0 +1,136 @@
+from json import loads
+import socket
+from threading import Event
+from unittest import TestCase
+
+from crab.service.monitor import CrabJobStatus, CrabStatusSnapshot
+from crab.web.stream import CrabStreamService, _status_delta
+
+
+def _job_status(status, running, reliability, scheduled):
+    return CrabJobStatus(status, running, reliability, scheduled, None, ())
+
+
+class DummyMonitor:
+    def __init__(self):
+        self.status_ready = Event()
+        self.status_ready.set()
+        self.snapshot = CrabStatusSnapshot(1, 0, 1, {
+            1: _job_status(0, False, 100, True),
+            2: _job_status(1, True, 50, False),
+        }, 0, 1)
+
+
+class StreamTestCase(TestCase):
+    def test_delta(self):
+        (changed, removed) = _status_delta({}, {1: (0,)})
+        self.assertEqual(changed, [1])
+        self.assertEqual(removed, [])
+
+        (changed, removed) = _status_delta(
+            {1: (0, False), 2: (1, False)}, {1: (0, False), 2: (1, True)})
+        self.assertEqual(changed, [2])
+        self.assertEqual(removed, [])
+
+        (changed, removed) = _status_delta({1: (0,), 2: (0,)}, {2: (0,)})
+        self.assertEqual(changed, [])
+        self.assertEqual(removed, [1])
+
+    def test_stream(self):
+        monitor = DummyMonitor()
+        stream = CrabStreamService(
+            {'host': '127.0.0.1', 'port': 0}, monitor, {})
+        stream.daemon = True
+        stream.start()
+        self.assertTrue(stream.ready.wait(10))
+
+        sock = socket.create_connection(('127.0.0.1', stream.port), 10)
+        sock.sendall(b'GET /jobstatus HTTP/1.1\r\nHost: test\r\n\r\n')
+
+        (header, message, rest) = self._read_event(sock, b'')
+
+        self.assertTrue(header.startswith(b'HTTP/1.1 200'))
+        self.assertIn(b'text/event-stream', header)
+        self.assertTrue(message['full'])
+        self.assertEqual(sorted(message['status'].keys()), ['1', '2'])
+        self.assertEqual(message['status']['2']['running'], True)
+
+        # Alter the status and check that only the difference is sent.
+        monitor.snapshot = CrabStatusSnapshot(1, 0, 2, {
+            1: _job_status(1, False, 100, True),
+        }, 0, 1)
+
+        (_, message, rest) = self._read_event(sock, rest)
+
+        self.assertFalse(message['full'])
+        self.assertEqual(list(message['status'].keys()), ['1'])
+        self.assertEqual(message['status']['1']['status'], 1)
+        self.assertEqual(message['removed'], [2])
+
+        sock.close()
+
+    def test_origin(self):
+        stream = CrabStreamService({'port': 0}, DummyMonitor(), {})
+        self.assertEqual(stream.host, '127.0.0.1')
+
+        self.assertTrue(stream._check_origin(
+            b'http://crab.example.com:8000', b'crab.example.com:8001'))
+        self.assertFalse(stream._check_origin(
+            b'http://other.example.com', b'crab.example.com:8001'))
+        self.assertFalse(stream._check_origin(
+            b'http://crab.example.com:8000', None))
+
+        stream = CrabStreamService({
+            'port': 0,
+            'allow_origin': 'http://crab.example.com:8000/',
+        }, DummyMonitor(), {})
+
+        self.assertTrue(stream._check_origin(
+            b'http://crab.example.com:8000', b'localhost:8001'))
+        self.assertFalse(stream._check_origin(
+            b'http://crab.example.com:8080', b'crab.example.com:8001'))
+
+        stream.daemon = True
+        stream.start()
+        self.assertTrue(stream.ready.wait(10))
+
+        sock = socket.create_connection(('127.0.0.1', stream.port), 10)
+        sock.sendall(b'GET /jobstatus HTTP/1.1\r\nHost: localhost\r\n'
+                     b'Origin: http://other.example.com\r\n\r\n')
+        self.assertTrue(sock.recv(4096).startswith(b'HTTP/1.0 403'))
+        sock.close()
+
+    def test_not_found(self):
+        stream = CrabStreamService({'port': 0}, DummyMonitor(), {})
+        stream.daemon = True
+        stream.start()
+        self.assertTrue(stream.ready.wait(10))
+
+        sock = socket.create_connection(('127.0.0.1', stream.port), 10)
+        sock.sendall(b'GET /other HTTP/1.1\r\nHost: localhost\r\n\r\n')
+
+        data = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+
+        # The response should be sent and then the connection closed.
+        self.assertTrue(data.startswith(b'HTTP/1.0 404'))
+        sock.close()
+
+        self.assertEqual(stream.clients, {})
+
+    def _read_event(self, sock, data):
+        marker = b'event: status\ndata: '
+
+        while marker not in data or b'\n\n' not in data.split(marker, 1)[1]:
+            chunk = sock.recv(4096)
+            self.assertTrue(chunk)
+            data += chunk
+
+        (before, after) = data.split(marker, 1)
+        (message, after) = after.split(b'\n\n', 1)
+
+        return (before, loads(message.decode('utf-8')), after)
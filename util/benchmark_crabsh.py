@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measures the time taken to run "crabsh -c true".
+
+The Crab client configuration (and server, unless --ignore is given)
+from the environment is used, so the timings include reporting the
+job to the server."""
+
+from __future__ import print_function
+
+from optparse import OptionParser
+import os
+import subprocess
+import sys
+import time
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        '-n',
+        type='int', dest='number', default=20,
+        help='number of times to run crabsh', metavar='NUMBER')
+    parser.add_option(
+        '--crabsh',
+        type='string', dest='crabsh',
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'scripts', 'crabsh'),
+        help='path to the crabsh script', metavar='PATH')
+    parser.add_option(
+        '--ignore',
+        action='store_true', dest='ignore', default=False,
+        help='run with CRABIGNORE set, so the server is not contacted')
+
+    (options, args) = parser.parse_args()
+    if len(args) != 0:
+        parser.error('no arguments required')
+
+    env = dict(os.environ)
+    if options.ignore:
+        env['CRABIGNORE'] = 'yes'
+
+    command = [sys.executable, options.crabsh, '-c', 'true']
+
+    timings = []
+    for i in range(options.number):
+        start = time.time()
+        subprocess.check_call(command, env=env)
+        timings.append(time.time() - start)
+
+    timings.sort()
+
+    print('crabsh -c true: {0} runs, min {1:.1f} ms, '
+          'median {2:.1f} ms, max {3:.1f} ms'.format(
+              len(timings), 1000 * timings[0],
+              1000 * timings[len(timings) // 2], 1000 * timings[-1]))
+
+
+if __name__ == "__main__":
+    main()
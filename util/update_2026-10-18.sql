@@ -0,0 +1,73 @@
+-- This SQL script updates the database to add the tables and columns
+-- introduced since version 0.5.0.  It is written for SQLite:
+-- to apply it to a MySQL database, first convert it using
+-- doc/schema_mysql.sed, as for the main schema.
+--
+-- Backing up the database is recommended before running this script.
+
+CREATE TABLE lease (
+    name VARCHAR(80) NOT NULL PRIMARY KEY,
+    holder VARCHAR(255) NOT NULL,
+    expires TIMESTAMP NOT NULL
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE TABLE joblive (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    stdout TEXT NOT NULL,
+    stderr TEXT NOT NULL,
+
+    FOREIGN KEY (jobid) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE INDEX joblive_jobid ON joblive (jobid);
+
+CREATE TABLE jobstats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    day DATE NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 0,
+    success INTEGER NOT NULL DEFAULT 0,
+    warning INTEGER NOT NULL DEFAULT 0,
+    fail INTEGER NOT NULL DEFAULT 0,
+    late INTEGER NOT NULL DEFAULT 0,
+    missed INTEGER NOT NULL DEFAULT 0,
+    timeout INTEGER NOT NULL DEFAULT 0,
+    duration_count INTEGER NOT NULL DEFAULT 0,
+    duration_total INTEGER NOT NULL DEFAULT 0,
+    duration_min INTEGER DEFAULT NULL,
+    duration_max INTEGER DEFAULT NULL,
+
+    UNIQUE (jobid, day),
+    FOREIGN KEY (jobid) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE INDEX jobstats_day ON jobstats (day);
+
+CREATE INDEX jobstart_jobid_datetime ON jobstart (jobid, datetime);
+CREATE INDEX jobfinish_jobid_datetime ON jobfinish (jobid, datetime);
+
+ALTER TABLE jobfinish ADD COLUMN startid INTEGER DEFAULT NULL;
+ALTER TABLE jobfinish ADD COLUMN duration INTEGER DEFAULT NULL;
+
+CREATE TABLE jobhistogram (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    day DATE NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+
+    UNIQUE (jobid, day, bucket),
+    FOREIGN KEY (jobid) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+)
+-- MySQL: ENGINE=InnoDB
+;